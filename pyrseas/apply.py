@@ -0,0 +1,567 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.apply
+    ~~~~~~~~~~~~~
+
+    Executors that apply the list of SQL statements (the migration
+    plan) generated by `Database.diff_map` to a database.  The
+    `Executor` sends each statement separately, the `BatchExecutor`
+    sends several statements per round trip and the
+    `LockAwareExecutor` avoids queueing behind conflicting locks.
+"""
+import os
+import re
+import time
+
+from psycopg2 import DatabaseError
+
+from pyrseas.lib.compress import file_codec
+from pyrseas.lib.progress import CopyProgress
+from pyrseas.plan import LOCK_MODES, StatementInfo, stmt_text
+
+SAVEPOINT = 'pyrseas_batch'
+STMT_SAVEPOINT = 'pyrseas_stmt'
+
+LOCK_NOT_AVAILABLE = '55P03'
+
+LOCK_CONFLICTS = {
+    'ACCESS SHARE': ['ACCESS EXCLUSIVE'],
+    'ROW SHARE': ['EXCLUSIVE', 'ACCESS EXCLUSIVE'],
+    'ROW EXCLUSIVE': ['SHARE', 'SHARE ROW EXCLUSIVE', 'EXCLUSIVE',
+                      'ACCESS EXCLUSIVE'],
+    'SHARE UPDATE EXCLUSIVE': ['SHARE UPDATE EXCLUSIVE', 'SHARE',
+                               'SHARE ROW EXCLUSIVE', 'EXCLUSIVE',
+                               'ACCESS EXCLUSIVE'],
+    'SHARE': ['ROW EXCLUSIVE', 'SHARE UPDATE EXCLUSIVE',
+              'SHARE ROW EXCLUSIVE', 'EXCLUSIVE', 'ACCESS EXCLUSIVE'],
+    'SHARE ROW EXCLUSIVE': ['ROW EXCLUSIVE', 'SHARE UPDATE EXCLUSIVE',
+                            'SHARE', 'SHARE ROW EXCLUSIVE', 'EXCLUSIVE',
+                            'ACCESS EXCLUSIVE'],
+    'EXCLUSIVE': LOCK_MODES[1:],
+    'ACCESS EXCLUSIVE': LOCK_MODES}
+"""Table-level lock modes that conflict with each mode"""
+
+CONFLICTING_HOLDERS = \
+    """SELECT l.pid, l.mode, l.granted, {state} AS state,
+              extract(epoch FROM now() - a.xact_start) AS xact_age,
+              a.{query} AS query,
+              ARRAY(SELECT m.mode FROM pg_locks m
+                    WHERE m.locktype = 'relation'
+                      AND m.relation = l.relation
+                      AND m.pid = pg_backend_pid() AND m.granted)
+                  AS own_modes
+       FROM pg_locks l JOIN pg_stat_activity a ON (a.{pid} = l.pid)
+       WHERE l.locktype = 'relation' AND l.mode = ANY(%(modes)s)
+         AND l.pid <> pg_backend_pid()
+         AND l.relation = (
+             SELECT c.oid FROM pg_class c
+                    JOIN pg_namespace n ON (c.relnamespace = n.oid)
+             WHERE c.relname = %(name)s
+               AND CASE WHEN %(schema)s IS NULL
+                        THEN pg_table_is_visible(c.oid)
+                        ELSE n.nspname = %(schema)s END)
+       ORDER BY a.xact_start"""
+"""Query for the sessions holding or awaiting conflicting locks on a
+table, with the modes this session already holds on it"""
+
+QUOTED_NAME = re.compile(r'^(?:("(?:[^"]|"")+"|[^".]+)\.)?'
+                         r'("(?:[^"]|"")+"|[^".]+)$')
+
+
+def copy_file(dbconn, stmt, callback=None):
+    """Load a data file as described by a `\\copy` tuple
+
+    :param dbconn: a DbConnection object
+    :param stmt: tuple of `\\copy`, table, from, path and format
+    :param callback: function called with periodic progress messages
+    :return: dictionary with table, rows, bytes and seconds
+    """
+    fmt = stmt[4].strip("' ")
+    path = stmt[3]
+    progress = CopyProgress(
+        stmt[1].split(' (')[0], callback=callback,
+        total_bytes=None if file_codec(path) else os.path.getsize(path))
+    dbconn.sql_copy_from("COPY %s FROM STDIN WITH (FORMAT %s)" % (
+        stmt[1], fmt), path, fmt == 'binary', progress)
+    return progress.result()
+
+
+class StatementError(Exception):
+    """An error raised by a statement of the plan"""
+
+    def __init__(self, index, stmt, error):
+        """Initialize the error
+
+        :param index: position of the statement in the plan (from 1)
+        :param stmt: the statement
+        :param error: the exception raised by the database
+        """
+        self.index = index
+        self.stmt = stmt
+        self.error = error
+        super(StatementError, self).__init__(str(self))
+
+    def __str__(self):
+        return "Statement %d failed: %s\n%s" % (self.index,
+                                                stmt_text(self.stmt),
+                                                str(self.error).rstrip())
+
+
+def batches(stmts, size, alone=None):
+    """Group the statements of a plan in batches
+
+    :param stmts: list of SQL statements or `\\copy` tuples
+    :param size: maximum number of statements in a batch
+    :param alone: function returning True for statements to be
+        executed by themselves
+    :return: generator of lists of (index, statement) pairs
+
+    A `\\copy` tuple is always in a batch by itself.
+    """
+    batch = []
+    for (i, stmt) in enumerate(stmts):
+        if isinstance(stmt, tuple) or (alone is not None and alone(stmt)):
+            if batch:
+                yield batch
+                batch = []
+            yield [(i + 1, stmt)]
+            continue
+        batch.append((i + 1, stmt))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Executor(object):
+    """Apply statements to a database, one at a time"""
+
+    def __init__(self, dbconn):
+        """Initialize the executor
+
+        :param dbconn: a DbConnection
+
+        The `progress` attribute can be set to a function to be
+        called with periodic progress messages while loading data
+        files.  The totals of each file loaded are appended to
+        `loads`.  The `begin` attribute can be set to a function to
+        be called in the transaction before the statements, e.g., to
+        check that the catalogs have not changed.
+        """
+        self.dbconn = dbconn
+        self.progress = None
+        self.begin = None
+        self.loads = []
+
+    def load(self, stmt):
+        """Load a data file as described by a `\\copy` tuple
+
+        :param stmt: the `\\copy` tuple
+        """
+        self.loads.append(copy_file(self.dbconn, stmt, self.progress))
+
+    def cursor(self):
+        """Return a cursor, connecting to the database if needed
+
+        :return: cursor
+
+        Unlike `DbConnection.execute`, errors raised when using this
+        cursor do not roll back the transaction, so that the executor
+        can recover from them.
+        """
+        if self.dbconn.conn is None or self.dbconn.conn.closed:
+            self.dbconn.connect()
+        return self.dbconn.conn.cursor()
+
+    def execute_one(self, index, stmt):
+        """Execute a single statement of the plan
+
+        :param index: position of the statement in the plan
+        :param stmt: SQL statement or `\\copy` tuple
+        """
+        try:
+            if isinstance(stmt, tuple):
+                self.load(stmt)
+            else:
+                curs = self.cursor()
+                try:
+                    curs.execute(stmt)
+                finally:
+                    curs.close()
+        except DatabaseError as exc:
+            raise StatementError(index, stmt, exc)
+
+    def run(self, stmts):
+        """Execute the statements of a plan
+
+        :param stmts: list of SQL statements or `\\copy` tuples
+
+        The transaction is neither committed nor rolled back.
+        """
+        if self.begin is not None:
+            self.begin()
+        for (i, stmt) in enumerate(stmts):
+            self.execute_one(i + 1, stmt)
+
+
+class BatchExecutor(Executor):
+    """Apply statements to a database, several per round trip"""
+
+    def __init__(self, dbconn, batch_size=100):
+        """Initialize the executor
+
+        :param dbconn: a DbConnection
+        :param batch_size: maximum number of statements per batch
+        """
+        super(BatchExecutor, self).__init__(dbconn)
+        self.batch_size = batch_size
+
+    def alone(self, stmt):
+        """Should the statement be executed by itself?
+
+        :param stmt: SQL statement
+        :return: boolean
+        """
+        return False
+
+    def execute_batch(self, batch):
+        """Execute a batch of statements as a single query string
+
+        :param batch: list of (index, statement) pairs
+
+        The batch is preceded by a savepoint.  If any statement fails,
+        the batch is rolled back to the savepoint and its statements
+        are executed one at a time, so that the failing statement can
+        be reported.
+        """
+        sql = ";\n".join(["SAVEPOINT %s" % SAVEPOINT] +
+                         [stmt for (i, stmt) in batch] +
+                         ["RELEASE SAVEPOINT %s" % SAVEPOINT])
+        curs = self.cursor()
+        try:
+            curs.execute(sql)
+        except DatabaseError:
+            curs.execute("ROLLBACK TO SAVEPOINT %s" % SAVEPOINT)
+            for (i, stmt) in batch:
+                self.execute_one(i, stmt)
+            curs.execute("RELEASE SAVEPOINT %s" % SAVEPOINT)
+        finally:
+            curs.close()
+
+    def run(self, stmts):
+        """Execute the statements of a plan in batches
+
+        :param stmts: list of SQL statements or `\\copy` tuples
+
+        The transaction is neither committed nor rolled back.
+        """
+        if self.begin is not None:
+            self.begin()
+        for batch in batches(stmts, self.batch_size, self.alone):
+            if len(batch) == 1:
+                self.execute_one(*batch[0])
+            else:
+                self.execute_batch(batch)
+
+
+def split_table_name(table):
+    """Split a possibly qualified and quoted table name
+
+    :param table: table name, e.g., 's1.t1' or '"My Schema".t1'
+    :return: tuple of schema name (None if not qualified) and table name
+    """
+    def unquote(name):
+        if name[:1] == '"':
+            return name[1:-1].replace('""', '"')
+        return name.lower()
+
+    match = QUOTED_NAME.match(table)
+    if match is None:
+        return (None, table)
+    (schema, name) = match.groups()
+    return (schema and unquote(schema), unquote(name))
+
+
+def conflicting_holders_query(version):
+    """Return the query for the sessions holding conflicting locks
+
+    :param version: server version number
+    :return: text of the query
+    """
+    if version < 90200:
+        return CONFLICTING_HOLDERS.format(state='NULL', query='current_query',
+                                          pid='procpid')
+    return CONFLICTING_HOLDERS.format(state='a.state', query='query',
+                                      pid='pid')
+
+
+def lock_mode_name(mode):
+    """Return the name of a lock mode as shown in pg_locks
+
+    :param mode: lock mode, e.g., 'SHARE ROW EXCLUSIVE'
+    :return: pg_locks mode, e.g., 'ShareRowExclusiveLock'
+    """
+    return "".join(word.capitalize() for word in mode.split()) + 'Lock'
+
+
+LOCK_MODE_NAMES = dict((lock_mode_name(mode), mode) for mode in LOCK_MODES)
+"""Lock modes, keyed by their names in pg_locks"""
+
+
+def conflicting_modes(mode):
+    """Return the pg_locks names of the modes conflicting with a mode
+
+    :param mode: lock mode, e.g., 'ACCESS EXCLUSIVE'
+    :return: list of pg_locks mode names
+    """
+    return [lock_mode_name(other) for other in LOCK_CONFLICTS[mode]]
+
+
+def blocked_by(mode, held_modes):
+    """Indicate whether a lock request conflicts with locks held
+
+    :param mode: pg_locks name of the mode requested
+    :param held_modes: list of pg_locks names of the modes held
+    :return: boolean
+    """
+    return any(mode in conflicting_modes(LOCK_MODE_NAMES[held])
+               for held in held_modes if held in LOCK_MODE_NAMES)
+
+
+class LockTimeout(Exception):
+    """A lock could not be acquired before the deadline"""
+
+
+class LocksUnavailable(Exception):
+    """The locks needed by a statement are not available"""
+
+    def __init__(self, index, stmt, reason):
+        """Initialize the exception
+
+        :param index: position of the statement in the plan (from 1)
+        :param stmt: the statement
+        :param reason: description of the conflicting locks
+        """
+        super(LocksUnavailable, self).__init__(reason)
+        self.index = index
+        self.stmt = stmt
+        self.reason = reason
+
+
+class LockAwareExecutor(BatchExecutor):
+    """Apply statements without queueing behind conflicting locks
+
+    Before each statement that takes table-level locks, `pg_locks` is
+    checked for other sessions holding, or waiting for, conflicting
+    locks.  The statements run with a short `lock_timeout`, so that a
+    statement blocked nonetheless gives up quickly instead of blocking
+    every other session queued behind it.  In either case, the
+    statement is retried with exponential backoff until the deadline
+    is reached.  If earlier statements have taken table-level locks,
+    the transaction is rolled back before waiting, so that those
+    locks do not block other sessions in the meantime, and the plan
+    is then applied again from the start.
+    """
+
+    def __init__(self, dbconn, batch_size=1, lock_timeout=2000,
+                 deadline=60, delay=0.5, max_delay=10, log=None):
+        """Initialize the executor
+
+        :param dbconn: a DbConnection
+        :param batch_size: maximum number of statements per batch
+        :param lock_timeout: lock_timeout for each attempt, in ms
+        :param deadline: seconds to keep retrying a statement
+        :param delay: seconds to wait before the first retry
+        :param max_delay: maximum seconds to wait between retries
+        :param log: function called with progress messages
+        """
+        super(LockAwareExecutor, self).__init__(dbconn, batch_size)
+        self.lock_timeout = lock_timeout
+        self.deadline = deadline
+        self.delay = delay
+        self.max_delay = max_delay
+        self.log = log
+        self.waits = []
+        self.version = dbconn.version if hasattr(dbconn, 'version') \
+            else None
+        self.clock = time.time
+        self.sleep = time.sleep
+
+    def locks(self, stmt):
+        """Return the table-level locks a statement takes
+
+        :param stmt: SQL statement or `\\copy` tuple
+        :return: list of (table, lock mode) tuples
+        """
+        return [(table, mode) for (table, mode)
+                in StatementInfo(stmt, self.version).locks if mode]
+
+    def alone(self, stmt):
+        """Statements taking table-level locks are executed by themselves
+
+        :param stmt: SQL statement
+        :return: boolean
+        """
+        return len(self.locks(stmt)) > 0
+
+    def conflicting_holders(self, locks):
+        """Return the sessions holding or awaiting conflicting locks
+
+        :param locks: list of (table, lock mode) tuples
+        :return: list of dicts with table, pid, mode, granted, state,
+            xact_age and query
+
+        Sessions waiting for a lock that conflicts with one this
+        session already holds, e.g., taken by an earlier statement of
+        the plan, are not included.  They are waiting for this
+        session, which the server does not queue behind them.
+        """
+        holders = []
+        curs = self.cursor()
+        try:
+            query = conflicting_holders_query(curs.connection.server_version)
+            # pg_stat_activity is otherwise frozen for the transaction
+            curs.execute("SELECT pg_stat_clear_snapshot()")
+            for (table, mode) in locks:
+                (schema, name) = split_table_name(table)
+                curs.execute(query, {'schema': schema, 'name': name,
+                                     'modes': conflicting_modes(mode)})
+                for row in curs.fetchall():
+                    holder = dict(zip([col[0] for col in curs.description],
+                                      row))
+                    own_modes = holder.pop('own_modes')
+                    if not holder['granted'] and blocked_by(holder['mode'],
+                                                            own_modes):
+                        continue
+                    holder['table'] = table
+                    holders.append(holder)
+        finally:
+            curs.close()
+        return holders
+
+    def attempt(self, index, stmt):
+        """Try executing a statement within a savepoint
+
+        :param index: position of the statement in the plan
+        :param stmt: SQL statement or `\\copy` tuple
+        :return: None if successful, or the lock_timeout error
+
+        Errors other than a lock timeout are raised as a StatementError.
+        """
+        curs = self.cursor()
+        try:
+            if isinstance(stmt, tuple):
+                curs.execute("SAVEPOINT %s" % STMT_SAVEPOINT)
+                self.load(stmt)
+                curs.execute("RELEASE SAVEPOINT %s" % STMT_SAVEPOINT)
+            else:
+                curs.execute("SAVEPOINT %s;\n%s;\nRELEASE SAVEPOINT %s" % (
+                    STMT_SAVEPOINT, stmt, STMT_SAVEPOINT))
+        except DatabaseError as exc:
+            curs.execute("ROLLBACK TO SAVEPOINT %s" % STMT_SAVEPOINT)
+            curs.execute("RELEASE SAVEPOINT %s" % STMT_SAVEPOINT)
+            if exc.pgcode != LOCK_NOT_AVAILABLE:
+                raise StatementError(index, stmt, exc)
+            return exc
+        finally:
+            curs.close()
+        return None
+
+    def execute_one(self, index, stmt):
+        """Execute a statement if its locks are available
+
+        :param index: position of the statement in the plan
+        :param stmt: SQL statement or `\\copy` tuple
+
+        LocksUnavailable is raised if other sessions hold or await
+        conflicting locks, or if the lock_timeout expires.
+        """
+        locks = self.locks(stmt)
+        holders = self.conflicting_holders(locks) if locks else []
+        if holders:
+            raise LocksUnavailable(index, stmt, "; ".join(
+                "pid %d %s %s on %s (transaction age %.0f s)" % (
+                    h['pid'], 'holds' if h['granted'] else 'awaits',
+                    h['mode'], h['table'], h['xact_age'] or 0)
+                for h in holders))
+        error = self.attempt(index, stmt)
+        if error is not None:
+            raise LocksUnavailable(index, stmt, str(error).strip())
+
+    def start(self):
+        """Set the lock_timeout at the start of the transaction"""
+        curs = self.cursor()
+        try:
+            curs.execute("SET LOCAL lock_timeout = %s",
+                         ("%dms" % self.lock_timeout, ))
+        finally:
+            curs.close()
+        if self.begin is not None:
+            self.begin()
+
+    def run(self, stmts):
+        """Execute the statements of a plan with a short lock_timeout
+
+        :param stmts: list of SQL statements or `\\copy` tuples
+
+        The transaction is neither committed nor rolled back, except
+        when restarting it.  If a statement was delayed, the time
+        waited and number of attempts are appended to :attr:`waits`.
+        """
+        batchlist = list(batches(stmts, self.batch_size, self.alone))
+        blocked = {}
+        (pos, holding) = (0, False)
+        self.start()
+        while pos < len(batchlist):
+            batch = batchlist[pos]
+            try:
+                if len(batch) == 1:
+                    self.execute_one(*batch[0])
+                else:
+                    self.execute_batch(batch)
+            except LocksUnavailable as exc:
+                if exc.index not in blocked:
+                    blocked[exc.index] = [self.clock(), 0, self.delay]
+                wait = blocked[exc.index]
+                wait[1] += 1
+                (elapsed, delay) = (self.clock() - wait[0], wait[2])
+                restart = holding or len(batch) > 1
+                if restart:
+                    self.dbconn.conn.rollback()
+                if elapsed + delay > self.deadline:
+                    raise StatementError(exc.index, exc.stmt, LockTimeout(
+                        "locks not acquired after %.1f s and %d attempts: "
+                        "%s" % (elapsed, wait[1], exc.reason)))
+                if self.log is not None:
+                    self.log("Statement %d: %s; %sretrying in %.1f s" % (
+                        exc.index, exc.reason, "transaction rolled back, "
+                        if restart else "", delay))
+                self.sleep(delay)
+                wait[2] = min(delay * 2, self.max_delay)
+                if restart:
+                    (pos, holding) = (0, False)
+                    self.loads = []
+                    self.start()
+                continue
+            for (index, stmt) in batch:
+                if index in blocked:
+                    (since, attempts, delay) = blocked.pop(index)
+                    self.waits.append((index, stmt, self.clock() - since,
+                                       attempts + 1))
+                if self.locks(stmt):
+                    holding = True
+            pos += 1
+
+    def wait_report(self):
+        """Return a report of the statements that had to wait
+
+        :return: text of the report
+        """
+        lines = []
+        for (index, stmt, seconds, attempts) in self.waits:
+            lines.append("Statement %d waited %.1f s (%d attempts): %s" % (
+                index, seconds, attempts, stmt_text(stmt).split('\n')[0]))
+        lines.append("Statements delayed: %d, total wait: %.1f s" % (
+            len(self.waits), sum(wait[2] for wait in self.waits)))
+        return "\n".join(lines)
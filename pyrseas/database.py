@@ -16,7 +16,11 @@ import sys
 import yaml
 
 from pyrseas.yamlutil import yamldump
+from pyrseas.datacopy import bulk_load, check_import_modes, export_tables
+from pyrseas.datacopy import load_order
+from pyrseas.datacopy import sync_tables
 from pyrseas.lib.dbconn import DbConnection
+from pyrseas.lib.progress import print_progress
 from pyrseas.dbobject import fetch_reserved_words
 from pyrseas.dbobject.language import LanguageDict
 from pyrseas.dbobject.cast import CastDict
@@ -121,6 +125,7 @@ class Database(object):
                                       db['password'], db['host'], db['port'])
         self.db = None
         self.config = config
+        self.export_results = []
 
     def _link_refs(self, db):
         """Link related objects"""
@@ -312,6 +317,12 @@ class Database(object):
             if not os.path.exists(opts.data_dir):
                 mkdir_parents(opts.data_dir)
         dbmap.update(self.db.schemas.to_map(opts))
+        if 'datacopy' in self.config:
+            self.export_results = export_tables(
+                self.dbconn, self.db.schemas.data_export(opts),
+                getattr(opts, 'jobs', None) or 1,
+                print_progress if getattr(opts, 'progress', False)
+                else None)
 
         if opts.multiple_files:
             with open(dbfilepath, 'w') as f:
@@ -387,7 +398,61 @@ class Database(object):
         stmts.append(self.db.fdwrappers._drop())
         stmts.append(self.db.languages._drop())
         stmts.append(self.db.extensions._drop())
-        if 'datacopy' in self.config:
+        if 'datacopy' in self.config and not (
+                getattr(opts, 'bulk_load', False) or
+                getattr(opts, 'sync_data', False)):
             opts.data_dir = self.config['files']['data_path']
-            stmts.append(self.ndb.schemas.data_import(opts))
+            tables = load_order(self.ndb.schemas.data_tables(opts))
+            check_import_modes(tables, self.dbconn.version)
+            stmts.append([table.data_import(dirpath)
+                          for (table, dirpath) in tables])
         return [s for s in flatten(stmts)]
+
+    def _data_tables(self, input_map):
+        """Return the datacopy tables of the new database
+
+        :param input_map: a YAML map defining the new database
+        :return: list of (table, directory path) tuples
+        """
+        if not hasattr(self, 'ndb'):
+            self.from_map(input_map)
+        if 'datacopy' not in self.config:
+            return []
+        opts = self.config['options']
+        opts.data_dir = self.config['files']['data_path']
+        return load_order(self.ndb.schemas.data_tables(opts))
+
+    def bulk_load(self, input_map, jobs=1, log=None, progress=None):
+        """Load the data of the datacopy tables in bulk
+
+        :param input_map: a YAML map defining the new database
+        :param jobs: number of connections to use
+        :param log: function called with a progress message
+        :param progress: function called with periodic messages while
+            loading the data files
+        :return: list of (phase, units, seconds) tuples
+
+        This is used instead of the statements generated by `diff_map`
+        to import the data, after the latter have been committed.
+        """
+        tables = self._data_tables(input_map)
+        if not tables:
+            return []
+        return bulk_load(self.dbconn, tables, self.ndb.tables.values(),
+                         jobs, log, progress)
+
+    def sync_data(self, input_map, jobs=1, log=None, progress=None):
+        """Synchronize the data of the datacopy tables with their files
+
+        :param input_map: a YAML map defining the new database
+        :param jobs: number of connections to use
+        :param log: function called with a progress message
+        :param progress: function called with periodic messages while
+            loading the data files
+        :return: list of dictionaries, one per table
+
+        This is used instead of the statements generated by `diff_map`
+        to import the data, after the latter have been committed.
+        """
+        return sync_tables(self.dbconn, self._data_tables(input_map), jobs,
+                           log, progress)
@@ -0,0 +1,672 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.datacopy
+    ~~~~~~~~~~~~~~~~
+
+    Functions to copy the data of the tables listed in the `datacopy`
+    configuration section out to files, possibly using several
+    database connections in parallel and splitting big tables into
+    primary key ranges, and to bulk load them back or synchronize
+    tables with them.
+"""
+import os
+import threading
+import time
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+from pyrseas.apply import copy_file
+from pyrseas.dbobject import quote_id
+from pyrseas.lib.compress import file_md5
+from pyrseas.lib.progress import CopyProgress, format_bytes
+from pyrseas.plan import table_sizes
+
+
+def _export_one(dbconn, item, lock, sizes=None, callback=None):
+    """Export the data of a table or of a chunk of it, timing it
+
+    :param dbconn: database connection to use
+    :param item: tuple of table, directory path, chunk and manifest
+    :param lock: lock protecting the manifests
+    :param sizes: dictionary of table sizes, as returned by table_sizes
+    :param callback: function called with periodic progress messages
+    :return: dictionary with table, rows, bytes and seconds
+
+    The estimated number of rows, used to report progress, is that
+    recorded in `pg_class.reltuples`, divided among the chunks.
+    """
+    (table, dirpath, chunk, manifest) = item
+    start = time.time()
+    progress = None
+    if callback is not None:
+        total = None
+        size = (sizes or {}).get((table.schema, table.name))
+        if size and size['rows'] and getattr(table, 'export_query',
+                                             None) is None:
+            total = size['rows'] / len(manifest['chunks']) \
+                if chunk is not None else size['rows']
+        progress = CopyProgress(table.qualname(), total, callback=callback)
+    result = table.data_export(dbconn, dirpath, chunk, progress)
+    result.update(table=table.qualname(), seconds=time.time() - start)
+    if chunk is not None:
+        with lock:
+            chunk.update(done=True, rows=result['rows'],
+                         bytes=result['bytes'], md5=file_md5(result['path']))
+            manifest['complete'] = all(chk.get('done')
+                                       for chk in manifest['chunks'])
+            table.write_manifest(dirpath, manifest)
+    return result
+
+
+def export_order(tables, sizes):
+    """Sort tables to be exported, biggest first
+
+    :param tables: list of (table, directory path) tuples
+    :param sizes: dictionary of table sizes, as returned by table_sizes
+    :return: sorted list
+    """
+    def heap_bytes(item):
+        size = sizes.get((item[0].schema, item[0].name))
+        return size['heap_bytes'] if size else 0
+    return sorted(tables, key=heap_bytes, reverse=True)
+
+
+def _pk_names(table, nchunks):
+    """Return the names of the columns used to split a table in chunks"""
+    if nchunks <= 1:
+        return []
+    return [col for (col, type_) in table.pk_columns()]
+
+
+def _resumable(manifest, table, nchunks):
+    """Can an existing manifest be used to resume an export?"""
+    return manifest is not None and not manifest.get('complete') and \
+        manifest.get('columns') == _pk_names(table, nchunks) and \
+        manifest.get('nchunks') == nchunks and \
+        manifest.get('format', 'csv') == table.data_format()
+
+
+def export_work(dbconn, tables):
+    """Return the units of work to export the data of tables
+
+    :param dbconn: a DbConnection object
+    :param tables: list of (table, directory path) tuples
+    :return: list of (table, directory path, chunk, manifest) tuples
+
+    Tables with a `chunks` option are split into primary key ranges.
+    These, and tables exported in binary format, are described by a
+    manifest file recording the format, server version and, once
+    exported, the rows and checksum of each file.  If the manifest of
+    an interrupted export is found, only the chunks not yet completed
+    are exported.  For other tables, the chunk and manifest are None.
+    """
+    work = []
+    for (table, dirpath) in tables:
+        if not table.uses_manifest():
+            work.append((table, dirpath, None, None))
+            continue
+        nchunks = table.copy_option('chunks', 1)
+        manifest = table.read_manifest(dirpath)
+        if not _resumable(manifest, table, nchunks):
+            if nchunks > 1:
+                chunks = table.data_chunks(dbconn, nchunks)
+            else:
+                chunks = [{'file': table.extern_filename('data') +
+                           table.data_suffix(), 'lower': None,
+                           'upper': None}]
+            manifest = {'table': table.qualname(), 'nchunks': nchunks,
+                        'columns': _pk_names(table, nchunks),
+                        'format': table.data_format(),
+                        'server_version': dbconn.conn.server_version,
+                        'complete': False, 'chunks': chunks}
+            table.write_manifest(dirpath, manifest)
+        for chunk in manifest['chunks']:
+            if not chunk.get('done') or not os.path.exists(
+                    os.path.join(dirpath, chunk['file'])):
+                chunk['done'] = False
+                work.append((table, dirpath, chunk, manifest))
+    return work
+
+
+def _fkey_columns(fkey):
+    """Return the referencing and referenced columns of a foreign key"""
+    table = fkey._table
+    parent = fkey.references
+    return ([quote_id(table.columns[col - 1].name) for col in fkey.col_idx],
+            [quote_id(parent.columns[col - 1].name)
+             for col in fkey.ref_cols])
+
+
+def sample_queries(tables, version=None):
+    """Return the queries selecting the rows of sampled tables
+
+    :param tables: list of (table, directory path) tuples
+    :param version: server version number, if known
+    :return: dictionary of queries, keyed by table name
+
+    A table is sampled according to its `tablesample`, `where` and
+    `limit` copy options.  If a table has the `closure` option, the
+    sampled tables it references through foreign keys also include
+    the rows referenced by the rows it exports, and so on
+    recursively.  The referenced tables must also be exported.
+    Tables that are not sampled are exported in full and have no
+    query.
+    """
+    names = dict((table.qualname(), table) for (table, dirpath) in tables)
+    children = {}
+    for (table, dirpath) in tables:
+        if not table.copy_option('closure'):
+            continue
+        for fkey in getattr(table, 'foreign_keys', {}).values():
+            parent = fkey.references
+            if parent is table:
+                continue
+            if parent.qualname() not in names:
+                raise ValueError("Table %s: referenced table %s is not "
+                                 "exported" % (table.qualname(),
+                                               parent.qualname()))
+            children.setdefault(parent.qualname(), []).append(fkey)
+    queries = {}
+
+    def query(table, path):
+        name = table.qualname()
+        if name in queries:
+            return queries[name]
+        if name in path:
+            raise ValueError("Table %s: foreign keys followed for the "
+                             "closure are circular" % name)
+        base = table.sample_query(version)
+        if base is not None and name in children:
+            if not hasattr(table, 'primary_key'):
+                raise ValueError("Table %s: a sampled table referenced by a "
+                                 "closure requires a primary key" % name)
+            pkey = ", ".join(col for (col, type_) in table.pk_columns())
+            conds = ["(%s) IN (SELECT %s FROM (%s) _base)" % (
+                pkey, pkey, base)]
+            for fkey in children[name]:
+                child = query(fkey._table, path + [name])
+                (cols, refcols) = _fkey_columns(fkey)
+                conds.append("(%s) IN (SELECT %s FROM %s)" % (
+                    ", ".join(refcols), ", ".join(cols),
+                    fkey._table.qualname() if child is None
+                    else "(%s) _child" % child))
+            base = "SELECT * FROM %s WHERE %s" % (name, " OR ".join(conds))
+        queries[name] = base
+        return base
+
+    for (table, dirpath) in tables:
+        query(table, [])
+    return dict((name, qry) for (name, qry) in queries.items()
+                if qry is not None)
+
+
+def load_order(tables):
+    """Sort tables to be loaded so that referenced tables come first
+
+    :param tables: list of (table, directory path) tuples
+    :return: sorted list
+
+    Tables are otherwise kept in their original order, which is also
+    used for tables with circular foreign keys.
+    """
+    names = set(table.qualname() for (table, dirpath) in tables)
+    pending = list(tables)
+    ordered = []
+    loaded = set()
+    while pending:
+        for item in pending:
+            parents = set(fkey.references.qualname() for fkey in getattr(
+                item[0], 'foreign_keys', {}).values()) & names
+            parents.discard(item[0].qualname())
+            if parents <= loaded:
+                break
+        else:
+            item = pending[0]
+        pending.remove(item)
+        ordered.append(item)
+        loaded.add(item[0].qualname())
+    return ordered
+
+
+def check_import_modes(tables, version):
+    """Check that the server can import the tables as configured
+
+    :param tables: list of (table, directory path) tuples
+    :param version: server version number
+
+    The `merge` import mode uses INSERT ... ON CONFLICT, which
+    requires PostgreSQL 9.5 or later.
+    """
+    if version >= 90500:
+        return
+    for (table, dirpath) in tables:
+        if table.data_merged():
+            raise ValueError("Table %s: import mode 'merge' requires "
+                             "PostgreSQL 9.5 or later" % table.qualname())
+
+
+def merge_results(results):
+    """Combine the results of exporting chunks into one per table
+
+    :param results: list of dictionaries, one per unit of work
+    :return: list of dictionaries, one per table
+    """
+    merged = []
+    bytable = {}
+    for res in results:
+        if res['table'] not in bytable:
+            bytable[res['table']] = dict(res)
+            merged.append(bytable[res['table']])
+            continue
+        tblres = bytable[res['table']]
+        for key in ['rows', 'bytes', 'seconds']:
+            tblres[key] += res[key]
+    return merged
+
+
+def _parallel(dbconn, work, func, jobs, setup=None):
+    """Process units of work using several database connections
+
+    :param dbconn: a DbConnection object
+    :param work: list of units of work
+    :param func: function called with a connection and a unit of work
+    :param jobs: number of connections to use
+    :param setup: function called with each new connection
+    :return: list of results returned by `func`
+
+    With a single job, the units are processed in order on `dbconn`.
+    Otherwise, each thread clones `dbconn` and takes the next unit
+    available.  The first error raised stops the other threads and is
+    raised again.
+    """
+    if jobs <= 1:
+        return [func(dbconn, item) for item in work]
+    pending = Queue()
+    for item in work:
+        pending.put(item)
+    lock = threading.Lock()
+    results = []
+    errors = []
+
+    def worker():
+        conn = dbconn.clone()
+        try:
+            conn.connect()
+            if setup is not None:
+                setup(conn)
+            while not errors:
+                try:
+                    item = pending.get_nowait()
+                except Empty:
+                    break
+                result = func(conn, item)
+                with lock:
+                    results.append(result)
+        except (Exception, SystemExit) as exc:
+            with lock:
+                errors.append(exc)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(jobs, len(work)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def export_tables(dbconn, tables, jobs=1, progress=None):
+    """Export the data of tables to files
+
+    :param dbconn: a DbConnection object
+    :param tables: list of (table, directory path) tuples
+    :param jobs: number of connections to use
+    :param progress: function called with periodic progress messages
+    :return: list of dictionaries, one per table, with the table
+        name, rows, bytes and seconds taken
+
+    The tables are exported biggest first.  With more than one job, a
+    leader connection exports its snapshot, which each worker
+    connection imports in a REPEATABLE READ transaction, so that all
+    the files are consistent with each other.  The chunks of tables
+    exported by primary key ranges are exported in parallel as well.
+    Sharing the snapshot requires PostgreSQL 9.2 or later.
+    Sampled tables are restricted to the rows selected by the queries
+    returned by `sample_queries`.
+    """
+    if not tables:
+        return []
+    queries = sample_queries(tables, dbconn.version)
+    for (table, dirpath) in tables:
+        table.export_query = queries.get(table.qualname())
+    sizes = table_sizes(dbconn)
+    work = export_work(dbconn, export_order(tables, sizes))
+    lock = threading.Lock()
+
+    def export(conn, item):
+        return _export_one(conn, item, lock, sizes, progress)
+
+    if jobs <= 1:
+        return merge_results(_parallel(dbconn, work, export, jobs))
+
+    leader = dbconn.clone()
+    leader.connect()
+    leader.conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    snapshot = leader.fetchone("SELECT pg_export_snapshot()")[0]
+
+    def setup(conn):
+        conn.conn.set_session(isolation_level='REPEATABLE READ',
+                              readonly=True)
+        conn.execute("SET TRANSACTION SNAPSHOT %s", (snapshot, )).close()
+
+    try:
+        return merge_results(_parallel(dbconn, work, export, jobs, setup))
+    finally:
+        leader.close()
+
+
+def export_report(results):
+    """Format the results of exporting tables as text
+
+    :param results: list of dictionaries, as returned by export_tables
+    :return: text of the report
+    """
+    lines = []
+    for res in results:
+        rate = res['bytes'] / res['seconds'] if res['seconds'] else 0
+        rows = '?' if res['rows'] is None or res['rows'] < 0 \
+            else res['rows']
+        lines.append("%s: %s rows, %s in %.1f s (%s/s)" % (
+            res['table'], rows, format_bytes(res['bytes']), res['seconds'],
+            format_bytes(rate)))
+    lines.append("Tables: %d, rows: %d, size: %s" % (
+        len(results), sum(res['rows'] for res in results
+                          if res['rows'] is not None and res['rows'] > 0),
+        format_bytes(sum(res['bytes'] for res in results))))
+    return "\n".join(lines)
+
+
+def _statements(stmts):
+    """Return the statements generated by a method as a list"""
+    return stmts if isinstance(stmts, list) else [stmts]
+
+
+def bulk_load_phases(tables, alltables):
+    """Return the phases of a bulk load of table data
+
+    :param tables: list of (table, directory path) tuples to be loaded
+    :param alltables: all the tables in the database, to find foreign
+        keys referencing the loaded tables
+    :return: list of (phase, units) tuples, where each unit is a
+        (label, statements) tuple to be run as one transaction
+
+    The `prepare` phase drops the foreign keys referencing or
+    referenced by the loaded tables, their unique constraints and
+    indexes other than the primary key, and disables their triggers.
+    The `load` phase replaces the data of each table.  The `index`
+    phase recreates the indexes and unique constraints.  The
+    `constrain` phase adds the foreign keys as NOT VALID and enables
+    the triggers.  The `validate` phase validates the foreign keys.
+    The units of the `load`, `index` and `validate` phases can be run
+    in parallel.
+    """
+    loaded = set(table.qualname() for (table, dirpath) in tables)
+    fkeys = []
+    for table in alltables:
+        for fkey in getattr(table, 'foreign_keys', {}).values():
+            if table.qualname() in loaded or \
+                    fkey.references.qualname() in loaded:
+                fkeys.append(fkey)
+    prepare = ["ALTER TABLE %s DROP CONSTRAINT %s" % (
+        fkey._table.qualname(), quote_id(fkey.name)) for fkey in fkeys]
+    constrain = []
+    validate = []
+    for fkey in fkeys:
+        stmts = _statements(fkey.add())
+        constrain.append(stmts[0] + " NOT VALID")
+        constrain.extend(stmts[1:])
+        validate.append((fkey.name, ["ALTER TABLE %s VALIDATE CONSTRAINT %s"
+                                     % (fkey._table.qualname(),
+                                        quote_id(fkey.name))]))
+    load = []
+    index = []
+    for (table, dirpath) in tables:
+        for constr in getattr(table, 'unique_constraints', {}).values():
+            prepare.append("ALTER TABLE %s DROP CONSTRAINT %s" % (
+                table.qualname(), quote_id(constr.name)))
+            index.append((constr.name, _statements(constr.add())))
+        for idx in getattr(table, 'indexes', {}).values():
+            prepare.append("DROP INDEX %s" % idx.qualname())
+            index.append((idx.name, _statements(idx.create())))
+        for trg in getattr(table, 'triggers', {}).values():
+            prepare.append("ALTER TABLE %s DISABLE TRIGGER %s" % (
+                table.qualname(), quote_id(trg.name)))
+            constrain.append("ALTER TABLE %s ENABLE TRIGGER %s" % (
+                table.qualname(), quote_id(trg.name)))
+        load.append((table.qualname(), table.data_load(dirpath)))
+    return [('prepare', [('prepare', prepare)]), ('load', load),
+            ('index', index), ('constrain', [('constrain', constrain)]),
+            ('validate', validate)]
+
+
+def _run_unit(dbconn, unit, progress=None):
+    """Run the statements of a unit of work in a transaction
+
+    :param dbconn: a DbConnection object
+    :param unit: (label, statements) tuple
+    :param progress: function called with periodic progress messages
+    :return: the label
+    """
+    (label, stmts) = unit
+    if dbconn.conn is None or dbconn.conn.closed:
+        dbconn.connect()
+    curs = dbconn.conn.cursor()
+    try:
+        for stmt in stmts:
+            if isinstance(stmt, tuple):
+                copy_file(dbconn, stmt, progress)
+            else:
+                curs.execute(stmt)
+        dbconn.commit()
+    except:
+        dbconn.rollback()
+        raise
+    finally:
+        curs.close()
+    return label
+
+
+def bulk_load(dbconn, tables, alltables, jobs=1, log=None, progress=None):
+    """Load the data of tables from files, rebuilding indexes afterwards
+
+    :param dbconn: a DbConnection object
+    :param tables: list of (table, directory path) tuples to be loaded
+    :param alltables: all the tables in the database
+    :param jobs: number of connections to use
+    :param log: function called with a progress message for each phase
+    :param progress: function called with periodic progress messages
+        while loading
+    :return: list of (phase, units, seconds) tuples
+
+    The phases, as returned by `bulk_load_phases`, are committed
+    separately, so the load is not atomic: if it fails, the indexes
+    and foreign keys dropped can be recreated by running yamltodb
+    again, but the triggers disabled must be enabled manually.
+    """
+    check_import_modes(tables, dbconn.version)
+    results = []
+    for (phase, units) in bulk_load_phases(tables, alltables):
+        units = [unit for unit in units if unit[1]]
+        start = time.time()
+        _parallel(dbconn, units,
+                  lambda conn, unit: _run_unit(conn, unit, progress), jobs)
+        results.append((phase, len(units), time.time() - start))
+        if log is not None:
+            log("%s: %d units in %.1f s" % results[-1])
+    return results
+
+
+SYNC_STAGING = 'pyrseas_sync'
+SYNC_FANOUT = 16
+SYNC_LEAF_ROWS = 1000
+
+
+def range_hash_query(relname, table, where):
+    """Return a query for the number of rows and hash of a key range
+
+    :param relname: name of the table or of its staging table
+    :param table: the table being synchronized
+    :param where: WHERE clause restricting the rows to the range
+    :return: SQL query
+
+    The hash is the MD5 of the concatenated MD5s of the text form of
+    the rows, in primary key order.
+    """
+    return "SELECT count(*), md5(string_agg(md5(_sync_r::text), '' " \
+        "ORDER BY %s)) FROM %s _sync_r%s" % (
+            ", ".join(name for (name, type_) in table.pk_columns()),
+            relname, where)
+
+
+def range_bounds_query(table, where, step):
+    """Return a query to split a key range of the staging table
+
+    :param table: the table being synchronized
+    :param where: WHERE clause restricting the rows to the range
+    :param step: number of rows in each subrange
+    :return: SQL query returning the primary key values, as text, of
+        every `step`-th row, other than the first
+    """
+    names = [name for (name, type_) in table.pk_columns()]
+    return "SELECT %s FROM (SELECT %s, row_number() OVER (ORDER BY %s) " \
+        "AS _sync_rn FROM %s%s) _sync_s WHERE _sync_rn %% %d = 1 " \
+        "AND _sync_rn > 1" % (
+            ", ".join("%s::text" % name for name in names),
+            ", ".join(names), ", ".join(names), SYNC_STAGING, where, step)
+
+
+def sync_statements(table, where):
+    """Return SQL to make a key range of a table match the staging table
+
+    :param table: the table being synchronized
+    :param where: WHERE clause restricting the rows to the range
+    :return: DELETE and INSERT statements
+
+    Rows not in the staging table are deleted.  Rows in the staging
+    table are inserted or, if they differ from the existing ones,
+    updated.
+    """
+    names = [name for (name, type_) in table.pk_columns()]
+    delete = "DELETE FROM %s _sync_t%s%sNOT EXISTS (SELECT 1 FROM %s " \
+        "_sync_s WHERE (%s) = (%s))" % (
+            table.qualname(), where, " AND " if where else " WHERE ",
+            SYNC_STAGING, ", ".join("_sync_s.%s" % name for name in names),
+            ", ".join("_sync_t.%s" % name for name in names))
+    upsert = "INSERT INTO %s AS _sync_t SELECT * FROM %s%s %s" % (
+        table.qualname(), SYNC_STAGING, where, table.upsert_clause('_sync_t'))
+    return [delete, upsert]
+
+
+def _sync_one(dbconn, item, progress=None):
+    """Synchronize the data of a table with its data files
+
+    :param dbconn: database connection to use
+    :param item: tuple of table and directory path
+    :param progress: function called with periodic progress messages
+        while loading the files
+    :return: dictionary with table, ranges compared, rows upserted and
+        deleted, and seconds taken
+    """
+    (table, dirpath) = item
+    if not hasattr(table, 'primary_key'):
+        raise ValueError("Table %s: synchronizing data requires a "
+                         "primary key" % table.qualname())
+    start = time.time()
+    result = {'table': table.qualname(), 'ranges': 0, 'upserted': 0,
+              'deleted': 0}
+    if dbconn.conn is None or dbconn.conn.closed:
+        dbconn.connect()
+    curs = dbconn.conn.cursor()
+    try:
+        curs.execute("CREATE TEMP TABLE %s (LIKE %s) ON COMMIT DROP" % (
+            SYNC_STAGING, table.qualname()))
+        fmt = table.data_format()
+        for path in table.data_files(dirpath):
+            copy_file(dbconn, ("\\copy ", SYNC_STAGING, " from '", path,
+                               "' " + fmt), progress)
+        curs.execute("ANALYZE %s" % SYNC_STAGING)
+        ranges = [{'lower': None, 'upper': None}]
+        while ranges:
+            keyrange = ranges.pop()
+            where = table._chunk_where(keyrange)
+            curs.execute(range_hash_query(table.qualname(), table, where))
+            current = tuple(curs.fetchone())
+            curs.execute(range_hash_query(SYNC_STAGING, table, where))
+            wanted = tuple(curs.fetchone())
+            result['ranges'] += 1
+            if current == wanted:
+                continue
+            bounds = []
+            if wanted[0] > SYNC_LEAF_ROWS:
+                curs.execute(range_bounds_query(
+                    table, where, -(-wanted[0] // SYNC_FANOUT)))
+                bounds = [list(row) for row in curs.fetchall()]
+            if bounds:
+                edges = [keyrange['lower']] + bounds + [keyrange['upper']]
+                ranges.extend({'lower': edges[i], 'upper': edges[i + 1]}
+                              for i in range(len(edges) - 1))
+                continue
+            (delete, upsert) = sync_statements(table, where)
+            curs.execute(delete)
+            result['deleted'] += curs.rowcount
+            curs.execute(upsert)
+            result['upserted'] += curs.rowcount
+        dbconn.commit()
+    except:
+        dbconn.rollback()
+        raise
+    finally:
+        curs.close()
+    result['seconds'] = time.time() - start
+    return result
+
+
+def sync_tables(dbconn, tables, jobs=1, log=None, progress=None):
+    """Synchronize the data of tables with their data files
+
+    :param dbconn: a DbConnection object
+    :param tables: list of (table, directory path) tuples
+    :param jobs: number of connections to use
+    :param log: function called with a progress message for each table
+    :param progress: function called with periodic progress messages
+        while loading the files
+    :return: list of dictionaries, one per table, as returned by
+        `_sync_one`
+
+    Each table's files are loaded into a temporary staging table.
+    Starting with the whole table, the number of rows and the hash of
+    each primary key range are computed by the server, for the table
+    and the staging table.  A range that differs is split into
+    SYNC_FANOUT subranges, which are compared in turn, until it has no
+    more than SYNC_LEAF_ROWS rows, when only the rows that differ are
+    deleted, inserted or updated.  Each table is synchronized in its
+    own transaction.  The rows are inserted or updated with INSERT ...
+    ON CONFLICT, which requires PostgreSQL 9.5 or later.
+    """
+    def sync(conn, item):
+        result = _sync_one(conn, item, progress)
+        if log is not None:
+            log("%s: %d ranges compared, %d rows inserted or updated, "
+                "%d deleted in %.1f s" % (
+                    result['table'], result['ranges'], result['upserted'],
+                    result['deleted'], result['seconds']))
+        return result
+
+    return _parallel(dbconn, tables, sync, jobs)
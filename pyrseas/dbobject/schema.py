@@ -97,13 +97,6 @@ class Schema(DbObject):
         if self.name == 'pg_catalog' and not schobjs:
             return {}
 
-        if hasattr(self, 'datacopy') and self.datacopy:
-            dir = self.extern_dir(opts.data_dir)
-            if not os.path.exists(dir):
-                os.mkdir(dir)
-            for tbl in self.datacopy:
-                self.tables[tbl].data_export(dbschemas.dbconn, dir)
-
         if opts.multiple_files:
             dir = self.extern_dir(opts.metadata_dir)
             if not os.path.exists(dir):
@@ -141,18 +134,42 @@ class Schema(DbObject):
         """
         return ["CREATE SCHEMA %s" % quote_id(self.name)]
 
-    def data_import(self, opts):
-        """Generate SQL to import data from the tables in this schema
+    def data_export(self, opts):
+        """Return the tables in this schema whose data is to be exported
 
         :param opts: options to include/exclude schemas/tables, etc.
-        :return: list of SQL statements
+        :return: list of (table, directory path) tuples
         """
-        stmts = []
+        tables = []
         if hasattr(self, 'datacopy') and self.datacopy:
             dir = self.extern_dir(opts.data_dir)
+            if not os.path.exists(dir):
+                os.mkdir(dir)
             for tbl in self.datacopy:
-                stmts.append(self.tables[tbl].data_import(dir))
-        return stmts
+                tables.append((self.tables[tbl], dir))
+        return tables
+
+    def data_tables(self, opts):
+        """Return the tables in this schema whose data is to be imported
+
+        :param opts: options to include/exclude schemas/tables, etc.
+        :return: list of (table, directory path) tuples
+        """
+        tables = []
+        if hasattr(self, 'datacopy') and self.datacopy:
+            dir = self.extern_dir(opts.data_dir)
+            for tbl in self.datacopy:
+                tables.append((self.tables[tbl], dir))
+        return tables
+
+    def data_import(self, opts):
+        """Generate SQL to import data from the tables in this schema
+
+        :param opts: options to include/exclude schemas/tables, etc.
+        :return: list of SQL statements
+        """
+        return [table.data_import(dir)
+                for (table, dir) in self.data_tables(opts)]
 
 
 PREFIXES = {'domain ': 'types', 'type': 'types', 'table ': 'tables',
@@ -305,8 +322,13 @@ class SchemaDict(DbObjectDict):
             if not hasattr(schema, 'datacopy'):
                 schema.datacopy = []
             for tbl in datacopy[key]:
+                opts = {}
+                if isinstance(tbl, dict):
+                    (tbl, opts) = list(tbl.items())[0]
                 if hasattr(schema, 'tables') and tbl in schema.tables:
                     schema.datacopy.append(tbl)
+                    if opts:
+                        schema.tables[tbl].copy_options = opts
 
     def to_map(self, opts):
         """Convert the schema dictionary to a regular dictionary
@@ -378,6 +400,34 @@ class SchemaDict(DbObjectDict):
                 stmts.append(self[sch].drop())
         return stmts
 
+    def data_export(self, opts):
+        """Iterate over schemas with tables to be exported
+
+        :param opts: options to include/exclude schemas/tables, etc.
+        :return: list of (table, directory path) tuples
+        """
+        tables = []
+        selschs = getattr(opts, 'schemas', [])
+        for sch in self:
+            if selschs and sch not in selschs:
+                continue
+            if hasattr(opts, 'excl_schemas') and opts.excl_schemas \
+                    and sch in opts.excl_schemas:
+                continue
+            tables.extend(self[sch].data_export(opts))
+        return tables
+
+    def data_tables(self, opts):
+        """Iterate over schemas with tables to be imported
+
+        :param opts: options to include/exclude schemas/tables, etc.
+        :return: list of (table, directory path) tuples
+        """
+        tables = []
+        for sch in self:
+            tables.extend(self[sch].data_tables(opts))
+        return tables
+
     def data_import(self, opts):
         """Iterate over schemas with tables to be imported
 
@@ -11,7 +11,11 @@
 import os
 import sys
 
+import yaml
+
+from pyrseas.lib.compress import codec_suffix, decompress_command, file_md5
 from pyrseas.lib.pycompat import PY2
+from pyrseas.yamlutil import yamldump
 from pyrseas.dbobject import DbObjectDict, DbSchemaObject
 from pyrseas.dbobject import quote_id, split_schema_obj
 from pyrseas.dbobject import commentable, ownable, grantable
@@ -20,6 +24,8 @@ from pyrseas.dbobject.constraint import ForeignKey, UniqueConstraint
 from pyrseas.dbobject.privileges import privileges_from_map, add_grant
 
 MAX_BIGINT = 9223372036854775807
+CHUNK_SAMPLE = 1000
+MERGE_BATCH_ROWS = 10000
 
 
 def seq_max_value(seq):
@@ -457,21 +463,382 @@ class Table(DbClass):
 
         return stmts
 
-    def data_export(self, dbconn, dirpath):
+    def pk_columns(self):
+        """Return the primary key columns
+
+        :return: list of (quoted column name, type) tuples
+        """
+        return [(quote_id(self.columns[col - 1].name),
+                 self.columns[col - 1].type)
+                for col in self.primary_key.col_idx]
+
+    def _chunk_where(self, chunk):
+        """Return a WHERE clause restricting rows to a primary key range
+
+        :param chunk: dictionary with lower and upper bounds (or None)
+        :return: SQL WHERE clause
+        """
+        cols = self.pk_columns()
+        names = "(%s)" % ", ".join(name for (name, type_) in cols)
+
+        def row(values):
+            return "(%s)" % ", ".join(
+                "'%s'::%s" % (val.replace("'", "''"), type_)
+                for (val, (name, type_)) in zip(values, cols))
+
+        conds = []
+        if chunk.get('lower') is not None:
+            conds.append("%s >= %s" % (names, row(chunk['lower'])))
+        if chunk.get('upper') is not None:
+            conds.append("%s < %s" % (names, row(chunk['upper'])))
+        return " WHERE " + " AND ".join(conds) if conds else ""
+
+    def data_chunks(self, dbconn, nchunks):
+        """Split the table data into primary key ranges
+
+        :param dbconn: database connection to use
+        :param nchunks: number of chunks desired
+        :return: list of chunk dictionaries, with file name, lower and
+            upper bounds
+
+        The bounds are taken from an ordered sample of the primary key
+        values, of about CHUNK_SAMPLE rows per chunk, using TABLESAMPLE
+        for large tables on PostgreSQL 9.5 or later.  On older servers,
+        all the key values are read.  Bounds are lists of values in
+        text form.
+        """
+        if not hasattr(self, 'primary_key'):
+            raise ValueError("Table %s: exporting in chunks requires a "
+                             "primary key" % self.qualname())
+        names = [name for (name, type_) in self.pk_columns()]
+        reltuples = dbconn.fetchone(
+            "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+            (self.qualname(), ))[0]
+        pct = 100.0 * nchunks * CHUNK_SAMPLE / max(reltuples, 1)
+        sample = " TABLESAMPLE SYSTEM (%f)" % pct \
+            if pct < 100 and dbconn.version >= 90500 else ""
+        rows = dbconn.fetchall("SELECT %s FROM %s%s ORDER BY %s" % (
+            ", ".join("%s::text" % name for name in names), self.qualname(),
+            sample, ", ".join(names)))
+        bounds = []
+        for i in range(1, nchunks):
+            if not rows:
+                break
+            bound = list(rows[len(rows) * i // nchunks])
+            if bound not in bounds:
+                bounds.append(bound)
+        bounds = [None] + bounds + [None]
+        return [{'file': self.extern_filename('%03d.data' % i) +
+                 self.data_suffix(),
+                 'lower': bounds[i], 'upper': bounds[i + 1]}
+                for i in range(len(bounds) - 1)]
+
+    def copy_option(self, name, default=None):
+        """Return an option for copying the table's data
+
+        :param name: option name, e.g., 'chunks'
+        :param default: value if the option is not given
+        :return: option value
+        """
+        return getattr(self, 'copy_options', {}).get(name, default)
+
+    def data_format(self):
+        """Return the format of the table's data files
+
+        :return: 'csv' or 'binary'
+        """
+        fmt = self.copy_option('format', 'csv')
+        if fmt not in ('csv', 'binary'):
+            raise ValueError("Table %s: unknown data format '%s'" % (
+                self.qualname(), fmt))
+        return fmt
+
+    def uses_manifest(self):
+        """Is the data export described by a manifest?
+
+        :return: boolean
+
+        A manifest is used for tables exported in chunks or in binary
+        format.
+        """
+        return self.copy_option('chunks', 1) > 1 or \
+            self.data_format() == 'binary'
+
+    def data_suffix(self):
+        """Return the suffix added to data file names for compression
+
+        :return: file suffix, e.g., '.gz', or an empty string
+        """
+        return codec_suffix(self.copy_option('compression'))
+
+    def manifest_path(self, dirpath):
+        """Return the path to the manifest of a data export
+
+        :param dirpath: full path to the directory for the data files
+        :return: file path
+        """
+        return os.path.join(dirpath, self.extern_filename('manifest'))
+
+    def read_manifest(self, dirpath):
+        """Read the manifest of a data export
+
+        :param dirpath: full path to the directory for the data files
+        :return: dictionary, or None if there is no manifest
+        """
+        path = self.manifest_path(dirpath)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return yaml.safe_load(f)
+
+    def write_manifest(self, dirpath, manifest):
+        """Write the manifest of a data export
+
+        :param dirpath: full path to the directory for the data files
+        :param manifest: dictionary describing the chunks
+        """
+        path = self.manifest_path(dirpath)
+        with open(path + '.tmp', 'w') as f:
+            f.write(yamldump(manifest))
+        os.rename(path + '.tmp', path)
+
+    def _order_by(self):
+        """Return the columns to order the exported rows by
+
+        :return: primary key column names, or all column positions
+        """
+        if hasattr(self, 'primary_key'):
+            return ", ".join(name for (name, type_) in self.pk_columns())
+        return ", ".join('%d' % (n + 1) for n in range(len(self.columns)))
+
+    def sample_query(self, version=None):
+        """Return a query selecting a sample of the table's rows
+
+        :param version: server version number, if known
+        :return: SQL query, or None if the table is not sampled
+
+        The sample is given by the `tablesample` (a percentage of the
+        table's pages), `where` (a predicate) and `limit` (a number of
+        rows, in primary key order) copy options.  The TABLESAMPLE
+        clause uses a fixed seed, so that the sample is the same each
+        time the query is run on the same data.  It requires
+        PostgreSQL 9.5 or later.
+        """
+        pct = self.copy_option('tablesample')
+        where = self.copy_option('where')
+        limit = self.copy_option('limit')
+        if pct is None and where is None and limit is None:
+            return None
+        query = "SELECT * FROM %s" % self.qualname()
+        if pct is not None:
+            if not 0 < float(pct) <= 100:
+                raise ValueError("Table %s: tablesample must be a "
+                                 "percentage" % self.qualname())
+            if version is not None and version < 90500:
+                raise ValueError("Table %s: tablesample requires "
+                                 "PostgreSQL 9.5 or later" % self.qualname())
+            query += " TABLESAMPLE SYSTEM (%s) REPEATABLE (0)" % float(pct)
+        if where is not None:
+            query += " WHERE %s" % where
+        if limit is not None:
+            query += " ORDER BY %s LIMIT %d" % (self._order_by(), int(limit))
+        return query
+
+    def data_export(self, dbconn, dirpath, chunk=None, progress=None):
         """Copy table data out to a file
 
         :param dbconn: database connection to use
         :param dirpath: full path to the directory for the file to be created
+        :param chunk: chunk dictionary, to export a primary key range
+        :param progress: CopyProgress to update, if any
+        :return: dictionary with the file path and the number of rows
+            and bytes written
         """
-        filepath = os.path.join(dirpath, self.extern_filename('data'))
-        if hasattr(self, 'primary_key'):
-            order_by = [self.columns[col - 1].name
-                        for col in self.primary_key.col_idx]
+        if chunk is None:
+            filepath = os.path.join(dirpath, self.extern_filename('data') +
+                                    self.data_suffix())
+            where = ""
         else:
-            order_by = ['%d' % (n + 1) for n in range(len(self.columns))]
-        dbconn.sql_copy_to(
-            "COPY (SELECT * FROM %s ORDER BY %s) TO STDOUT WITH CSV" % (
-            self.qualname(), ', '.join(order_by)), filepath)
+            filepath = os.path.join(dirpath, chunk['file'])
+            where = self._chunk_where(chunk)
+        source = self.qualname()
+        if getattr(self, 'export_query', None) is not None:
+            source = "(%s) _sample" % self.export_query
+        binary = self.data_format() == 'binary'
+        rows = dbconn.sql_copy_to(
+            "COPY (SELECT * FROM %s%s ORDER BY %s) TO STDOUT WITH %s" % (
+                source, where, self._order_by(),
+                '(FORMAT binary)' if binary else 'CSV'), filepath, binary,
+            progress)
+        return {'path': filepath, 'rows': rows,
+                'bytes': os.path.getsize(filepath)}
+
+    def data_files(self, dirpath):
+        """Return the data files to be imported into the table
+
+        :param dirpath: full path for the directory for the files
+        :return: list of file paths
+
+        If the export is described by a manifest, the files are checked
+        against the checksums recorded in it.
+        """
+        if not self.uses_manifest():
+            return [os.path.join(dirpath, self.extern_filename('data') +
+                                 self.data_suffix())]
+        manifest = self.read_manifest(dirpath)
+        if manifest is None or not manifest.get('complete'):
+            raise ValueError("Table %s: data export is missing or "
+                             "incomplete" % self.qualname())
+        files = []
+        for chunk in manifest['chunks']:
+            filepath = os.path.join(dirpath, chunk['file'])
+            if 'md5' in chunk and file_md5(filepath) != chunk['md5']:
+                raise ValueError("Table %s: data file %s does not match "
+                                 "its checksum" % (self.qualname(), filepath))
+            files.append(filepath)
+        return files
+
+    def data_merged(self):
+        """Is the data imported by merging it into the existing rows?
+
+        :return: boolean
+        """
+        mode = self.copy_option('import', 'truncate')
+        if mode not in ('truncate', 'merge'):
+            raise ValueError("Table %s: unknown import mode '%s'" % (
+                self.qualname(), mode))
+        return mode == 'merge'
+
+    def upsert_clause(self, alias):
+        """Return an ON CONFLICT clause to update the rows that differ
+
+        :param alias: alias of the table in the INSERT statement
+        :return: SQL clause
+        """
+        names = [name for (name, type_) in self.pk_columns()]
+        others = [quote_id(col.name) for col in self.columns
+                  if not getattr(col, 'dropped', False)
+                  and quote_id(col.name) not in names]
+        if not others:
+            return "ON CONFLICT (%s) DO NOTHING" % ", ".join(names)
+        return "ON CONFLICT (%s) DO UPDATE SET %s WHERE ROW(%s.*) IS " \
+            "DISTINCT FROM ROW(EXCLUDED.*)" % (
+                ", ".join(names), ", ".join("%s = EXCLUDED.%s" % (col, col)
+                                            for col in others), alias)
+
+    def _copy_stmt(self, relname, filepath, fmt):
+        """Return a `\\copy` tuple to load a data file
+
+        :param relname: name of the table, possibly followed by columns
+        :param filepath: full path to the data file
+        :param fmt: 'csv' or 'binary'
+        :return: tuple
+
+        The path is kept unquoted in the tuple, for loading the file
+        directly.  It is quoted when the statement is written out, by
+        `pyrseas.plan.stmt_text`.
+        """
+        command = decompress_command(filepath)
+        if command is None:
+            return ("\\copy ", relname, " from '", filepath, "' " + fmt)
+        # psql decompresses the file using a program
+        return ("\\copy ", relname, " from program '%s " % command,
+                filepath, "' " + fmt)
+
+    def _data_merge(self, files, fmt):
+        """Generate SQL to merge the data in files into the table
+
+        :param files: list of data file paths
+        :param fmt: 'csv' or 'binary'
+        :return: list of SQL statements
+
+        The files are loaded into an unlogged staging table, with a
+        row number used to upsert its rows, MERGE_BATCH_ROWS at a
+        time, into the table.  Then the rows missing from the staging
+        table are deleted, also in batches.
+        """
+        if not hasattr(self, 'primary_key'):
+            raise ValueError("Table %s: merging data requires a primary "
+                             "key" % self.qualname())
+        stage = self.qualname(self.name + '_pyrseas_stage')
+        cols = ", ".join(quote_id(col.name) for col in self.columns
+                         if not getattr(col, 'dropped', False))
+        names = [name for (name, type_) in self.pk_columns()]
+        stmts = ["CREATE UNLOGGED TABLE %s (LIKE %s, _pyrseas_row "
+                 "bigserial)" % (stage, self.qualname())]
+        for filepath in files:
+            stmts.append(self._copy_stmt("%s (%s)" % (stage, cols), filepath,
+                                         fmt))
+        stmts.append("CREATE INDEX ON %s (_pyrseas_row)" % stage)
+        stmts.append(
+            "DO $$DECLARE _pyrseas_n bigint; BEGIN\n"
+            "FOR _pyrseas_n IN 0 .. (SELECT coalesce(max(_pyrseas_row), 0) "
+            "FROM %(stage)s) BY %(batch)d LOOP\n"
+            "  INSERT INTO %(table)s AS _pyrseas_t (%(cols)s)\n"
+            "  SELECT %(cols)s FROM %(stage)s WHERE _pyrseas_row > _pyrseas_n"
+            " AND _pyrseas_row <= _pyrseas_n + %(batch)d\n  %(upsert)s;\n"
+            "END LOOP;\n"
+            "CREATE TEMP TABLE _pyrseas_gone AS SELECT row_number() OVER () "
+            "AS _pyrseas_row, %(tcols)s FROM %(table)s _pyrseas_t\n"
+            "  WHERE NOT EXISTS (SELECT 1 FROM %(stage)s _pyrseas_s "
+            "WHERE (%(scols)s) = (%(tcols)s));\n"
+            "FOR _pyrseas_n IN 0 .. (SELECT coalesce(max(_pyrseas_row), 0) "
+            "FROM _pyrseas_gone) BY %(batch)d LOOP\n"
+            "  DELETE FROM %(table)s _pyrseas_t USING _pyrseas_gone _pyrseas_g"
+            " WHERE (%(tcols)s) = (%(gcols)s)\n"
+            "    AND _pyrseas_g._pyrseas_row > _pyrseas_n"
+            " AND _pyrseas_g._pyrseas_row <= _pyrseas_n + %(batch)d;\n"
+            "END LOOP;\n"
+            "DROP TABLE _pyrseas_gone;\nEND$$" % {
+                'stage': stage, 'table': self.qualname(), 'cols': cols,
+                'batch': MERGE_BATCH_ROWS,
+                'upsert': self.upsert_clause('_pyrseas_t'),
+                'tcols': ", ".join("_pyrseas_t.%s" % name for name in names),
+                'scols': ", ".join("_pyrseas_s.%s" % name for name in names),
+                'gcols': ", ".join("_pyrseas_g.%s" % name for name in names)})
+        stmts.append("DROP TABLE %s" % stage)
+        return stmts
+
+    def data_load(self, dirpath):
+        """Generate SQL to replace the table's data by that in its files
+
+        :param dirpath: full path for the directory for the file
+        :return: list of SQL statements
+
+        If the export is described by a manifest, the generated SQL
+        checks the number of rows loaded and, for binary data, that the
+        server has the same major version as the one exported from.
+        """
+        stmts = []
+        manifest = self.read_manifest(dirpath) if self.uses_manifest() \
+            else None
+        files = self.data_files(dirpath)
+        fmt = self.data_format()
+        if fmt == 'binary' and manifest.get('server_version'):
+            version = manifest['server_version']
+            divisor = 10000 if version >= 100000 else 100
+            stmts.append(
+                "DO $$BEGIN IF current_setting('server_version_num')::integer"
+                " / %d <> %d THEN RAISE EXCEPTION 'Binary data for %s was "
+                "exported from server version %d'; END IF; END$$" % (
+                    divisor, version // divisor,
+                    self.qualname().replace("'", "''"), version))
+        if self.data_merged():
+            stmts.extend(self._data_merge(files, fmt))
+        else:
+            stmts.append("TRUNCATE ONLY %s" % self.qualname())
+            for filepath in files:
+                stmts.append(self._copy_stmt(self.qualname(), filepath, fmt))
+        if manifest is not None:
+            rows = [chunk.get('rows') for chunk in manifest['chunks']]
+            if None not in rows and min(rows) >= 0:
+                stmts.append(
+                    "DO $$BEGIN IF (SELECT count(*) FROM %s) <> %d THEN "
+                    "RAISE EXCEPTION 'Table %s: expected %d rows'; END IF; "
+                    "END$$" % (self.qualname(), sum(rows),
+                               self.qualname().replace("'", "''"),
+                               sum(rows)))
+        return stmts
 
     def data_import(self, dirpath):
         """Generate SQL to import data into a table
@@ -479,14 +846,13 @@ class Table(DbClass):
         :param dirpath: full path for the directory for the file
         :return: list of SQL statements
         """
-        filepath = os.path.join(dirpath, self.extern_filename('data'))
+        if self.data_merged():
+            return self.data_load(dirpath)
         stmts = []
         if hasattr(self, 'referred_by'):
             stmts.append("ALTER TABLE %s DROP CONSTRAINT %s" % (
                 self.referred_by._table.qualname(), self.referred_by.name))
-        stmts.append("TRUNCATE ONLY %s" % self.qualname())
-        stmts.append(("\\copy ", self.qualname(), " from '", filepath,
-                      "' csv"))
+        stmts.extend(self.data_load(dirpath))
         if hasattr(self, 'referred_by'):
             stmts.append(self.referred_by.add())
         return stmts
@@ -9,6 +9,7 @@ from pyrseas import __version__
 from pyrseas.yamlutil import yamldump
 from pyrseas.database import Database
 from pyrseas.cmdargs import cmd_parser, parse_args
+from pyrseas.datacopy import export_report
 
 
 def main(schema=None):
@@ -22,6 +23,12 @@ def main(schema=None):
     parser.add_argument('-x', '--no-privileges', action='store_true',
                         dest='no_privs',
                         help='exclude privilege (GRANT/REVOKE) information')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="export datacopy tables using N connections "
+                        "(default %(default)s)")
+    parser.add_argument('--progress', action='store_true',
+                        help="report the progress of exporting datacopy "
+                        "tables")
     group = parser.add_argument_group("Object inclusion/exclusion options",
                                       "(each can be given multiple times)")
     group.add_argument('-n', '--schema', metavar='SCHEMA', dest='schemas',
@@ -44,9 +51,17 @@ def main(schema=None):
     options = cfg['options']
     if options.multiple_files and output:
         parser.error("Cannot specify both --multiple-files and --output")
+    if options.jobs < 1:
+        parser.error("Number of jobs must be a positive integer")
 
     db = Database(cfg)
+    if options.jobs > 1:
+        db.from_catalog()
+        if db.dbconn.version < 90200:
+            parser.error("--jobs requires PostgreSQL 9.2 or later")
     dbmap = db.to_map()
+    if db.export_results:
+        print(export_report(db.export_results), file=sys.stderr)
 
     if not options.multiple_files:
         print(yamldump(dbmap), file=output or sys.stdout)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.lib.compress
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Helper functions to read and write possibly compressed data files.
+    The compression codec is determined by the file name suffix, e.g.,
+    ``table.t1.data.gz``.  Data is streamed through the codec, so that
+    files are never held in memory.  Compression with zstd requires
+    the `zstandard` package.
+"""
+import gzip
+import hashlib
+import io
+
+CODECS = {'gzip': ('.gz', 'gzip -dc'), 'zstd': ('.zst', 'zstd -dc')}
+"""Supported codecs, with their file suffix and decompression command"""
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def codec_suffix(codec):
+    """Return the file suffix for a compression codec
+
+    :param codec: codec name, or None for no compression
+    :return: file suffix, e.g., '.gz'
+    """
+    if codec is None:
+        return ''
+    if codec not in CODECS:
+        raise ValueError("Unknown compression '%s': expected one of %s" % (
+            codec, ", ".join(sorted(CODECS))))
+    return CODECS[codec][0]
+
+
+def file_codec(path):
+    """Return the compression codec of a file, based on its suffix
+
+    :param path: file name/path
+    :return: codec name, or None if not compressed
+    """
+    for (codec, (suffix, command)) in CODECS.items():
+        if path.endswith(suffix):
+            return codec
+    return None
+
+
+def decompress_command(path):
+    """Return a shell command that writes a file decompressed to stdout
+
+    :param path: file name/path
+    :return: command, to be followed by the path, or None if the file
+        is not compressed
+    """
+    codec = file_codec(path)
+    if codec is None:
+        return None
+    return CODECS[codec][1]
+
+
+def open_file(path, mode='r'):
+    """Open a possibly compressed file
+
+    :param path: file name/path
+    :param mode: 'r' or 'w', optionally followed by 'b' for binary
+    :return: file object
+    """
+    binary = 'b' in mode
+    mode = mode.replace('b', '').replace('t', '')
+    codec = file_codec(path)
+    if codec is None:
+        return open(path, mode + ('b' if binary else ''))
+    if codec == 'gzip':
+        fileobj = gzip.open(path, mode + 'b', GZIP_LEVEL)
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Compression with zstd requires the "
+                             "'zstandard' package")
+        rawfile = open(path, mode + 'b')
+        if mode == 'w':
+            fileobj = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL).stream_writer(rawfile, closefd=True)
+        else:
+            fileobj = zstandard.ZstdDecompressor().stream_reader(
+                rawfile, closefd=True)
+    if binary:
+        return fileobj
+    return io.TextIOWrapper(fileobj, encoding='utf-8')
+
+
+def file_md5(path, blocksize=1024 * 1024):
+    """Return the MD5 checksum of a file, as stored
+
+    :param path: file name/path
+    :param blocksize: number of bytes to read at a time
+    :return: MD5 hex digest
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
@@ -6,13 +6,53 @@
     A `DbConnection` is a helper class representing a connection to a
     PostgreSQL database.
 """
+import re
 import sys
+from copy import copy
+from itertools import count
 
-from psycopg2 import connect
+from psycopg2 import connect, DatabaseError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import DictConnection
 
+from .compress import open_file
+from .progress import ProgressFile
 from .pycompat import PY2
 
+_cursor_ids = count(1)
+_prepared_ids = count(1)
+
+PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+
+INVALID_SQL_STATEMENT_NAME = '26000'
+FEATURE_NOT_SUPPORTED = '0A000'
+
+
+def prepared_text(query):
+    """Convert a query with psycopg2 placeholders for use by PREPARE
+
+    :param query: query text, with %(name)s or %s placeholders
+    :return: tuple of query text with $n parameters and list of
+        argument names, or number of arguments for %s placeholders
+    """
+    names = []
+    positional = [0]
+
+    def param(match):
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(0) == '%s':
+            positional[0] += 1
+            return '$%d' % positional[0]
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return '$%d' % (names.index(match.group(1)) + 1)
+
+    text = PLACEHOLDER.sub(param, query)
+    if names and positional[0]:
+        raise ValueError("Cannot mix named and positional placeholders")
+    return (text, names or positional[0])
+
 if PY2:
     from psycopg2.extensions import register_type, UNICODE
     register_type(UNICODE)
@@ -36,19 +76,38 @@ class DbConnection(object):
         self.host = '' if host is None else "host=%s " % host
         self.port = '' if port is None else "port=%d " % port
         self.conn = None
+        self.prepared = {}
+
+    def conninfo(self):
+        """Return the connection string
+
+        :return: libpq connection string
+        """
+        return "%s%sdbname=%s%s%s" % (self.host, self.port, self.dbname,
+                                      self.user, self.pswd)
 
     def connect(self):
         """Connect to the database"""
         try:
-            self.conn = connect("%s%sdbname=%s%s%s" % (
-                self.host, self.port, self.dbname, self.user, self.pswd),
-                connection_factory=DictConnection)
+            self.conn = connect(self.conninfo(),
+                                connection_factory=DictConnection)
+            self.prepared = {}
         except Exception as exc:
             if str(exc)[:6] == 'FATAL:':
                 sys.exit("Database connection error: %s" % str(exc)[8:])
             else:
                 raise exc
 
+    def clone(self):
+        """Return a new, not yet connected, connection to the same database
+
+        :return: DbConnection (or subclass) object
+        """
+        other = copy(self)
+        other.conn = None
+        other.prepared = {}
+        return other
+
     def close(self):
         """Close the database connection"""
         if self.conn and not self.conn.closed:
@@ -81,6 +140,66 @@ class DbConnection(object):
             raise exc
         return curs
 
+    def _execute_prepared(self, query, args):
+        """Prepare a query, if not yet prepared, and execute it
+
+        :param query: text of the statement to execute
+        :param args: arguments to query
+        :return: cursor
+        """
+        if query not in self.prepared:
+            (text, argnames) = prepared_text(query)
+            name = "pyrseas_%d" % next(_prepared_ids)
+            self.execute("PREPARE %s AS %s" % (name, text)).close()
+            self.prepared[query] = (name, argnames)
+        (name, argnames) = self.prepared[query]
+        if isinstance(argnames, list):
+            args = [args[argname] for argname in argnames]
+            nargs = len(argnames)
+        else:
+            nargs = argnames
+        if not nargs:
+            return self.execute("EXECUTE %s" % name)
+        return self.execute("EXECUTE %s (%s)" % (
+            name, ", ".join(['%s'] * nargs)), args)
+
+    def execute_prepared(self, query, args=None):
+        """Execute a query as a server-side prepared statement
+
+        :param query: text of the statement to execute
+        :param args: arguments to query
+        :return: cursor
+
+        The first time a given query is executed on a connection, it
+        is prepared with PREPARE, so that the server parses and plans
+        it only once, and it is then run with EXECUTE.  Prepared
+        statements are forgotten when the connection is reopened.  If
+        the prepared statement no longer exists, e.g., it was removed
+        by DISCARD ALL, or its result type has changed because of
+        schema changes, the query is prepared again.  It is then
+        retried if no transaction was in progress, since the error has
+        rolled back the transaction; otherwise the error is raised.
+        """
+        if self.conn is None or self.conn.closed:
+            self.connect()
+        idle = self.conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        try:
+            return self._execute_prepared(query, args)
+        except DatabaseError as exc:
+            if exc.pgcode not in (INVALID_SQL_STATEMENT_NAME,
+                                  FEATURE_NOT_SUPPORTED):
+                raise
+            if exc.pgcode == FEATURE_NOT_SUPPORTED:
+                if 'cached plan' not in str(exc):
+                    raise
+                self.execute("DEALLOCATE %s" %
+                             self.prepared[query][0]).close()
+            del self.prepared[query]
+            if not idle:
+                raise
+            self.rollback()
+            return self._execute_prepared(query, args)
+
     def fetchone(self, query, args=None):
         """Execute a single row SELECT query and return row
 
@@ -109,52 +228,151 @@ class DbConnection(object):
         curs.close()
         return rows
 
-    def copy_to(self, path, table, sep=','):
+    def copy_expert(self, sql, fileobj):
+        """Execute an SQL COPY command from or to a file object
+
+        :param sql: SQL copy command
+        :param fileobj: file-like object to read from or write to
+        :return: number of rows copied (-1 if not known)
+        """
+        if self.conn is None or self.conn.closed:
+            self.connect()
+        curs = self.conn.cursor()
+        try:
+            curs.copy_expert(sql, fileobj)
+        except:
+            self.conn.rollback()
+            raise
+        finally:
+            curs.close()
+        return curs.rowcount
+
+    def fetchiter(self, query, args=None, size=1000):
+        """Execute a SELECT query and generate its rows
+
+        :param query: a SELECT query to be executed
+        :param args: arguments to query
+        :param size: number of rows to fetch at a time
+        :return: generator of psycopg2 DictRow's
+
+        The rows are fetched through a server-side (named) cursor,
+        which is closed when all rows have been read or the generator
+        is closed.  The cursor only exists while the current
+        transaction is open.
+        """
+        if self.conn is None or self.conn.closed:
+            self.connect()
+        curs = self.conn.cursor(name="pyrseas_%d" % next(_cursor_ids))
+        curs.itersize = size
+        try:
+            curs.execute(query, args)
+            for row in curs:
+                yield row
+        finally:
+            if not self.conn.closed:
+                curs.close()
+
+    @staticmethod
+    def _track(fileobj, progress, binary=False):
+        """Return a file object counting the data copied, if requested
+
+        :param fileobj: file object to be passed to psycopg2
+        :param progress: CopyProgress to update, or None
+        :param binary: the COPY uses binary format
+        :return: file object
+        """
+        if progress is None:
+            return fileobj
+        return ProgressFile(fileobj, progress, binary)
+
+    def copy_to(self, path, table, sep=',', progress=None):
         """Execute a COPY command to a file
 
         :param path: file name/path to copy into
         :param table: possibly schema qualified table name
         :param sep: separator between columns
+        :param progress: CopyProgress to update, if any
+
+        The file is compressed if its suffix is that of a supported codec.
         """
         if self.conn is None or self.conn.closed:
             self.connect()
-        with open(path, 'w') as f:
+        with open_file(path, 'w') as f:
             curs = self.conn.cursor()
             try:
-                curs.copy_to(f, table, sep)
+                curs.copy_to(self._track(f, progress), table, sep)
             except:
                 curs.close()
                 raise
+        if progress is not None:
+            progress.finish(curs.rowcount)
 
-    def sql_copy_to(self, sql, path):
+    def sql_copy_to(self, sql, path, binary=False, progress=None):
         """Execute an SQL COPY command to a file
 
         :param sql: SQL copy command
         :param path: file name/path to copy into
+        :param binary: the COPY uses binary format
+        :param progress: CopyProgress to update, if any
+        :return: number of rows copied (-1 if not known)
+
+        The file is compressed if its suffix is that of a supported codec.
         """
         if self.conn is None or self.conn.closed:
             self.connect()
-        with open(path, 'w') as f:
+        with open_file(path, 'wb' if binary else 'w') as f:
             curs = self.conn.cursor()
             try:
-                curs.copy_expert(sql, f)
-            except:
+                curs.copy_expert(sql, self._track(f, progress, binary))
+            finally:
                 curs.close()
-                raise
+        if progress is not None:
+            progress.finish(curs.rowcount)
+        return curs.rowcount
 
-    def copy_from(self, path, table, sep=','):
+    def copy_from(self, path, table, sep=',', progress=None):
         """Execute a COPY command from a file
 
         :param path: file name/path to copy from
         :param table: possibly schema qualified table name
         :param sep: separator between columns
+        :param progress: CopyProgress to update, if any
+
+        The file is decompressed if its suffix is that of a supported
+        codec.
         """
         if self.conn is None or self.conn.closed:
             self.connect()
-        with open(path, 'r') as f:
+        with open_file(path, 'r') as f:
             curs = self.conn.cursor()
             try:
-                curs.copy_from(f, table, sep)
+                curs.copy_from(self._track(f, progress), table, sep)
             except:
                 curs.close()
                 raise
+        if progress is not None:
+            progress.finish(curs.rowcount)
+
+    def sql_copy_from(self, sql, path, binary=False, progress=None):
+        """Execute an SQL COPY command from a file
+
+        :param sql: SQL copy command
+        :param path: file name/path to copy from
+        :param binary: the COPY uses binary format
+        :param progress: CopyProgress to update, if any
+        :return: number of rows copied (-1 if not known)
+
+        The file is decompressed if its suffix is that of a supported
+        codec.
+        """
+        if self.conn is None or self.conn.closed:
+            self.connect()
+        with open_file(path, 'rb' if binary else 'r') as f:
+            curs = self.conn.cursor()
+            try:
+                curs.copy_expert(sql, self._track(f, progress, binary))
+            finally:
+                curs.close()
+        if progress is not None:
+            progress.finish(curs.rowcount)
+        return curs.rowcount
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.lib.dbpool
+    ~~~~~~~~~~~~~~~~~~
+
+    A `ConnectionPool` shares a set of `DbConnection` objects among
+    threads.  A `ThreadLocalConnection` can be passed wherever a
+    `DbConnection` is expected, e.g., to `RelVar.connect`, and uses a
+    connection checked out from the pool by the current thread.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2 import Error
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of database connections"""
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, dbconn, minconn=1, maxconn=10, check_interval=30):
+        """Initialize the pool and open the minimum number of connections
+
+        :param dbconn: DbConnection (or subclass, e.g., CatDbConnection)
+            object, cloned to open the pool's connections
+        :param minconn: number of idle connections kept open
+        :param maxconn: maximum number of connections open at a time
+        :param check_interval: seconds a connection may stay idle
+            before it is checked with a query when checked out
+        """
+        if minconn > maxconn:
+            raise ValueError("Minimum number of connections (%d) exceeds "
+                             "maximum (%d)" % (minconn, maxconn))
+        self.template = dbconn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.check_interval = check_interval
+        self.idle = []
+        self.size = 0
+        self.waiting = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.local = threading.local()
+        for i in range(minconn):
+            conn = dbconn.clone()
+            conn.connect()
+            self.idle.append((conn, self.clock()))
+            self.size += 1
+
+    def _check(self, conn, since):
+        """Make sure an idle connection is usable, reconnecting if not
+
+        :param conn: DbConnection object
+        :param since: time when the connection was returned to the pool
+        """
+        if conn.conn is None or conn.conn.closed:
+            conn.connect()
+        elif self.clock() - since > self.check_interval:
+            try:
+                conn.execute("SELECT 1").close()
+                conn.rollback()
+            except Error:
+                conn.close()
+                conn.connect()
+
+    def getconn(self, timeout=None):
+        """Check out a connection
+
+        :param timeout: seconds to wait for a connection if the maximum
+            number are in use (wait indefinitely if None)
+        :return: DbConnection object
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise PoolError("connection pool is closed")
+                if self.idle:
+                    (conn, since) = self.idle.pop()
+                    break
+                if self.size < self.maxconn:
+                    (conn, since) = (None, None)
+                    self.size += 1
+                    break
+                if deadline is not None and self.clock() >= deadline:
+                    raise PoolError("timed out waiting for a connection")
+                self.waiting += 1
+                try:
+                    self.cond.wait(None if deadline is None
+                                   else deadline - self.clock())
+                finally:
+                    self.waiting -= 1
+        try:
+            if conn is None:
+                conn = self.template.clone()
+                conn.connect()
+            else:
+                self._check(conn, since)
+        except:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool
+
+        :param conn: DbConnection object obtained from getconn
+        :param close: indicates the connection should be closed
+
+        An open transaction is rolled back.  The connection is closed
+        if it is broken or if there are already `minconn` idle
+        connections and no thread is waiting for one.
+        """
+        if not close and conn.conn is not None and not conn.conn.closed:
+            status = conn.conn.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Error:
+                    close = True
+        with self.cond:
+            if close or self.closed or (len(self.idle) >= self.minconn and
+                                        not self.waiting):
+                conn.close()
+                self.size -= 1
+            else:
+                self.idle.append((conn, self.clock()))
+            self.cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection for the duration of a `with` block
+
+        :param timeout: seconds to wait for a connection
+        :return: context manager giving a DbConnection object
+
+        Any transaction not committed at the end of the block is
+        rolled back.
+        """
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def thread_connection(self):
+        """Return the connection checked out by the current thread
+
+        :return: DbConnection object
+
+        A connection is checked out on the first call in each thread
+        and kept until `release_thread` is called.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.getconn()
+            self.local.conn = conn
+        return conn
+
+    def release_thread(self):
+        """Return the connection of the current thread to the pool"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            self.local.conn = None
+            self.putconn(conn)
+
+    def closeall(self):
+        """Close the idle connections and refuse further checkouts
+
+        Connections checked out are closed when they are returned.
+        """
+        with self.cond:
+            self.closed = True
+            for (conn, since) in self.idle:
+                conn.close()
+            self.size -= len(self.idle)
+            self.idle = []
+            self.cond.notify_all()
+
+
+class ThreadLocalConnection(object):
+    """A stand-in for a DbConnection, using a connection per thread
+
+    Attributes and methods, e.g., `execute` or `commit`, are those of
+    the connection checked out from the pool by the current thread.
+    """
+
+    def __init__(self, pool):
+        """Initialize the stand-in
+
+        :param pool: ConnectionPool object
+        """
+        self.pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self.pool.thread_connection(), name)
+
+    def clone(self):
+        """Return a new, not yet connected, connection to the same database
+
+        :return: DbConnection (or subclass) object
+        """
+        return self.pool.template.clone()
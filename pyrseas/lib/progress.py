@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.lib.progress
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Helpers to report the progress of long running COPY operations.  A
+    `ProgressFile` wraps the file object passed to psycopg2, counting
+    the bytes, and for text formats the rows, going through it into a
+    `CopyProgress`, which periodically reports the throughput and
+    estimated time to completion.
+"""
+from __future__ import print_function
+import sys
+import time
+
+INTERVAL = 5.0
+"""Seconds between progress reports"""
+
+
+def format_bytes(size):
+    """Return a size in bytes in human readable form
+
+    :param size: number of bytes
+    :return: string
+    """
+    for unit in ['bytes', 'kB', 'MB', 'GB']:
+        if abs(size) < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = 'TB'
+    return ("%d %s" if unit == 'bytes' else "%.1f %s") % (size, unit)
+
+
+def format_seconds(secs):
+    """Return a duration in seconds as hours, minutes and seconds
+
+    :param secs: number of seconds
+    :return: string
+    """
+    secs = int(secs + 0.5)
+    return "%d:%02d:%02d" % (secs // 3600, secs // 60 % 60, secs % 60)
+
+
+def print_progress(message):
+    """Print a progress message to standard error
+
+    :param message: text of the message
+    """
+    print(message, file=sys.stderr)
+
+
+class CopyProgress(object):
+    """The progress of copying the data of a table to or from a file"""
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, label, total_rows=None, total_bytes=None,
+                 callback=None, interval=INTERVAL):
+        """Start tracking a copy
+
+        :param label: name of the table, used in messages
+        :param total_rows: estimated number of rows, e.g., from reltuples
+        :param total_bytes: number of bytes, e.g., the size of the file
+        :param callback: function called with each progress message
+        :param interval: seconds between progress messages
+        """
+        self.label = label
+        self.total_rows = total_rows
+        self.total_bytes = total_bytes
+        self.callback = callback
+        self.interval = interval
+        self.rows = 0
+        self.bytes = 0
+        self.start = self.last = self.clock()
+        self.end = None
+
+    def update(self, data, binary=False):
+        """Count data read or written, reporting progress if due
+
+        :param data: the data read or written
+        :param binary: the data is in binary COPY format (rows are not
+            counted)
+        """
+        self.bytes += len(data)
+        if not binary:
+            self.rows += data.count(b'\n' if isinstance(data, bytes)
+                                    else '\n')
+        now = self.clock()
+        if self.callback is not None and now - self.last >= self.interval:
+            self.last = now
+            self.callback(self.message(now))
+
+    def message(self, now=None):
+        """Return a message describing the progress so far
+
+        :param now: current time
+        :return: string
+        """
+        elapsed = max((now or self.clock()) - self.start, 0.001)
+        msg = "%s: %d rows, %s (%d rows/s, %s/s)" % (
+            self.label, self.rows, format_bytes(self.bytes),
+            self.rows / elapsed, format_bytes(self.bytes / elapsed))
+        done = None
+        if self.total_rows and self.rows:
+            done = float(self.rows) / self.total_rows
+        elif self.total_bytes and self.bytes:
+            done = float(self.bytes) / self.total_bytes
+        if done is not None and done < 1:
+            msg += ", %d%%, ETA %s" % (done * 100, format_seconds(
+                elapsed * (1 - done) / done))
+        return msg
+
+    def finish(self, rows=-1):
+        """Record the end of the copy
+
+        :param rows: number of rows copied, if known (-1 otherwise)
+        """
+        self.end = self.clock()
+        if rows >= 0:
+            self.rows = rows
+
+    def result(self):
+        """Return the totals of the copy
+
+        :return: dictionary with table, rows, bytes and seconds
+        """
+        return {'table': self.label, 'rows': self.rows, 'bytes': self.bytes,
+                'seconds': (self.end or self.clock()) - self.start}
+
+
+class ProgressFile(object):
+    """A file object counting the data read or written through it"""
+
+    def __init__(self, fileobj, progress, binary=False):
+        """Wrap a file object
+
+        :param fileobj: file object passed to psycopg2
+        :param progress: CopyProgress to update
+        :param binary: the file holds binary COPY data
+        """
+        self._file = fileobj
+        self._progress = progress
+        self._binary = binary
+
+    def read(self, size=-1):
+        "Read and count data"
+        data = self._file.read(size)
+        self._progress.update(data, self._binary)
+        return data
+
+    def readline(self, size=-1):
+        "Read and count a line"
+        data = self._file.readline(size)
+        self._progress.update(data, self._binary)
+        return data
+
+    def write(self, data):
+        "Write and count data"
+        self._file.write(data)
+        self._progress.update(data, self._binary)
+
+    def __getattr__(self, name):
+        "Delegate other attributes to the file object"
+        return getattr(self._file, name)
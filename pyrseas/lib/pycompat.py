@@ -11,5 +11,7 @@ PY2 = sys.version_info[0] == 2
 
 if not PY2:
     strtypes = (str, )
+    from shlex import quote as shell_quote
 else:
     strtypes = (str, unicode)
+    from pipes import quote as shell_quote
@@ -0,0 +1,535 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.plan
+    ~~~~~~~~~~~~
+
+    Functions to analyze the list of SQL statements (the migration
+    plan) generated by `Database.diff_map`.  Each statement is
+    classified by the table-level lock it takes and by whether it
+    rewrites or scans a whole table, so that the cost of applying the
+    plan can be estimated before running it.
+"""
+import os
+import re
+
+from pyrseas.lib.progress import format_bytes
+from pyrseas.lib.pycompat import shell_quote, strtypes
+from pyrseas.dbobject import split_schema_obj
+
+LOCK_MODES = ['ACCESS SHARE', 'ROW SHARE', 'ROW EXCLUSIVE',
+              'SHARE UPDATE EXCLUSIVE', 'SHARE', 'SHARE ROW EXCLUSIVE',
+              'EXCLUSIVE', 'ACCESS EXCLUSIVE']
+"""PostgreSQL table-level lock modes, from weakest to strongest"""
+
+EFFECTS = [None, 'load', 'scan', 'rewrite']
+"""Whole-table effects of a statement, from cheapest to costliest"""
+
+DEFAULT_RATES = {'scan_rate': 100, 'rewrite_rate': 30, 'load_rate': 20}
+"""Default throughput assumptions, in megabytes per second"""
+
+VOLATILE_DEFAULTS = ['nextval(', 'random(', 'clock_timestamp(',
+                     'gen_random_uuid(', 'uuid_generate_']
+
+IDENT = r'(?:"(?:[^"]|"")+"|[^\s."(),]+)'
+QUALNAME = r'(%s(?:\.%s)?)' % (IDENT, IDENT)
+
+ALTER_TABLE = re.compile(r'ALTER\s+TABLE\s+(?:ONLY\s+)?' + QUALNAME +
+                         r'\s+(.*)$', re.S | re.I)
+CREATE_INDEX = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(CONCURRENTLY\s+)?'
+                          r'(?:%s\s+)?ON\s+(?:ONLY\s+)?%s' % (IDENT, QUALNAME),
+                          re.S | re.I)
+TABLE_STMT = re.compile(r'(DROP\s+TABLE|TRUNCATE(?:\s+ONLY)?|CLUSTER|'
+                        r'VACUUM\s+FULL)\s+' + QUALNAME, re.S | re.I)
+TRIGGER_STMT = re.compile(r'(CREATE|DROP)\s+TRIGGER\s+.*?\s+ON\s+' +
+                          QUALNAME, re.S | re.I)
+RULE_STMT = re.compile(r'(?:CREATE|DROP)\s+RULE\s+.*?\s+ON\s+' + QUALNAME,
+                       re.S | re.I)
+ALTER_COLUMN = re.compile(r'ALTER\s+(?:COLUMN\s+)?%s\s+(.*)$' % IDENT,
+                          re.S | re.I)
+REFERENCES = re.compile(r'\sREFERENCES\s+' + QUALNAME, re.S | re.I)
+CLAUSE_TARGET = re.compile(r'(ADD|ALTER|DROP)\s+(?:(COLUMN|CONSTRAINT)\s+)?'
+                           r'(?:IF\s+EXISTS\s+)?(%s)(.*)$' % IDENT,
+                           re.S | re.I)
+HOPPABLE = re.compile(r'(COMMENT\s+ON|GRANT|REVOKE)\s', re.I)
+UNMERGEABLE = ['RENAME', 'SET SCHEMA']
+CONSTRAINT_KEYWORDS = ['PRIMARY', 'UNIQUE', 'FOREIGN', 'CHECK', 'EXCLUDE']
+
+
+def split_clauses(text):
+    """Split a list of ALTER TABLE subcommands at top-level commas
+
+    :param text: subcommands, e.g., "ADD COLUMN c1 integer, DROP c2"
+    :return: list of strings
+    """
+    clauses = []
+    level = 0
+    quote = None
+    start = 0
+    for i, c in enumerate(text):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in ("'", '"'):
+            quote = c
+        elif c == '(':
+            level += 1
+        elif c == ')':
+            level -= 1
+        elif c == ',' and level == 0:
+            clauses.append(text[start:i].strip())
+            start = i + 1
+    clauses.append(text[start:].strip())
+    return [clause for clause in clauses if clause]
+
+
+def stmt_text(stmt):
+    """Return the text of a generated statement
+
+    :param stmt: SQL statement or a `\\copy` tuple
+    :return: string
+
+    The path of a `\\copy` tuple is written as part of a psql literal,
+    after quoting it for the shell if it is passed to a program.
+    """
+    if isinstance(stmt, tuple):
+        (copy, relname, source, path, fmt) = stmt
+        if source.startswith(" from program "):
+            path = shell_quote(path)
+        return "".join((copy, relname, source, path.replace("'", "''"),
+                        fmt))
+    return stmt
+
+
+def stronger_lock(mode1, mode2):
+    """Return the stronger of two lock modes
+
+    :param mode1: lock mode or None
+    :param mode2: lock mode or None
+    :return: lock mode or None
+    """
+    if mode1 is None:
+        return mode2
+    if mode2 is None:
+        return mode1
+    return LOCK_MODES[max(LOCK_MODES.index(mode1), LOCK_MODES.index(mode2))]
+
+
+def costlier_effect(effect1, effect2):
+    """Return the costlier of two whole-table effects
+
+    :param effect1: effect or None
+    :param effect2: effect or None
+    :return: effect or None
+    """
+    return EFFECTS[max(EFFECTS.index(effect1), EFFECTS.index(effect2))]
+
+
+def _alter_clause(clause, version):
+    """Classify a single ALTER TABLE subcommand
+
+    :param clause: the subcommand text
+    :param version: server version number (or None if unknown)
+    :return: tuple of lock mode, effect and referenced table (if any)
+    """
+    upper = ' '.join(clause.upper().split())
+    lock = 'ACCESS EXCLUSIVE'
+    effect = None
+    reftable = None
+    if upper.startswith('ADD CONSTRAINT') or upper.startswith(
+            'ADD PRIMARY KEY') or upper.startswith('ADD UNIQUE') or \
+            upper.startswith('ADD FOREIGN KEY') or upper.startswith(
+            'ADD CHECK'):
+        notvalid = upper.endswith('NOT VALID')
+        if ' FOREIGN KEY ' in ' %s ' % upper:
+            lock = 'SHARE ROW EXCLUSIVE'
+            match = REFERENCES.search(clause)
+            if match:
+                reftable = match.group(1)
+            if not notvalid:
+                effect = 'scan'
+        elif ' CHECK ' in ' %s ' % upper or ' CHECK(' in upper:
+            if not notvalid:
+                effect = 'scan'
+        elif ' USING INDEX ' not in upper or ' USING INDEX TABLESPACE' in \
+                upper:
+            # primary keys and unique constraints build an index
+            effect = 'scan'
+    elif upper.startswith('ADD'):
+        # ADD [COLUMN]
+        if ' DEFAULT ' in ' %s ' % upper:
+            if version is None or version < 110000 or [
+                    func for func in VOLATILE_DEFAULTS if func.upper()
+                    in upper]:
+                effect = 'rewrite'
+    elif upper.startswith('ALTER'):
+        match = ALTER_COLUMN.match(clause)
+        action = ' '.join(match.group(1).upper().split()) if match else ''
+        if action.startswith('TYPE ') or action.startswith('SET DATA TYPE '):
+            effect = 'rewrite'
+        elif action == 'SET NOT NULL':
+            effect = 'scan'
+        elif action.startswith('SET STATISTICS') or action.startswith(
+                'SET (') or action.startswith('RESET (') or \
+                action.startswith('SET STORAGE'):
+            lock = 'SHARE UPDATE EXCLUSIVE'
+    elif upper.startswith('VALIDATE CONSTRAINT'):
+        lock = 'SHARE UPDATE EXCLUSIVE'
+        effect = 'scan'
+    elif upper.startswith('SET TABLESPACE'):
+        effect = 'rewrite'
+    elif upper.startswith('SET (') or upper.startswith('RESET (') or \
+            upper.startswith('SET WITHOUT CLUSTER') or \
+            upper.startswith('CLUSTER ON'):
+        lock = 'SHARE UPDATE EXCLUSIVE'
+    elif upper.startswith('ENABLE') or upper.startswith('DISABLE'):
+        lock = 'SHARE ROW EXCLUSIVE'
+    elif upper.startswith('SET WITH OIDS') or upper.startswith(
+            'SET WITHOUT OIDS') or upper.startswith('SET LOGGED') or \
+            upper.startswith('SET UNLOGGED'):
+        effect = 'rewrite'
+    return (lock, effect, reftable)
+
+
+class StatementInfo(object):
+    """The locking and whole-table effects of a generated statement"""
+
+    def __init__(self, stmt, version=None):
+        """Classify a statement
+
+        :param stmt: SQL statement or a `\\copy` tuple
+        :param version: server version number (or None if unknown)
+
+        After initialization, :attr:`table` is the (possibly schema
+        qualified) name of the table principally affected by the
+        statement, :attr:`locks` is a list of (table, lock mode)
+        tuples, :attr:`lock` is the strongest lock taken and
+        :attr:`effect` is one of 'rewrite', 'scan', 'load' or None.
+        """
+        self.stmt = stmt
+        self.table = None
+        self.locks = []
+        self.effect = None
+        if isinstance(stmt, tuple):
+            # expected format: (\copy, table [(columns)], from, path,
+            # format)
+            self.table = stmt[1].split(' (')[0]
+            self.locks.append((self.table, 'ROW EXCLUSIVE'))
+            self.effect = 'load'
+            return
+        text = stmt.strip()
+        match = ALTER_TABLE.match(text)
+        if match:
+            self.table = match.group(1)
+            lock = None
+            for clause in split_clauses(match.group(2)):
+                (mode, effect, reftable) = _alter_clause(clause, version)
+                lock = stronger_lock(lock, mode)
+                self.effect = costlier_effect(self.effect, effect)
+                if reftable is not None and reftable != self.table:
+                    self.locks.append((reftable, 'SHARE ROW EXCLUSIVE'))
+            self.locks.insert(0, (self.table, lock))
+            return
+        match = CREATE_INDEX.match(text)
+        if match:
+            self.table = match.group(2)
+            self.effect = 'scan'
+            self.locks.append((self.table, 'SHARE UPDATE EXCLUSIVE'
+                               if match.group(1) else 'SHARE'))
+            return
+        match = TABLE_STMT.match(text)
+        if match:
+            self.table = match.group(2)
+            verb = match.group(1).upper()
+            if verb.startswith('CLUSTER') or verb.startswith('VACUUM'):
+                self.effect = 'rewrite'
+            self.locks.append((self.table, 'ACCESS EXCLUSIVE'))
+            return
+        match = TRIGGER_STMT.match(text)
+        if match:
+            self.table = match.group(2)
+            self.locks.append((self.table, 'SHARE ROW EXCLUSIVE'
+                               if match.group(1).upper() == 'CREATE'
+                               else 'ACCESS EXCLUSIVE'))
+            return
+        match = RULE_STMT.match(text)
+        if match:
+            self.table = match.group(1)
+            self.locks.append((self.table, 'ACCESS EXCLUSIVE'))
+
+    @property
+    def lock(self):
+        "The strongest table-level lock taken by the statement"
+        lock = None
+        for (table, mode) in self.locks:
+            lock = stronger_lock(lock, mode)
+        return lock
+
+
+def _table_key(name):
+    """Return a (schema, table) key for a possibly qualified table name
+
+    :param name: table name as it appears in a statement
+    :return: tuple
+    """
+    (sch, tbl) = split_schema_obj(name)
+    if sch[0] == '"' and sch[-1:] == '"':
+        sch = sch[1:-1]
+    return (sch.replace('""', '"'), tbl.replace('""', '"'))
+
+
+def table_sizes(dbconn):
+    """Return the sizes of the tables in a database
+
+    :param dbconn: a DbConnection object
+    :return: dictionary keyed by (schema, table)
+    """
+    sizes = {}
+    block_size = int(dbconn.fetchone("SHOW block_size")[0])
+    for row in dbconn.fetchall(
+            """SELECT nspname, relname, relpages, reltuples,
+                      pg_total_relation_size(c.oid) AS total_bytes
+               FROM pg_class c
+                    JOIN pg_namespace ON (relnamespace = pg_namespace.oid)
+               WHERE relkind in ('r', 'm')
+                     AND (nspname != 'pg_catalog'
+                          AND nspname != 'information_schema')"""):
+        sizes[(row['nspname'], row['relname'])] = {
+            'pages': row['relpages'], 'rows': int(row['reltuples']),
+            'heap_bytes': row['relpages'] * block_size,
+            'total_bytes': row['total_bytes']}
+    dbconn.rollback()
+    return sizes
+
+
+def estimate_plan(dbconn, stmts, rates=None):
+    """Annotate a migration plan with lock and time estimates
+
+    :param dbconn: a DbConnection object
+    :param stmts: list of SQL statements, as returned by diff_map
+    :param rates: dictionary overriding DEFAULT_RATES
+    :return: list of dictionaries, one per statement
+
+    The time estimate for a statement that rewrites a table is based
+    on the table's total size (including indexes and TOAST data),
+    whereas a scan is based on the heap size as given by
+    `pg_class.relpages`.  Loads are based on the size of the data file.
+    """
+    mbrates = DEFAULT_RATES.copy()
+    mbrates.update(rates or {})
+    sizes = table_sizes(dbconn)
+    version = dbconn.version if hasattr(dbconn, 'version') else None
+    result = []
+    for stmt in stmts:
+        info = StatementInfo(stmt, version)
+        est = {'statement': stmt_text(stmt), 'lock': info.lock,
+               'effect': info.effect, 'table': info.table,
+               'locked_tables': [tbl for (tbl, mode) in info.locks],
+               'rows': None, 'bytes': None, 'seconds': 0.0}
+        size = None
+        if info.table is not None:
+            size = sizes.get(_table_key(info.table))
+        if size is not None:
+            est['rows'] = size['rows']
+            est['bytes'] = size['total_bytes']
+        nbytes = 0
+        if info.effect == 'rewrite' and size is not None:
+            nbytes = size['total_bytes']
+            rate = mbrates['rewrite_rate']
+        elif info.effect == 'scan' and size is not None:
+            nbytes = size['heap_bytes']
+            rate = mbrates['scan_rate']
+        elif info.effect == 'load' and os.path.exists(stmt[3]):
+            nbytes = os.path.getsize(stmt[3])
+            est['bytes'] = nbytes
+            rate = mbrates['load_rate']
+        if nbytes:
+            est['seconds'] = nbytes / (rate * 1024.0 * 1024.0)
+        result.append(est)
+    return result
+
+
+def estimate_report(estimates):
+    """Format the estimates returned by estimate_plan as text
+
+    :param estimates: list of dictionaries
+    :return: string
+    """
+    lines = []
+    total = 0.0
+    for (num, est) in enumerate(estimates):
+        total += est['seconds']
+        lines.append("%d. %s" % (num + 1, est['statement'].strip()))
+        if est['lock'] is None:
+            lines.append("   lock: none")
+            continue
+        descr = "   lock: %s on %s" % (est['lock'],
+                                       ", ".join(est['locked_tables']))
+        if est['effect'] is not None:
+            descr += "; %s" % est['effect']
+        if est['rows'] is not None:
+            descr += "; rows: %d" % est['rows']
+        if est['bytes'] is not None:
+            descr += "; size: %s" % format_bytes(est['bytes'])
+        if est['effect'] is not None:
+            descr += "; estimate: %.1f s" % est['seconds']
+        lines.append(descr)
+    lines.append("Statements: %d, rewrites: %d, scans: %d, "
+                 "estimated time: %.1f s" % (
+                     len(estimates),
+                     len([e for e in estimates if e['effect'] == 'rewrite']),
+                     len([e for e in estimates if e['effect'] == 'scan']),
+                     total))
+    return "\n".join(lines)
+
+
+class _AlterTable(object):
+    """An ALTER TABLE statement whose subcommands may be merged"""
+
+    def __init__(self, header, table, clauses):
+        self.header = header
+        self.table = table
+        self.clauses = clauses
+        self.targets = [_clause_target(clause) for clause in clauses]
+        self.refs = set()
+        for clause in clauses:
+            match = REFERENCES.search(clause)
+            if match and match.group(1) != table:
+                self.refs.add(match.group(1))
+
+    def text(self):
+        "Return the text of the (possibly merged) statement"
+        return "%s\n    %s" % (self.header, ",\n    ".join(self.clauses))
+
+    def has_drops(self):
+        "Does any subcommand drop a column or a constraint?"
+        return [tgt for tgt in self.targets if tgt[0] == 'DROP']
+
+    def compatible(self, other):
+        """Can the subcommands of another statement be added to this one?
+
+        :param other: an _AlterTable on the same table
+        :return: boolean
+
+        PostgreSQL executes the subcommands of an ALTER TABLE in
+        passes, e.g., all drops before column type changes and those
+        before column additions, so subcommands that depend on an
+        earlier subcommand on the same column or constraint are kept
+        in separate statements.
+        """
+        added = set(tgt[2] for tgt in self.targets if tgt[0] == 'ADD')
+        retyped = set(tgt[2] for tgt in self.targets if tgt[3])
+        altered = set(tgt[2] for tgt in self.targets if tgt[0] == 'ALTER')
+        tblspc = [clause for clause in self.clauses
+                  if clause.upper().startswith('SET TABLESPACE')]
+        for (tgt, clause) in zip(other.targets, other.clauses):
+            (action, kind, name, retype) = tgt
+            if action in ('ALTER', 'DROP') and name in added:
+                return False
+            if action == 'DROP' and name in altered:
+                return False
+            if retype and name in retyped:
+                return False
+            if tblspc and clause.upper().startswith('SET TABLESPACE'):
+                return False
+        return True
+
+
+def _clause_target(clause):
+    """Return the action and target of an ALTER TABLE subcommand
+
+    :param clause: the subcommand text
+    :return: tuple of action, kind, name and whether type is altered
+    """
+    match = CLAUSE_TARGET.match(clause)
+    if not match:
+        return (None, None, None, False)
+    action = match.group(1).upper()
+    kind = (match.group(2) or 'COLUMN').upper()
+    name = match.group(3)
+    if name.upper() in CONSTRAINT_KEYWORDS:
+        # unnamed constraint, e.g., ADD PRIMARY KEY (c1)
+        return (action, 'CONSTRAINT', None, False)
+    if action == 'ALTER' and name.upper() in ('CONSTRAINT', 'COLUMN'):
+        return (None, None, None, False)
+    if action == 'DROP' and name.upper() in ('NOT', 'DEFAULT'):
+        return (None, None, None, False)
+    rest = ' '.join(match.group(4).upper().split())
+    retype = action == 'ALTER' and (rest.startswith('TYPE ') or
+                                    rest.startswith('SET DATA TYPE '))
+    return (action, kind, name, retype)
+
+
+def _parse_alter(stmt):
+    """Parse a statement that may take part in merging
+
+    :param stmt: SQL statement or a `\\copy` tuple
+    :return: _AlterTable or None
+    """
+    if not isinstance(stmt, strtypes):
+        return None
+    text = stmt.strip()
+    match = ALTER_TABLE.match(text)
+    if not match:
+        return None
+    clauses = split_clauses(match.group(2))
+    for clause in clauses:
+        upper = ' '.join(clause.upper().split())
+        for verb in UNMERGEABLE:
+            if upper.startswith(verb):
+                return None
+    return _AlterTable(text[:match.start(2)].rstrip(), match.group(1),
+                       clauses)
+
+
+def coalesce_alters(stmts):
+    """Merge ALTER TABLE statements on the same table
+
+    :param stmts: list of SQL statements, as returned by diff_map
+    :return: list of SQL statements
+
+    Each ALTER TABLE can rewrite or scan the table and has to acquire
+    the table lock, so the subcommands of several ALTER TABLE
+    statements on the same table are merged into the first of them,
+    e.g., an ADD COLUMN, an ALTER COLUMN TYPE and an ADD CONSTRAINT
+    result in a single rewrite.  A later statement is only moved
+    ahead of intervening COMMENT, GRANT and REVOKE statements, and of
+    ALTER TABLE statements on other tables that neither reference it
+    nor are referenced by it, so that the dependency ordering of the
+    plan is preserved.  Any other statement ends the merging.
+    """
+    result = []
+    parsed = []
+    pending = {}
+    for stmt in stmts:
+        alter = _parse_alter(stmt)
+        if alter is None:
+            result.append(stmt)
+            parsed.append(None)
+            if not (isinstance(stmt, strtypes) and
+                    HOPPABLE.match(stmt.strip())):
+                pending = {}
+            continue
+        idx = pending.get(alter.table)
+        if idx is not None and parsed[idx].compatible(alter):
+            mergeable = True
+            drops = alter.has_drops()
+            for later in parsed[idx + 1:]:
+                if later is None:
+                    if drops:
+                        mergeable = False
+                        break
+                elif later.table in alter.refs or \
+                        alter.table in later.refs:
+                    mergeable = False
+                    break
+            if mergeable:
+                target = parsed[idx]
+                target.clauses.extend(alter.clauses)
+                target.targets.extend(alter.targets)
+                target.refs.update(alter.refs)
+                result[idx] = target.text()
+                continue
+        result.append(stmt)
+        parsed.append(alter)
+        pending[alter.table] = len(result) - 1
+    return result
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.plancache
+    ~~~~~~~~~~~~~~~~~
+
+    A `PlanCache` stores the list of SQL statements generated by
+    `Database.diff_map`, keyed by a hash of the input map, the options
+    and configuration that affect the generated statements, and a
+    fingerprint of the database catalogs.  Running yamltodb again with
+    the same input against a database with identical catalogs, e.g.,
+    another shard, reuses the stored statements without extracting
+    and comparing the catalogs.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from pyrseas import __version__
+
+CACHE_FORMAT = 1
+
+USER_NS = "%s.nspname NOT IN ('pg_catalog', 'information_schema') " \
+    "AND %s.nspname !~ '^pg_(toast|temp_)'"
+
+FINGERPRINT_QUERIES = [
+    ("""SELECT concat_ws('|', 'schema', n.nspname,
+                  pg_get_userbyid(n.nspowner), n.nspacl::text,
+                  obj_description(n.oid, 'pg_namespace'))
+        FROM pg_namespace n WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'class', n.nspname, c.relname, c.relkind,
+                  {relpersistence}, pg_get_userbyid(c.relowner),
+                  c.relacl::text, c.reloptions::text, s.spcname,
+                  obj_description(c.oid, 'pg_class'),
+                  CASE WHEN c.relkind IN ('v', 'm')
+                       THEN pg_get_viewdef(c.oid) END)
+        FROM pg_class c JOIN pg_namespace n ON (c.relnamespace = n.oid)
+             LEFT JOIN pg_tablespace s ON (c.reltablespace = s.oid)
+        WHERE c.relkind NOT IN ('i', 't') AND %s""" % (USER_NS % ('n', 'n')),
+     0),
+    ("""SELECT concat_ws('|', 'sequence', c.oid::regclass::text,
+                  query_to_xml('SELECT start_value, increment_by, '
+                               'max_value, min_value, cache_value, '
+                               'is_cycled FROM ' || c.oid::regclass::text,
+                               false, false, '')::text,
+                  (SELECT d.refobjid::regclass::text || '.' || a.attname
+                   FROM pg_depend d
+                        JOIN pg_attribute a ON (a.attrelid = d.refobjid
+                                                AND a.attnum = d.refobjsubid)
+                   WHERE d.classid = 'pg_class'::regclass
+                     AND d.objid = c.oid AND d.deptype = 'a'
+                     AND d.refclassid = 'pg_class'::regclass))
+        FROM pg_class c JOIN pg_namespace n ON (c.relnamespace = n.oid)
+        WHERE c.relkind = 'S' AND %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'column', a.attrelid::regclass::text,
+                  row_number() OVER (PARTITION BY a.attrelid
+                                     ORDER BY a.attnum),
+                  a.attname, format_type(a.atttypid, a.atttypmod),
+                  a.attnotnull, a.attstattarget, a.attstorage,
+                  pg_get_expr(d.adbin, d.adrelid), a.attacl::text,
+                  {attcollation},
+                  col_description(a.attrelid, a.attnum))
+        FROM pg_attribute a JOIN pg_class c ON (a.attrelid = c.oid)
+             JOIN pg_namespace n ON (c.relnamespace = n.oid)
+             LEFT JOIN pg_attrdef d ON (a.attrelid = d.adrelid
+                                        AND a.attnum = d.adnum)
+        WHERE a.attnum > 0 AND NOT a.attisdropped
+          AND c.relkind NOT IN ('i', 't') AND %s""" % (
+        USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'constraint',
+                  CASE WHEN c.conrelid <> 0 THEN c.conrelid::regclass::text
+                       ELSE c.contypid::regtype::text END,
+                  c.conname, pg_get_constraintdef(c.oid),
+                  obj_description(c.oid, 'pg_constraint'))
+        FROM pg_constraint c JOIN pg_namespace n ON (c.connamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'index', pg_get_indexdef(i.indexrelid),
+                  obj_description(i.indexrelid, 'pg_class'))
+        FROM pg_index i JOIN pg_class c ON (i.indexrelid = c.oid)
+             JOIN pg_namespace n ON (c.relnamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'function', n.nspname, p.proname,
+                  pg_get_function_identity_arguments(p.oid),
+                  pg_get_function_result(p.oid), l.lanname, md5(p.prosrc),
+                  p.probin, p.proconfig::text, p.provolatile, p.proisstrict,
+                  p.prosecdef, p.procost, p.prorows,
+                  pg_get_userbyid(p.proowner), p.proacl::text,
+                  obj_description(p.oid, 'pg_proc'))
+        FROM pg_proc p JOIN pg_namespace n ON (p.pronamespace = n.oid)
+             JOIN pg_language l ON (p.prolang = l.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'aggregate', a.aggfnoid::regprocedure::text,
+                  a.aggtransfn::regprocedure::text,
+                  a.aggfinalfn::regprocedure::text,
+                  a.aggtranstype::regtype::text, a.agginitval,
+                  a.aggsortop::regoperator::text)
+        FROM pg_aggregate a JOIN pg_proc p ON (a.aggfnoid = p.oid)
+             JOIN pg_namespace n ON (p.pronamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'type', n.nspname, t.typname, t.typtype,
+                  format_type(t.typbasetype, t.typtypmod), t.typnotnull,
+                  t.typdefault, pg_get_userbyid(t.typowner),
+                  obj_description(t.oid, 'pg_type'),
+                  (SELECT string_agg(enumlabel, ',' ORDER BY {enumorder})
+                   FROM pg_enum e WHERE e.enumtypid = t.oid))
+        FROM pg_type t JOIN pg_namespace n ON (t.typnamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'trigger', pg_get_triggerdef(t.oid),
+                  t.tgenabled, obj_description(t.oid, 'pg_trigger'))
+        FROM pg_trigger t JOIN pg_class c ON (t.tgrelid = c.oid)
+             JOIN pg_namespace n ON (c.relnamespace = n.oid)
+        WHERE NOT t.tgisinternal AND %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'rule', pg_get_ruledef(r.oid),
+                  obj_description(r.oid, 'pg_rewrite'))
+        FROM pg_rewrite r JOIN pg_class c ON (r.ev_class = c.oid)
+             JOIN pg_namespace n ON (c.relnamespace = n.oid)
+        WHERE r.rulename <> '_RETURN' AND %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'operator', o.oid::regoperator::text,
+                  o.oprcode::regproc::text, o.oprrest::regproc::text,
+                  o.oprjoin::regproc::text, o.oprcom::regoperator::text,
+                  o.oprnegate::regoperator::text, o.oprcanhash,
+                  o.oprcanmerge, pg_get_userbyid(o.oprowner),
+                  obj_description(o.oid, 'pg_operator'))
+        FROM pg_operator o JOIN pg_namespace n ON (o.oprnamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'opclass', n.nspname, o.opcname, a.amname,
+                  o.opcintype::regtype::text, o.opcdefault,
+                  pg_get_userbyid(o.opcowner))
+        FROM pg_opclass o JOIN pg_namespace n ON (o.opcnamespace = n.oid)
+             JOIN pg_am a ON (o.opcmethod = a.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'opfamily', n.nspname, o.opfname, a.amname,
+                  pg_get_userbyid(o.opfowner))
+        FROM pg_opfamily o JOIN pg_namespace n ON (o.opfnamespace = n.oid)
+             JOIN pg_am a ON (o.opfmethod = a.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'cast', c.castsource::regtype::text,
+                  c.casttarget::regtype::text,
+                  c.castfunc::regprocedure::text, c.castcontext,
+                  c.castmethod, obj_description(c.oid, 'pg_cast'))
+        FROM pg_cast c WHERE c.oid >= 16384""", 0),
+    ("""SELECT concat_ws('|', 'collation', n.nspname, c.collname,
+                  c.collcollate, c.collctype, pg_get_userbyid(c.collowner),
+                  obj_description(c.oid, 'pg_collation'))
+        FROM pg_collation c JOIN pg_namespace n ON (c.collnamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 90100),
+    ("""SELECT concat_ws('|', 'conversion', n.nspname, c.conname,
+                  pg_encoding_to_char(c.conforencoding),
+                  pg_encoding_to_char(c.contoencoding),
+                  c.conproc::regproc::text, c.condefault,
+                  obj_description(c.oid, 'pg_conversion'))
+        FROM pg_conversion c JOIN pg_namespace n ON (c.connamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'tsconfig', n.nspname, c.cfgname, p.prsname,
+                  obj_description(c.oid, 'pg_ts_config'))
+        FROM pg_ts_config c JOIN pg_namespace n ON (c.cfgnamespace = n.oid)
+             JOIN pg_ts_parser p ON (c.cfgparser = p.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'tsdict', n.nspname, d.dictname, t.tmplname,
+                  d.dictinitoption, obj_description(d.oid, 'pg_ts_dict'))
+        FROM pg_ts_dict d JOIN pg_namespace n ON (d.dictnamespace = n.oid)
+             JOIN pg_ts_template t ON (d.dicttemplate = t.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'tsparser', n.nspname, p.prsname,
+                  p.prsstart::regproc::text, p.prstoken::regproc::text,
+                  p.prsend::regproc::text, p.prsheadline::regproc::text,
+                  p.prslextype::regproc::text,
+                  obj_description(p.oid, 'pg_ts_parser'))
+        FROM pg_ts_parser p JOIN pg_namespace n ON (p.prsnamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'tstemplate', n.nspname, t.tmplname,
+                  t.tmplinit::regproc::text, t.tmpllexize::regproc::text,
+                  obj_description(t.oid, 'pg_ts_template'))
+        FROM pg_ts_template t JOIN pg_namespace n ON (t.tmplnamespace = n.oid)
+        WHERE %s""" % (USER_NS % ('n', 'n')), 0),
+    ("""SELECT concat_ws('|', 'extension', e.extname, e.extversion,
+                  n.nspname, obj_description(e.oid, 'pg_extension'))
+        FROM pg_extension e JOIN pg_namespace n ON (e.extnamespace = n.oid)
+     """, 90100),
+    ("""SELECT concat_ws('|', 'language', l.lanname, l.lanpltrusted,
+                  pg_get_userbyid(l.lanowner), l.lanacl::text,
+                  obj_description(l.oid, 'pg_language'))
+        FROM pg_language l WHERE l.oid >= 16384""", 0),
+    ("""SELECT concat_ws('|', 'fdw', w.fdwname, {fdwhandler},
+                  w.fdwvalidator::regproc::text, w.fdwoptions::text,
+                  pg_get_userbyid(w.fdwowner), w.fdwacl::text,
+                  obj_description(w.oid, 'pg_foreign_data_wrapper'))
+        FROM pg_foreign_data_wrapper w""", 0),
+    ("""SELECT concat_ws('|', 'server', s.srvname, w.fdwname, s.srvtype,
+                  s.srvversion, s.srvoptions::text,
+                  pg_get_userbyid(s.srvowner), s.srvacl::text,
+                  obj_description(s.oid, 'pg_foreign_server'))
+        FROM pg_foreign_server s
+             JOIN pg_foreign_data_wrapper w ON (s.srvfdw = w.oid)""", 0),
+    ("""SELECT concat_ws('|', 'user mapping', u.srvname, u.usename,
+                  u.umoptions::text)
+        FROM pg_user_mappings u""", 0),
+    ("""SELECT concat_ws('|', 'foreign table', f.ftrelid::regclass::text,
+                  s.srvname, f.ftoptions::text)
+        FROM pg_foreign_table f
+             JOIN pg_foreign_server s ON (f.ftserver = s.oid)""", 90100),
+    ("""SELECT concat_ws('|', 'event trigger', e.evtname, e.evtevent,
+                  e.evtfoid::regproc::text, e.evtenabled, e.evttags::text,
+                  pg_get_userbyid(e.evtowner),
+                  obj_description(e.oid, 'pg_event_trigger'))
+        FROM pg_event_trigger e""", 90300)]
+"""Queries returning a text definition of each user object.  Each
+query is paired with the minimum server version it requires."""
+
+VERSION_EXPRS = [
+    (90100, {'relpersistence': "c.relpersistence",
+             'attcollation': "(SELECT collname FROM pg_collation\n"
+             "                   WHERE oid = a.attcollation)",
+             'enumorder': "enumsortorder",
+             'fdwhandler': "w.fdwhandler::regproc::text"}),
+    (0, {'relpersistence': "NULL", 'attcollation': "NULL",
+         'enumorder': "e.oid", 'fdwhandler': "NULL"})]
+"""Expressions substituted in the queries, for catalog columns added
+in later versions, paired with the minimum server version"""
+
+
+def _array_concat(qry):
+    """Replace concat_ws calls, which require 9.1, by array_to_string
+
+    :param qry: query text
+    :return: query text
+
+    Like concat_ws, array_to_string skips NULLs.
+    """
+    while "concat_ws('|', " in qry:
+        start = qry.index("concat_ws('|', ")
+        pos = start + len("concat_ws('|', ")
+        args = []
+        (arg, depth, quoted) = (pos, 0, False)
+        while depth >= 0:
+            char = qry[pos]
+            if char == "'":
+                quoted = not quoted
+            elif not quoted:
+                if char == '(':
+                    depth += 1
+                elif char == ')':
+                    depth -= 1
+                elif char == ',' and depth == 0:
+                    args.append(qry[arg:pos].strip())
+                    arg = pos + 1
+            pos += 1
+        args.append(qry[arg:pos - 1].strip())
+        qry = qry[:start] + "array_to_string(ARRAY[%s], '|')" % ", ".join(
+            ["(%s)::text" % arg for arg in args]) + qry[pos:]
+    return qry
+
+
+def fingerprint_queries(version):
+    """Return the fingerprint queries for a server version
+
+    :param version: server version number
+    :return: list of query texts
+    """
+    exprs = [exprs for (minver, exprs) in VERSION_EXPRS
+             if version >= minver][0]
+    queries = [qry.format(**exprs) for (qry, minver) in FINGERPRINT_QUERIES
+               if version >= minver]
+    if version < 90100:
+        queries = [_array_concat(qry) for qry in queries]
+    return queries
+
+
+def catalog_fingerprint(dbconn):
+    """Return a fingerprint of the object definitions in the catalogs
+
+    :param dbconn: a DbConnection
+    :return: MD5 hex digest
+
+    The fingerprint is computed by the server over textual definitions
+    of the user objects, sorted, so that databases with the same
+    objects, e.g., shards, have the same fingerprint regardless of
+    OIDs.  Sequence parameters, e.g., the increment, and ownership are
+    included, but not the current value of sequences, nor statistics,
+    such as row counts.
+    """
+    version = dbconn.version if hasattr(dbconn, 'version') else \
+        dbconn.fetchone("SHOW server_version_num")[0]
+    sql = "SELECT md5(string_agg(d, E'\\n' ORDER BY d)) FROM (%s) defs(d)" % (
+        "\nUNION ALL\n".join(fingerprint_queries(int(version))))
+    return "%s-%s" % (version, dbconn.fetchone(sql)[0])
+
+
+def _json_default(obj):
+    return str(obj)
+
+
+def plan_key(inmap, config, fingerprint):
+    """Return the cache key for an input map applied to a database
+
+    :param inmap: the YAML input map
+    :param config: the configuration dictionary
+    :param fingerprint: the catalog fingerprint of the database
+    :return: SHA-256 hex digest
+
+    Besides the input map and the fingerprint, the key covers the
+    Pyrseas version, the options that affect `diff_map` and the
+    configuration sections other than those for the connection and
+    file locations (except the data directory).
+    """
+    opts = config['options']
+    keyed = {'pyrseas': __version__, 'fingerprint': fingerprint,
+             'map': inmap,
+             'options': {'schemas': sorted(getattr(opts, 'schemas', [])),
+                         'revert': getattr(opts, 'revert', False),
+                         'quote_reserved': getattr(opts, 'quote_reserved',
+                                                   False),
+                         'bulk_load': getattr(opts, 'bulk_load', False),
+                         'sync_data': getattr(opts, 'sync_data', False)},
+             'config': dict((key, val) for (key, val) in config.items()
+                            if key not in ('database', 'files', 'options'))}
+    if 'datacopy' in config:
+        keyed['data_path'] = config['files'].get('data_path')
+    text = json.dumps(keyed, sort_keys=True, default=_json_default)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def encode_stmts(stmts):
+    """Convert the statements of a plan for storing as JSON
+
+    :param stmts: list of SQL statements or `\\copy` tuples
+    :return: list of strings or dicts
+    """
+    return [{'copy': list(stmt)} if isinstance(stmt, tuple) else stmt
+            for stmt in stmts]
+
+
+def decode_stmts(stmts):
+    """Convert stored statements back to those returned by diff_map
+
+    :param stmts: list of strings or dicts
+    :return: list of SQL statements or `\\copy` tuples
+    """
+    return [tuple(stmt['copy']) if isinstance(stmt, dict) else stmt
+            for stmt in stmts]
+
+
+class PlanCache(object):
+    """A directory of generated plans, one JSON file per key"""
+
+    def __init__(self, path):
+        """Initialize the cache
+
+        :param path: directory holding the cached plans
+        """
+        self.path = path
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key):
+        """Return a cached plan
+
+        :param key: the cache key, as returned by `plan_key`
+        :return: dict with the plan metadata and the statements, or
+            None if the plan is not cached
+        """
+        try:
+            with open(self._filename(key)) as f:
+                plan = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if plan.get('format') != CACHE_FORMAT or plan.get('key') != key:
+            return None
+        plan['statements'] = decode_stmts(plan['statements'])
+        return plan
+
+    def put(self, key, stmts, fingerprint, dbname=None):
+        """Store a plan in the cache
+
+        :param key: the cache key, as returned by `plan_key`
+        :param stmts: list of SQL statements or `\\copy` tuples
+        :param fingerprint: the catalog fingerprint of the database
+        :param dbname: name of the database the plan was generated for
+        :return: dict with the plan metadata and the statements
+        """
+        plan = {'format': CACHE_FORMAT, 'key': key,
+                'fingerprint': fingerprint, 'pyrseas': __version__,
+                'created': datetime.utcnow().isoformat() + 'Z',
+                'database': dbname, 'statements': encode_stmts(stmts)}
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        filename = self._filename(key)
+        tmpname = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmpname, 'w') as f:
+            json.dump(plan, f, indent=1)
+        os.rename(tmpname, filename)
+        plan['statements'] = stmts
+        return plan
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.relation.aio
+
+    Counterparts of RelVar and JoinRelation for asyncio applications,
+    using the `psycopg` (version 3) driver and the `psycopg_pool`
+    package, which must be installed separately.  The SQL is generated
+    by the wrapped RelVar or JoinRelation.  Each method runs in its
+    own transaction, on a connection from the pool.
+"""
+from psycopg import DatabaseError
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from pyrseas.relation.tuple import tuple_values_dict
+
+
+def connection_pool(dbconn, min_size=1, max_size=10):
+    """Return an asyncio connection pool for the database of a connection
+
+    :param dbconn: DbConnection object giving the connection parameters
+    :param min_size: number of connections kept open
+    :param max_size: maximum number of connections
+    :return: AsyncConnectionPool, to be opened with `await pool.open()`
+    """
+    return AsyncConnectionPool(dbconn.conninfo(), min_size=min_size,
+                               max_size=max_size, open=False)
+
+
+class AsyncRelVar(object):
+    "A relation variable accessed through an asyncio connection pool"
+
+    def __init__(self, relvar):
+        """Initialize the asyncio relation variable
+
+        :param relvar: RelVar object, used to create tuples and SQL
+        """
+        self.relvar = relvar
+
+    def connect(self, pool):
+        """Specify the pool giving connections to the database
+
+        :param pool: psycopg_pool AsyncConnectionPool object
+        """
+        self.pool = pool
+
+    async def _execute(self, cmd, args):
+        """Execute a command returning at most one row
+
+        :param cmd: text of the command
+        :param args: dictionary of arguments to the command
+        :return: tuple of number of rows affected and row or None
+        """
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as curs:
+                await curs.execute(cmd, args)
+                row = await curs.fetchone() if curs.description else None
+                return (curs.rowcount, row)
+
+    async def insert_one(self, newtuple, retkey=False):
+        """Execute a single-tuple INSERT command
+
+        :param newtuple: the tuple to be inserted
+        :param retkey: indicates assigned key values should be returned
+        """
+        relvar = self.relvar
+        attrnames = [name for name, typ in newtuple._heading]
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as curs:
+                await curs.execute(relvar.insert_one_sql(attrnames, retkey),
+                                   tuple_values_dict(newtuple))
+                if curs.rowcount != 1:
+                    raise DatabaseError("Failed to add %s %r" % (
+                        relvar.extname, relvar))
+                if retkey:
+                    return relvar.returned_key(await curs.fetchone())
+
+    async def update_one(self, newtuple, keytuple, currtuple=None):
+        """Execute a single-tuple UPDATE command using the primary key
+
+        :param newtuple: Tuple with new values
+        :param keytuple: Tuple with key values
+        :param currtuple: previous version of newtuple
+        """
+        relvar = self.relvar
+        if currtuple:
+            changed_values = tuple_values_dict(currtuple, newtuple)
+            if not changed_values:
+                return
+        else:
+            changed_values = tuple_values_dict(newtuple)
+        values = relvar.key_values_update(keytuple, currtuple)
+        values.update(changed_values)
+        (rowcount, row) = await self._execute(relvar.update_one_sql(
+            list(changed_values.keys()), currtuple is not None), values)
+        if rowcount != 1:
+            raise DatabaseError("Failed to update %s %r" % (
+                relvar.extname, relvar))
+
+    async def delete_one(self, keytuple, currtuple=None):
+        """Execute a single-tuple DELETE command using the primary key
+
+        :param keytuple: Tuple with key values
+        :param currtuple: tuple from previous get
+        """
+        relvar = self.relvar
+        (rowcount, row) = await self._execute(
+            relvar.delete_one_sql(currtuple is not None),
+            relvar.key_values_update(keytuple, currtuple))
+        if rowcount != 1:
+            raise DatabaseError("Failed to delete %s %r" % (
+                relvar.extname, relvar))
+
+    async def get_one(self, keytuple):
+        """Execute a single-tuple retrieval and return the tuple data
+
+        :param keytuple: Tuple with key values
+        :return: Tuple or None
+        """
+        (rowcount, row) = await self._execute(
+            self.relvar.get_one_sql(), self.relvar.key_values(keytuple))
+        if not row:
+            return None
+        # psycopg may return xmin as an integer, but it must be passed
+        # back as a string, to be compared to an xid
+        row['xmin'] = str(row['xmin'])
+        return self.relvar.row_tuple(row)
+
+
+class AsyncJoinRelation(object):
+    "A join relation accessed through an asyncio connection pool"
+
+    def __init__(self, joinrel):
+        """Initialize the asyncio join relation
+
+        :param joinrel: JoinRelation object, used to create tuples and SQL
+        """
+        self.joinrel = joinrel
+
+    def connect(self, pool):
+        """Specify the pool giving connections to the database
+
+        :param pool: psycopg_pool AsyncConnectionPool object
+        """
+        self.pool = pool
+
+    async def _fetchall(self, query, params):
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as curs:
+                await curs.execute(query, params)
+                return await curs.fetchall()
+
+    async def count(self, qry_args=None):
+        """Execute a COUNT() possibly based on a WHERE clause
+
+        :param qry_args: query arguments to form WHERE clause
+        :return: integer result from COUNT()
+        """
+        rows = await self._fetchall(*self.joinrel.count_query(qry_args))
+        return rows[0]['count']
+
+    async def subset(self, limit='ALL', offset=0, qry_args='', order=[],
+                     after=None, attributes=None):
+        """Execute a multiple-tuple retrieval and return the tuple data
+
+        :param limit: literal 'ALL' or integer, max tuples to return
+        :param offset: integer, offset into subset
+        :param qry_args: dictionary of query arguments
+        :param order: list of attributes to sort on, possibly including DESC
+        :param after: Tuple after which to start, in the sort order
+        :param attributes: list of attribute names to select (all if None)
+        :return: list of tuples
+        """
+        rows = await self._fetchall(*self.joinrel.subset_query(
+            limit, offset, qry_args, order, after, attributes))
+        row_tuple = self.joinrel.row_tuple_func(attributes, order)
+        return [row_tuple(row) for row in rows]
@@ -52,3 +52,47 @@ class Attribute(object):
 
     def __repr__(self):
         return "Attribute(%s %s)" % (self.name, self.type.__name__)
+
+
+_EMPTY_VALUES = {str: '', int: 0, float: 0.0, bool: False}
+
+
+def attribute_validator(name, type_=str, nullable=False, sysdefault=False):
+    """Return a function that validates a value for an attribute
+
+    :param name: attribute name
+    :param type_: type
+    :param nullable: indicates whether attribute accepts NULLs
+    :param sysdefault: indicates whether attribute has system default
+    :return: function taking a value and returning it, possibly
+        converted, or raising ValueError
+
+    The function applies the same rules as Attribute, but the tests
+    that depend only on the attribute are done once, instead of for
+    every value.
+    """
+    attrrepr = "Attribute(%s %s)" % (name, type_.__name__)
+    empty = _EMPTY_VALUES.get(type_)
+    to_float = type_ == float
+    unicode_ok = PY2 and type_ == str
+
+    def validate(value):
+        if value is None:
+            if nullable:
+                return None
+            if empty is not None:
+                return empty
+            if not sysdefault:
+                raise ValueError("No value provided for %s" % attrrepr)
+            return None
+        if to_float and isinstance(value, int) and float(value) == value:
+            value = float(value)
+        if not isinstance(value, type_):
+            if not (unicode_ok and isinstance(value, unicode)):
+                raise ValueError("Value (%s) of %s is not of type '%s'" %
+                                 (value, attrrepr, type_.__name__))
+        if nullable and empty is not None and value == empty:
+            return None
+        return value
+
+    return validate
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.relation.cache
+"""
+import time
+from collections import OrderedDict
+
+
+class TupleCache(object):
+    "A least recently used cache of Tuples, keyed by their key values"
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, maxsize=1000, ttl=None, revalidate=False):
+        """Initialize the cache
+
+        :param maxsize: maximum number of tuples held
+        :param ttl: seconds after which a tuple is dropped (no limit if None)
+        :param revalidate: indicates the tuple version should be checked
+            against the database before returning a cached tuple
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.revalidate = revalidate
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.stale = 0
+        self.invalidations = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return a cached tuple
+
+        :param key: tuple of key values
+        :return: Tuple, or None if not cached or expired
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None or (entry[1] is not None and
+                             entry[1] < self.clock()):
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, tup):
+        """Add a tuple to the cache, dropping the least recently used
+
+        :param key: tuple of key values
+        :param tup: Tuple
+        """
+        self.entries.pop(key, None)
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        self.entries[key] = (tup, expires)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key, stale=False):
+        """Remove a tuple from the cache
+
+        :param key: tuple of key values
+        :param stale: indicates the tuple was found to be out of date
+        """
+        if self.entries.pop(key, None) is not None:
+            if stale:
+                self.stale += 1
+            else:
+                self.invalidations += 1
+
+    def clear(self):
+        """Remove all tuples from the cache"""
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+
+    def stats(self):
+        """Return the cache statistics
+
+        :return: dictionary
+        """
+        return {'size': len(self.entries), 'hits': self.hits,
+                'misses': self.misses, 'stale': self.stale,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions}
@@ -2,8 +2,10 @@
 """
     pyrseas.relation.join
 """
+import json
+
 from pyrseas.relation.attribute import Attribute
-from pyrseas.relation.tuple import Tuple
+from pyrseas.relation.tuple import tuple_class
 
 
 class ProjAttribute(Attribute):
@@ -59,6 +61,12 @@ class JoinRelation(object):
             assert join is not None, "Must provide 'join' clause"
         if join:
             self.from_clause += " %s" % (join)
+        self.tuple_classes = {}
+        self.select_lists = {}
+        self.where_clauses = {}
+        self.order_clauses = {}
+        self.after_conds = {}
+        self.subset_queries = {}
 
     def connect(self, dbconn):
         """Specify the database where the relations are present
@@ -74,43 +82,69 @@ class JoinRelation(object):
         :param kwargs: keyword arguments corresponding to attributes
         :return: Tuple
         """
-        kwargs.update(dict(list(zip([name for name, attr in self.attributes],
-                                    args))))
-        attribs = []
-        namelist = []
-        attrs = dict(self.attributes)
-        for (argname, argval) in list(kwargs.items()):
-            attr = attrs[argname]
-            attribs.append(Attribute(
-                argname, attr.type, argval, nullable=attr.nullable,
-                sysdefault=attr.sysdefault))
-            namelist.append(argname)
-        for name, attr in self.attributes:
-            if name not in namelist and name in self._required_attribs:
-                attribs.append(Attribute(name, attr.type,
-                                         nullable=attr.nullable,
-                                         sysdefault=attr.sysdefault))
-        return Tuple(attribs)
+        if args:
+            kwargs.update(zip([name for name, attr in self.attributes],
+                              args))
+        names = tuple(kwargs)
+        cls = self.tuple_class(names)
+        values = [kwargs[name] for name in names]
+        values.extend([None] * (len(cls._heading) - len(names)))
+        return cls(*values)
+
+    def tuple_class(self, names, required=True):
+        """Return the Tuple class for a list of attributes
+
+        :param names: tuple of attribute names
+        :param required: indicates required attributes should be added
+        :return: Tuple subclass
+
+        The class has the given attributes followed, if `required` is
+        true, by any required attributes not given.
+        """
+        if (names, required) not in self.tuple_classes:
+            attrs = dict(self.attributes)
+            attribs = [attrs[name] for name in names]
+            if required:
+                attribs.extend([
+                    attr for name, attr in self.attributes
+                    if name not in names and name in self._required_attribs])
+            self.tuple_classes[names, required] = tuple_class(attribs)
+        return self.tuple_classes[names, required]
+
+    def attr_exprs(self):
+        """Return the expressions and types of the attributes
+
+        :return: dictionary of attribute names and (expression, type)
+        """
+        if not hasattr(self, 'attrexprs'):
+            attrs = {}
+            for name, attr in self.attributes:
+                attrs.update({attr.name: ("%s.%s" % (
+                    attr.projection.rangevar, attr.basename), attr.type)})
+            self.attrexprs = attrs
+        return self.attrexprs
 
     def where_clause(self, qry_args=None):
+        """Return a WHERE clause based on query arguments
+
+        :param qry_args: dictionary of query arguments
+        :return: tuple of WHERE clause and dictionary of parameters
+
+        The clause only depends on the names of the arguments and the
+        comparison operators, so it is cached on those.
+        """
         if not qry_args:
             return ('', {})
-        attrs = {}
-        for name, attr in self.attributes:
-            if attr.name != attr.basename:
-                expr = "%s.%s" % (attr.projection.rangevar, attr.basename)
-            else:
-                expr = "%s.%s" % (attr.projection.rangevar, attr.name)
-            attrs.update({attr.name: (expr, attr.type)})
-        subclauses = []
+        attrs = self.attr_exprs()
+        opers = []
         params = {}
         for name in qry_args:
             if name not in attrs:
                 raise KeyError("Attribute '%s' not allowed in query string" %
                                name)
-            (expr, type_) = attrs[name]
+            type_ = attrs[name][1]
             if type_ == str:
-                subclauses.append("%s ILIKE %%(%s)s" % (expr, name))
+                oper = 'ILIKE'
                 params.update({name: '%%%s%%' % qry_args[name]})
             else:
                 arg = qry_args[name].strip()
@@ -121,12 +155,78 @@ class JoinRelation(object):
                 elif arg[:1] in ['>', '<']:
                     oper = arg[:1]
                     arg = arg[1:].strip()
-                subclauses.append("%s %s %%(%s)s" % (expr, oper, name))
                 if type_ in (int, float):
                     arg = type_(arg)
                 params.update({name: arg})
+            opers.append((name, oper))
+        key = tuple(opers)
+        if key not in self.where_clauses:
+            self.where_clauses[key] = " WHERE %s" % " AND ".join([
+                "%s %s %%(%s)s" % (attrs[name][0], oper, name)
+                for (name, oper) in opers])
+        return (self.where_clauses[key], params)
+
+    def order_list(self, order):
+        """Validate the attributes to sort on
+
+        :param order: list of attributes, possibly including DESC
+        :return: list of (attribute name, descending)
+        """
+        attrnames = [name for (name, attr) in self.attributes]
+        orderlist = []
+        for name in order:
+            nm = name.rstrip()
+            desc = False
+            if nm[-5:].upper() == ' DESC':
+                nm = nm[:-5]
+                desc = True
+            elif nm[-4:].upper() == ' ASC':
+                nm = nm[:-4]
+            nm = nm.strip()
+            if nm not in attrnames:
+                raise AttributeError("JoinRelation %s has no attribute "
+                                     "'%s'" % (self.extname, nm))
+            orderlist.append((nm, desc))
+        return orderlist
+
+    def after_clause(self, orderlist, after):
+        """Return a condition selecting the tuples following a given one
 
-        return (" WHERE %s" % " AND ".join(subclauses), params)
+        :param orderlist: list of (attribute name, descending)
+        :param after: Tuple with values of the attributes in orderlist
+        :return: tuple of condition and dictionary of parameters
+
+        This implements keyset (or "seek") pagination: the next page
+        starts after the last tuple of the previous one, instead of at
+        an OFFSET, so that it can be found using an index on the
+        attributes, instead of reading and discarding all the previous
+        tuples.  The sort attributes should identify tuples uniquely
+        and not be null.  If all attributes are sorted in the same
+        direction, a row comparison is used.
+        """
+        params = dict(('_after_%s' % name, getattr(after, name))
+                      for (name, desc) in orderlist)
+        key = tuple(orderlist)
+        if key not in self.after_conds:
+            self.after_conds[key] = self._after_cond(orderlist)
+        return (self.after_conds[key], params)
+
+    def _after_cond(self, orderlist):
+        attrs = self.attr_exprs()
+        exprs = [attrs[name][0] for (name, desc) in orderlist]
+        args = ['%%(_after_%s)s' % name for (name, desc) in orderlist]
+        opers = ['<' if desc else '>' for (name, desc) in orderlist]
+        if len(set(opers)) == 1:
+            if len(exprs) == 1:
+                return "%s %s %s" % (exprs[0], opers[0], args[0])
+            return "(%s) %s (%s)" % (", ".join(exprs), opers[0],
+                                     ", ".join(args))
+        disjuncts = []
+        for i in range(len(exprs)):
+            conds = ["%s = %s" % (exprs[j], args[j]) for j in range(i)]
+            conds.append("%s %s %s" % (exprs[i], opers[i], args[i]))
+            disjuncts.append("(%s)" % " AND ".join(conds))
+        return "(%s)" % " OR ".join(disjuncts)
 
     def count(self, qry_args=None):
         """Execute a COUNT() possibly based on a WHERE clause
@@ -134,53 +234,267 @@ class JoinRelation(object):
         :param qry_args: query arguments to form WHERE clause
         :return: integer result from COUNT()
         """
-        (where, params) = self.where_clause(qry_args)
-        row = self.db.fetchone(
-            "SELECT COUNT(*) FROM " + self.from_clause + where, params)
+        row = self.db.fetchone(*self.count_query(qry_args))
         self.db.rollback()
         return row[0]
 
-    def subset(self, limit='ALL', offset=0, qry_args='', order=[]):
-        """Execute a multiple-tuple retrieval and return the tuple data
+    def count_query(self, qry_args=None):
+        """Return the query for a COUNT() possibly based on a WHERE clause
+
+        :param qry_args: query arguments to form WHERE clause
+        :return: tuple of query and dictionary of parameters
+        """
+        (where, params) = self.where_clause(qry_args)
+        return ("SELECT COUNT(*) FROM " + self.from_clause + where, params)
+
+    def order_clause(self, order):
+        """Return the attributes and the clause to sort on
+
+        :param order: list of attributes to sort on, possibly including DESC
+        :return: tuple of list of (attribute name, descending) and
+            ORDER BY clause
+
+        If `order` is empty, the tuples are sorted on the first
+        attribute.
+        """
+        key = tuple(order)
+        if key not in self.order_clauses:
+            orderlist = self.order_list(order)
+            if orderlist:
+                orderby = " ORDER BY %s" % ", ".join(order)
+            else:
+                orderlist = [(self.attributes[0][0], False)]
+                orderby = " ORDER BY 1"
+            self.order_clauses[key] = (orderlist, orderby)
+        return self.order_clauses[key]
+
+    def projected_names(self, attributes, order=[]):
+        """Return the names of the attributes selected by a projection
+
+        :param attributes: list of attribute names
+        :param order: list of attributes to sort on, possibly including DESC
+        :return: tuple of attribute names
+
+        The attributes sorted on are added if not in `attributes`.
+        """
+        (orderlist, orderby) = self.order_clause(order)
+        names = list(attributes)
+        names.extend([name for (name, desc) in orderlist
+                      if name not in names])
+        return tuple(names)
+
+    def select_list(self, names=None):
+        """Return the expressions selecting the attributes
+
+        :param names: tuple of attribute names (all attributes if None)
+        :return: string
+        """
+        if names not in self.select_lists:
+            if names is None:
+                attribs = [attr for name, attr in self.attributes]
+            else:
+                attrs = dict(self.attributes)
+                for name in names:
+                    if name not in attrs:
+                        raise AttributeError("JoinRelation %s has no "
+                                             "attribute '%s'" % (
+                                                 self.extname, name))
+                attribs = [attrs[name] for name in names]
+            exprs = []
+            for attr in attribs:
+                if attr.name != attr.basename:
+                    exprs.append("%s.%s AS %s" % (
+                        attr.projection.rangevar, attr.basename, attr.name))
+                else:
+                    exprs.append("%s.%s" % (attr.projection.rangevar,
+                                            attr.name))
+            self.select_lists[names] = ", ".join(exprs)
+        return self.select_lists[names]
+
+    def subset_parts(self, qry_args='', order=[], after=None):
+        """Return the parts of a query for a multiple-tuple retrieval
+
+        :param qry_args: dictionary of query arguments
+        :param order: list of attributes to sort on, possibly including DESC
+        :param after: Tuple after which to start, in the sort order
+        :return: tuple of WHERE clause, ORDER BY clause, condition for
+            tuples after `after` (or None) and dictionary of parameters
+        """
+        (where, params) = self.where_clause(qry_args)
+        (orderlist, orderby) = self.order_clause(order)
+        cond = None
+        if after is not None:
+            (cond, afterparams) = self.after_clause(orderlist, after)
+            params.update(afterparams)
+        return (where, orderby, cond, params)
+
+    def subset_query(self, limit='ALL', offset=0, qry_args='', order=[],
+                     after=None, attributes=None):
+        """Return the query for a multiple-tuple retrieval
 
         :param limit: literal 'ALL' or integer, max tuples to return
         :param offset: integer, offset into subset
         :param qry_args: dictionary of query arguments
         :param order: list of attributes to sort on, possibly including DESC
-        :return: list of tuples
+        :param after: Tuple after which to start, in the sort order
+        :param attributes: list of attribute names to select (all if None)
+        :return: tuple of query and dictionary of parameters
+
+        The query, except for the LIMIT and OFFSET, is cached on the
+        clauses and the attributes selected.
         """
-        (where, params) = self.where_clause(qry_args)
+        (where, orderby, cond, params) = self.subset_parts(qry_args, order,
+                                                           after)
+        names = None
+        if attributes is not None:
+            names = self.projected_names(attributes, order)
+            if not order:
+                orderby = " ORDER BY %s" % self.attributes[0][0]
+        key = (where, orderby, cond, names)
+        if key not in self.subset_queries:
+            if cond is not None:
+                where += (" AND " if where else " WHERE ") + cond
+            self.subset_queries[key] = "SELECT %s FROM %s%s%s" % (
+                self.select_list(names), self.from_clause, where, orderby)
+        slice_ = " LIMIT %s OFFSET %d" % (limit, offset)
+        return (self.subset_queries[key] + slice_, params)
+
+    def page_query(self, limit='ALL', offset=0, qry_args='', order=[],
+                   after=None):
+        """Return the query for a page of tuples and the total count
 
-        def getsubset_qry():
-            if not hasattr(self, 'getsubset_qry'):
-                exprs = []
-                for name, attr in self.attributes:
-                    if attr.name != attr.basename:
-                        exprs.append("%s.%s AS %s" % (
-                            attr.projection.rangevar, attr.basename,
-                            attr.name))
-                    else:
-                        exprs.append("%s.%s" % (attr.projection.rangevar,
-                                                attr.name))
-                self.getsubset_qry = "SELECT %s FROM %s" % (
-                    ", ".join(exprs), self.from_clause)
-            return self.getsubset_qry
+        :param limit: literal 'ALL' or integer, max tuples to return
+        :param offset: integer, offset into subset
+        :param qry_args: dictionary of query arguments
+        :param order: list of attributes to sort on, possibly including DESC
+        :param after: Tuple after which to start, in the sort order
+        :return: tuple of query and dictionary of parameters
 
+        The query returns the total number of tuples matching
+        `qry_args` in a `_total` column, computed by a window function.
+        If `after` is given, the tuples are first selected and counted
+        in a subquery, which flags those following `after`.
+        """
+        (where, orderby, cond, params) = self.subset_parts(qry_args, order,
+                                                           after)
         slice_ = " LIMIT %s OFFSET %d" % (limit, offset)
-        orderby = " ORDER BY 1"
-        if order:
-            attrnames = [name for (name, attr) in self.attributes]
-            for name in order:
-                nm = name.rstrip()
-                if nm[-5:].upper() == ' DESC':
-                    nm = nm[:-5]
-                elif nm[-4:].upper() == ' ASC':
-                    nm = nm[:-4]
-                if nm not in attrnames:
-                    raise AttributeError("JoinRelation %s has no attribute "
-                                         "'%s'" % (self.extname, nm))
-            orderby = " ORDER BY %s" % ", ".join(order)
-        query = getsubset_qry() + where + orderby + slice_
+        select = "SELECT %s, count(*) OVER () AS _total" % self.select_list()
+        if cond is None:
+            return (select + " FROM " + self.from_clause + where + orderby +
+                    slice_, params)
+        return ("SELECT * FROM (%s, %s AS _after FROM %s%s) AS s "
+                "WHERE _after%s%s" % (select, cond, self.from_clause, where,
+                                      orderby, slice_), params)
+
+    def estimate_count(self, qry_args=None):
+        """Return the planner's estimate of the number of tuples
+
+        :param qry_args: query arguments to form WHERE clause
+        :return: integer
+        """
+        (where, params) = self.where_clause(qry_args)
+        row = self.db.fetchone("EXPLAIN (FORMAT JSON) SELECT 1 FROM " +
+                               self.from_clause + where, params)
+        self.db.rollback()
+        plan = row[0]
+        if not isinstance(plan, list):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def page(self, limit='ALL', offset=0, qry_args='', order=[], after=None,
+             estimate=False):
+        """Return a page of tuples and the total number of tuples
+
+        :param limit: literal 'ALL' or integer, max tuples to return
+        :param offset: integer, offset into subset
+        :param qry_args: dictionary of query arguments
+        :param order: list of attributes to sort on, possibly including DESC
+        :param after: Tuple after which to start, in the sort order
+        :param estimate: indicates the total should be estimated by
+            the planner instead of counted
+        :return: tuple of total and list of tuples
+
+        The tuples and the total are retrieved by a single query,
+        unless the page is past the end, when the tuples are counted
+        separately.  Counting requires finding all the matching
+        tuples, so an estimate, from EXPLAIN, is much faster for large
+        relations.
+        """
+        if estimate:
+            return (self.estimate_count(qry_args),
+                    self.subset(limit, offset, qry_args, order, after))
+        rows = self.db.fetchall(*self.page_query(limit, offset, qry_args,
+                                                 order, after))
+        self.db.rollback()
+        if not rows:
+            if offset or after is not None:
+                return (self.count(qry_args), [])
+            return (0, [])
+        tuples = []
+        for row in rows:
+            row = dict(row)
+            total = row.pop('_total')
+            row.pop('_after', None)
+            tuples.append(self.tuple(**row))
+        return (total, tuples)
+
+    def row_tuple_func(self, attributes=None, order=[]):
+        """Return a function creating a Tuple from a row
+
+        :param attributes: list of attribute names selected (all if None)
+        :param order: list of attributes to sort on, possibly including DESC
+        :return: function taking a row and returning a Tuple
+        """
+        if attributes is None:
+            return lambda row: self.tuple(**row)
+        names = self.projected_names(attributes, order)
+        cls = self.tuple_class(names, False)
+        return lambda row: cls(*[row[name] for name in names])
+
+    def subset(self, limit='ALL', offset=0, qry_args='', order=[],
+               after=None, attributes=None):
+        """Execute a multiple-tuple retrieval and return the tuple data
+
+        :param limit: literal 'ALL' or integer, max tuples to return
+        :param offset: integer, offset into subset
+        :param qry_args: dictionary of query arguments
+        :param order: list of attributes to sort on, possibly including DESC
+        :param after: Tuple after which to start, in the sort order
+        :param attributes: list of attribute names to select (all if None)
+        :return: list of tuples
+
+        If `attributes` is given, the tuples only have those
+        attributes, and those sorted on.
+        """
+        (query, params) = self.subset_query(limit, offset, qry_args, order,
+                                            after, attributes)
         rows = self.db.fetchall(query, params)
         self.db.rollback()
-        return [self.tuple(**row) for row in rows]
+        row_tuple = self.row_tuple_func(attributes, order)
+        return [row_tuple(row) for row in rows]
+
+    def iter_subset(self, limit='ALL', qry_args='', order=[], after=None,
+                    fetch_size=1000, attributes=None):
+        """Execute a multiple-tuple retrieval and generate the tuples
+
+        :param limit: literal 'ALL' or integer, max tuples to return
+        :param qry_args: dictionary of query arguments
+        :param order: list of attributes to sort on, possibly including DESC
+        :param after: Tuple after which to start, in the sort order
+        :param fetch_size: number of rows to fetch from the server at a time
+        :param attributes: list of attribute names to select (all if None)
+        :return: generator of tuples
+
+        The rows are read through a server-side cursor, so that only
+        `fetch_size` of them are held in memory at any time.
+        """
+        (query, params) = self.subset_query(limit, 0, qry_args, order, after,
+                                            attributes)
+        row_tuple = self.row_tuple_func(attributes, order)
+        rows = self.db.fetchiter(query, params, fetch_size)
+        try:
+            for row in rows:
+                yield row_tuple(row)
+        finally:
+            rows.close()
+            self.db.rollback()
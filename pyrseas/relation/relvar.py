@@ -2,10 +2,64 @@
 """
     pyrseas.relation.relvar
 """
+import json
+from binascii import hexlify
+from copy import copy
+from io import StringIO
+
 from psycopg2 import DatabaseError
 
+from pyrseas.lib.pycompat import strtypes
 from pyrseas.relation import Attribute, Tuple
-from pyrseas.relation.tuple import tuple_values_dict
+from pyrseas.relation.cache import TupleCache
+from pyrseas.relation.tuple import tuple_class, tuple_values_dict
+
+BATCH_SIZE = 1000
+"""Default number of tuples processed by each statement of the
+insert_many, update_many and delete_many methods"""
+
+
+def pg_text(value):
+    """Return a value formatted as PostgreSQL text input
+
+    :param value: attribute value, not None
+    :return: string
+
+    Byte strings are formatted as bytea in hex format, lists and
+    tuples as array literals, and dictionaries as JSON.
+    """
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, strtypes):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return u'\\x' + hexlify(bytes(value)).decode('ascii')
+    if isinstance(value, (list, tuple)):
+        return u'{%s}' % u",".join([_array_element(elem) for elem in value])
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return u'%s' % value
+
+
+def _array_element(value):
+    if value is None:
+        return u'NULL'
+    if isinstance(value, (list, tuple)):
+        return pg_text(value)
+    return u'"%s"' % pg_text(value).replace('\\', '\\\\').replace(
+        '"', '\\"')
+
+
+def copy_text(value):
+    """Return a value formatted for COPY text format
+
+    :param value: attribute value
+    :return: string
+    """
+    if value is None:
+        return '\\N'
+    return pg_text(value).replace('\\', '\\\\').replace(
+        '\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
 
 
 class RelVar(object):
@@ -26,13 +80,127 @@ class RelVar(object):
                 not attr.sysdefault and not attr.nullable)]
         self.key = key
         self.extname = extname or name
+        self.tuple_classes = {}
+        self.cache = None
+        self.listener = None
 
-    def connect(self, dbconn):
+    def connect(self, dbconn, prepare=False):
         """Specify the database where the relvar is present
 
         :param dbconn: DbConnection object
+        :param prepare: use server-side prepared statements for the
+            single-tuple commands
         """
         self.db = dbconn
+        self.prepare = prepare
+
+    def execute(self, cmd, args):
+        """Execute a single-tuple command, possibly as a prepared statement
+
+        :param cmd: text of the command
+        :param args: dictionary of arguments to the command
+        :return: cursor
+        """
+        if self.prepare:
+            return self.db.execute_prepared(cmd, args)
+        return self.db.execute(cmd, args)
+
+    def use_cache(self, maxsize=1000, ttl=None, revalidate=False):
+        """Cache the tuples retrieved by get_one
+
+        :param maxsize: maximum number of tuples cached
+        :param ttl: seconds after which a cached tuple is dropped
+        :param revalidate: indicates that the version of a cached
+            tuple should be checked before returning it
+        :return: TupleCache
+
+        Tuples changed through this relvar are removed from the
+        cache.  Changes made by other sessions are only noticed if
+        revalidate is set, after ttl seconds, or through notifications
+        (see notify_trigger and listen).  The cache statistics are
+        available from its stats method.
+        """
+        self.cache = TupleCache(maxsize, ttl, revalidate)
+        return self.cache
+
+    def notify_channel(self):
+        """Return the name of the channel for cache invalidation
+
+        :return: string
+        """
+        return "pyrseas_%s" % self.name.replace('.', '_')
+
+    def notify_trigger(self):
+        """Return SQL statements creating a trigger for cache invalidation
+
+        :return: list of SQL statements
+
+        The trigger sends a notification, with the key values of the
+        old row as a JSON object, when a row is updated or deleted.
+        It requires PostgreSQL 9.4 or later.
+        """
+        channel = self.notify_channel()
+        keyvals = ", ".join(["'%s', OLD.%s" % (attr, attr)
+                             for attr in self.key])
+        return [
+            "CREATE OR REPLACE FUNCTION %s() RETURNS trigger "
+            "LANGUAGE plpgsql AS $$BEGIN\n"
+            "    PERFORM pg_notify('%s', json_build_object(%s)::text);\n"
+            "    RETURN NULL;\nEND$$" % (channel, channel, keyvals),
+            "DROP TRIGGER IF EXISTS %s ON %s" % (channel, self.name),
+            "CREATE TRIGGER %s AFTER UPDATE OR DELETE ON %s "
+            "FOR EACH ROW EXECUTE PROCEDURE %s()" % (
+                channel, self.name, channel)]
+
+    def listen(self, dbconn):
+        """Listen for notifications invalidating cached tuples
+
+        :param dbconn: DbConnection object, not used for anything else
+
+        The notifications are processed by get_one before looking up
+        the cache.
+        """
+        dbconn.connect()
+        dbconn.conn.autocommit = True
+        dbconn.execute("LISTEN %s" % self.notify_channel()).close()
+        self.listener = dbconn
+
+    def poll_notifies(self):
+        """Remove the tuples named by pending notifications from the cache
+        """
+        conn = self.listener.conn
+        conn.poll()
+        channel = self.notify_channel()
+        attrdict = dict(self.attributes)
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            if notify.channel != channel:
+                continue
+            keyvals = json.loads(notify.payload)
+            if any(attrdict[attr].type not in (int, float, str)
+                   for attr in self.key):
+                # JSON values cannot be reliably converted to the keys
+                self.cache.clear()
+                continue
+            self.cache.invalidate(tuple(
+                attrdict[attr].type(keyvals[attr]) for attr in self.key))
+
+    def cache_key(self, keytuple):
+        """Return the key of a tuple in the cache
+
+        :param keytuple: Tuple with key values
+        :return: tuple of key values
+        """
+        return tuple(getattr(keytuple, attr) for attr in self.key)
+
+    def _invalidate(self, keytuples):
+        """Remove tuples changed through this relvar from the cache
+
+        :param keytuples: list of Tuples with key values
+        """
+        if self.cache is not None:
+            for keytuple in keytuples:
+                self.cache.invalidate(self.cache_key(keytuple))
 
     def tuple(self, *args, **kwargs):
         """Return a Tuple based on relvar and passed-in arguments
@@ -41,22 +209,29 @@ class RelVar(object):
         :param kwargs: keyword arguments corresponding to attributes
         :return: Tuple
         """
-        kwargs.update(dict(list(zip([name for name, attr in self.attributes],
-                                    args))))
-        attribs = []
-        namelist = []
-        attrs = dict(self.attributes)
-        for (argname, argval) in list(kwargs.items()):
-            attr = attrs[argname]
-            attribs.append(Attribute(
-                argname, attr.type, argval, nullable=attr.nullable,
-                sysdefault=attr.sysdefault))
-            namelist.append(argname)
-        for name in self._required_attribs:
-            if name not in namelist:
-                raise ValueError("Missing required attribute: %s" % name)
-
-        return Tuple(attribs)
+        if args:
+            kwargs.update(zip([name for name, attr in self.attributes],
+                              args))
+        names = tuple(kwargs)
+        (cls, missing) = self.tuple_class(names)
+        if missing:
+            raise ValueError("Missing required attribute: %s" % missing[0])
+        return cls(*[kwargs[name] for name in names])
+
+    def tuple_class(self, names):
+        """Return the Tuple class for a list of attributes
+
+        :param names: tuple of attribute names
+        :return: tuple of Tuple subclass and list of missing required
+            attributes
+        """
+        if names not in self.tuple_classes:
+            attrs = dict(self.attributes)
+            self.tuple_classes[names] = (
+                tuple_class([attrs[name] for name in names]),
+                [name for name in self._required_attribs
+                 if name not in names])
+        return self.tuple_classes[names]
 
     def key_tuple(self, *args, **kwargs):
         """Return a Tuple of key attributes, with given values
@@ -87,26 +262,157 @@ class RelVar(object):
         :param retkey: indicates assigned key values should be returned
         """
         attrnames = [name for name, typ in newtuple._heading]
+        curs = self.execute(self.insert_one_sql(attrnames, retkey),
+                            tuple_values_dict(newtuple))
+        if curs.rowcount != 1:
+            self.db.rollback()
+            raise DatabaseError("Failed to add %s %r" % (self.extname, self))
+        if retkey:
+            rettuple = self.returned_key(curs.fetchone())
+        curs.close()
+        if retkey:
+            return rettuple
+
+    def insert_one_sql(self, attrnames, retkey=False):
+        """Return a single-tuple INSERT command
+
+        :param attrnames: list of attribute names
+        :param retkey: indicates assigned key values should be returned
+        :return: string
+        """
         targets = '(%s)' % ", ".join(attrnames)
         values_list = 'VALUES (%s)' % ", ".join(
             ['%%(%s)s' % name for name in attrnames])
         cmd = "INSERT INTO %s %s %s" % (self.name, targets, values_list)
         if retkey:
             cmd += " RETURNING %s" % ", ".join(self.key)
-        curs = self.db.execute(cmd, tuple_values_dict(newtuple))
-        if curs.rowcount != 1:
-            self.db.rollback()
-            raise DatabaseError("Failed to add %s %r" % (self.extname, self))
+        return cmd
+
+    def returned_key(self, row):
+        """Return a Tuple with the key values returned by an INSERT
+
+        :param row: row returned
+        :return: Tuple
+        """
+        attrdict = dict(self.attributes)
+        rettuple = Tuple([Attribute(name, attrdict[name].type)
+                          for name in self.key])
+        for attr, type_ in rettuple._heading:
+            setattr(rettuple, attr, row[attr])
+        return rettuple
+
+    def _heading_runs(self, tuples):
+        """Validate tuples and split them into runs with the same heading
+
+        :param tuples: list of Tuples
+        :return: list of (attribute names, list of Tuples)
+        """
+        attrdict = dict(self.attributes)
+        runs = []
+        heading = None
+        for tup in tuples:
+            if not isinstance(tup, Tuple):
+                raise ValueError("%r is not a Tuple" % (tup, ))
+            if tup._heading != heading:
+                for name, type_ in tup._heading:
+                    if name not in attrdict or attrdict[name].type != type_:
+                        raise ValueError("Attribute %s %s of %r is not in %s"
+                                         % (name, type_.__name__, tup,
+                                            self.extname))
+                names = [name for name, type_ in tup._heading]
+                for name in self._required_attribs:
+                    if name not in names:
+                        raise ValueError("Missing required attribute: %s" %
+                                         name)
+                heading = tup._heading
+                runs.append((names, []))
+            runs[-1][1].append(tup)
+        return runs
+
+    def insert_many_cmd(self, attrnames, nrows, retkey=False):
+        """Return a multi-row INSERT command
+
+        :param attrnames: list of attribute names
+        :param nrows: number of rows in the VALUES list
+        :param retkey: indicates assigned key values should be returned
+        :return: string
+
+        The commands are cached, since the same ones are normally used
+        for all but the last batch.
+        """
+        if not hasattr(self, 'insert_many_cmds'):
+            self.insert_many_cmds = {}
+        cachekey = (tuple(attrnames), nrows, retkey)
+        if cachekey not in self.insert_many_cmds:
+            row = '(%s)' % ", ".join(['%s'] * len(attrnames))
+            cmd = "INSERT INTO %s (%s) VALUES %s" % (
+                self.name, ", ".join(attrnames), ", ".join([row] * nrows))
+            if retkey:
+                cmd += " RETURNING %s" % ", ".join(self.key)
+            self.insert_many_cmds[cachekey] = cmd
+        return self.insert_many_cmds[cachekey]
+
+    def _copy_many(self, attrnames, tuples):
+        """Insert tuples using COPY FROM STDIN
+
+        :param attrnames: list of attribute names
+        :param tuples: list of Tuples
+        :return: number of rows copied
+        """
+        buf = StringIO()
+        for tup in tuples:
+            values = [copy_text(getattr(tup, name)) for name in attrnames]
+            buf.write(u"\t".join(values) + u"\n")
+        buf.seek(0)
+        return self.db.copy_expert("COPY %s (%s) FROM STDIN" % (
+            self.name, ", ".join(attrnames)), buf)
+
+    def insert_many(self, tuples, retkey=False, batch_size=BATCH_SIZE):
+        """Insert multiple tuples, using multi-row INSERTs or COPY
+
+        :param tuples: list of Tuples to be inserted
+        :param retkey: indicates assigned key values should be returned
+        :param batch_size: maximum number of tuples per INSERT command
+        :return: list of key Tuples, in the order of tuples, if retkey
+
+        All tuples are validated against the relvar heading before
+        anything is inserted.  Consecutive tuples with the same
+        attributes are inserted together: if there are more than
+        `batch_size` of them and keys need not be returned, they are
+        loaded with a single COPY, otherwise with INSERT commands of
+        up to `batch_size` rows each.  Tuples omitting attributes with
+        system defaults, e.g., a serial key, get the column default.
+        """
+        runs = self._heading_runs(tuples)
         if retkey:
             attrdict = dict(self.attributes)
-            rettuple = Tuple([Attribute(name, attrdict[name].type)
-                              for name in self.key])
-            row = curs.fetchone()
-            for attr, type_ in rettuple._heading:
-                setattr(rettuple, attr, row[attr])
-        curs.close()
+            keytuples = []
+        for attrnames, run in runs:
+            if not retkey and len(run) > batch_size:
+                if self._copy_many(attrnames, run) != len(run):
+                    self.db.rollback()
+                    raise DatabaseError("Failed to add %s %r" % (
+                        self.extname, self))
+                continue
+            for start in range(0, len(run), batch_size):
+                batch = run[start:start + batch_size]
+                values = [getattr(tup, name) for tup in batch
+                          for name in attrnames]
+                curs = self.db.execute(self.insert_many_cmd(
+                    attrnames, len(batch), retkey), values)
+                if curs.rowcount != len(batch):
+                    curs.close()
+                    self.db.rollback()
+                    raise DatabaseError("Failed to add %s %r" % (
+                        self.extname, self))
+                if retkey:
+                    for row in curs.fetchall():
+                        keytuples.append(Tuple([
+                            Attribute(name, attrdict[name].type, row[name])
+                            for name in self.key]))
+                curs.close()
         if retkey:
-            return rettuple
+            return keytuples
 
     def where_clause(self, tuple_version=False):
         """Return WHERE clause for use by get, update and delete methods
@@ -149,16 +455,6 @@ class RelVar(object):
         :param keytuple: Tuple with key values
         :param currtuple: previous version of newtuple
         """
-        def update_one_cmd():
-            if changed_values or not hasattr(self, 'update_one_cmd'):
-                setlist = "SET %s" % ", ".join(
-                    ['%s = %%(%s)s' % (c, c) for c in
-                     list(changed_values.keys())])
-                self.update_one_cmd = "UPDATE %s %s %s" % (
-                    self.name, setlist,
-                    self.where_clause(currtuple is not None))
-            return self.update_one_cmd
-
         if currtuple:
             changed_values = tuple_values_dict(currtuple, newtuple)
             if not changed_values:
@@ -167,12 +463,14 @@ class RelVar(object):
             changed_values = tuple_values_dict(newtuple)
         values = self.key_values_update(keytuple, currtuple)
         values.update(changed_values)
-        curs = self.db.execute(update_one_cmd(), values)
+        curs = self.execute(self.update_one_sql(
+            list(changed_values.keys()), currtuple is not None), values)
         if curs.rowcount != 1:
             self.db.rollback()
             raise DatabaseError("Failed to update %s %r" % (
                 self.extname, self))
         curs.close()
+        self._invalidate([keytuple])
 
     def delete_one(self, keytuple, currtuple=None):
         """Execute a single-tuple DELETE command using the primary key
@@ -180,45 +478,304 @@ class RelVar(object):
         :param keytuple: Tuple with key values
         :param currtuple: tuple from previous get
         """
-        def delete_one_cmd():
-            if not hasattr(self, 'delete_one_cmd'):
-                self.delete_one_cmd = "DELETE FROM %s %s" % (
-                    self.name, self.where_clause(currtuple is not None))
-            return self.delete_one_cmd
-
         values = self.key_values_update(keytuple, currtuple)
-        curs = self.db.execute(delete_one_cmd(), values)
+        curs = self.execute(self.delete_one_sql(currtuple is not None),
+                            values)
         if curs.rowcount != 1:
             self.db.rollback()
             raise DatabaseError("Failed to delete %s %r" % (
                 self.extname, self))
         curs.close()
+        self._invalidate([keytuple])
+
+    def update_one_sql(self, attrnames, tuple_version=False):
+        """Return a single-tuple UPDATE command
+
+        :param attrnames: names of attributes to be updated
+        :param tuple_version: indicates whether xmin should be matched
+        :return: string
+        """
+        setlist = "SET %s" % ", ".join(
+            ['%s = %%(%s)s' % (c, c) for c in attrnames])
+        return "UPDATE %s %s %s" % (self.name, setlist,
+                                    self.where_clause(tuple_version))
+
+    def delete_one_sql(self, tuple_version=False):
+        """Return a single-tuple DELETE command
+
+        :param tuple_version: indicates whether xmin should be matched
+        :return: string
+        """
+        if not hasattr(self, 'delete_one_cmds'):
+            self.delete_one_cmds = {}
+        if tuple_version not in self.delete_one_cmds:
+            self.delete_one_cmds[tuple_version] = "DELETE FROM %s %s" % (
+                self.name, self.where_clause(tuple_version))
+        return self.delete_one_cmds[tuple_version]
+
+    def get_one_sql(self):
+        """Return a single-tuple SELECT query
+
+        :return: string
+        """
+        if not hasattr(self, 'get_one_qry'):
+            self.get_one_qry = "SELECT %s.xmin, %s FROM %s %s" % (
+                self.name, ", ".join([name for name, attr in
+                                      self.attributes]),
+                self.name, self.where_clause())
+        return self.get_one_qry
+
+    def column_types(self):
+        """Return the SQL types of the columns of the relvar's table
+
+        :return: dictionary of column names and types
+
+        The types are queried once and cached.
+        """
+        if not hasattr(self, 'coltypes'):
+            rows = self.db.fetchall(
+                """SELECT attname, format_type(atttypid, atttypmod) AS type
+                   FROM pg_attribute
+                   WHERE attrelid = %s::regclass AND attnum > 0
+                         AND NOT attisdropped""", (self.name, ))
+            self.coltypes = dict((row['attname'], row['type'])
+                                 for row in rows)
+        return self.coltypes
+
+    def many_cmd(self, verb, attrnames, tuple_version, nrows):
+        """Return an UPDATE or DELETE command joined to a VALUES list
+
+        :param verb: 'UPDATE' or 'DELETE'
+        :param attrnames: names of attributes to be updated
+        :param tuple_version: indicates whether xmin should be matched
+        :param nrows: number of rows in the VALUES list
+        :return: string
+
+        Each row of the VALUES list holds the key values, the tuple
+        version if needed, and the new values.  The command returns
+        the key values of the rows found.  The commands are cached.
+        """
+        if not hasattr(self, 'many_cmds'):
+            self.many_cmds = {}
+        cachekey = (verb, tuple(attrnames), tuple_version, nrows)
+        if cachekey in self.many_cmds:
+            return self.many_cmds[cachekey]
+        coltypes = self.column_types()
+        cols = [('_kv_%s' % attr, coltypes[attr]) for attr in self.key]
+        match = ['t.%s = v._kv_%s' % (attr, attr) for attr in self.key]
+        if tuple_version:
+            cols.append(('_xmin', 'xid'))
+            match.append('t.xmin = v._xmin')
+        cols.extend([(attr, coltypes[attr]) for attr in attrnames])
+        row = '(%s)' % ", ".join(['CAST(%%s AS %s)' % typ
+                                  for name, typ in cols])
+        values = "(VALUES %s) AS v (%s)" % (
+            ", ".join([row] * nrows), ", ".join(name for name, typ in cols))
+        if verb == 'UPDATE':
+            cmd = "UPDATE %s AS t SET %s FROM %s" % (
+                self.name, ", ".join(['%s = v.%s' % (attr, attr)
+                                      for attr in attrnames]), values)
+        else:
+            cmd = "DELETE FROM %s AS t USING %s" % (self.name, values)
+        cmd += " WHERE %s RETURNING %s" % (" AND ".join(match), ", ".join(
+            ['v._kv_%s' % attr for attr in self.key]))
+        self.many_cmds[cachekey] = cmd
+        return cmd
+
+    def _execute_many(self, verb, attrnames, tuple_version, items,
+                      batch_size):
+        """Execute set-based UPDATE or DELETE commands in batches
+
+        :param verb: 'UPDATE' or 'DELETE'
+        :param attrnames: names of attributes to be updated
+        :param tuple_version: indicates whether xmin should be matched
+        :param items: list of (index, key Tuple, version, values dict)
+        :param batch_size: maximum number of items per command
+        :return: list of indexes of the items whose row was not found
+        """
+        missing = []
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            args = []
+            for (i, keytuple, version, values) in batch:
+                args.extend([getattr(keytuple, attr) for attr in self.key])
+                if tuple_version:
+                    args.append(version)
+                args.extend([values[attr] for attr in attrnames])
+            curs = self.db.execute(self.many_cmd(
+                verb, attrnames, tuple_version, len(batch)), args)
+            found = set(tuple(row['_kv_%s' % attr] for attr in self.key)
+                        for row in curs.fetchall())
+            curs.close()
+            missing.extend([i for (i, keytuple, version, values) in batch
+                            if tuple(getattr(keytuple, attr) for attr
+                                     in self.key) not in found])
+        return missing
+
+    def update_many(self, newtuples, keytuples, currtuples=None,
+                    batch_size=BATCH_SIZE):
+        """Execute set-based UPDATE commands using the primary key
+
+        :param newtuples: list of Tuples with new values
+        :param keytuples: list of Tuples with key values
+        :param currtuples: list of previous versions of newtuples
+        :param batch_size: maximum number of tuples per UPDATE command
+        :return: list of keytuples whose rows were not updated
+
+        This is the equivalent of calling update_one for each tuple,
+        but each batch of tuples updating the same attributes is sent
+        as one UPDATE joined on the key values, and on the tuple
+        versions if currtuples is given, to a VALUES list.  Tuples
+        whose row no longer exists or, with currtuples, has been
+        changed since it was retrieved, are returned instead of
+        raising an error, so that the caller may decide whether to
+        commit the other changes.
+        """
+        groups = {}
+        for i, (newtuple, keytuple) in enumerate(zip(newtuples, keytuples)):
+            if currtuples is not None:
+                currtuple = currtuples[i]
+                values = tuple_values_dict(currtuple, newtuple)
+                if not values:
+                    continue
+                version = currtuple._tuple_version
+            else:
+                values = tuple_values_dict(newtuple)
+                version = None
+            attrnames = tuple(sorted(values.keys()))
+            groups.setdefault(attrnames, []).append(
+                (i, keytuple, version, values))
+        missing = []
+        for attrnames in sorted(groups):
+            missing.extend(self._execute_many(
+                'UPDATE', attrnames, currtuples is not None,
+                groups[attrnames], batch_size))
+        self._invalidate(keytuples)
+        return [keytuples[i] for i in sorted(missing)]
+
+    def delete_many(self, keytuples, currtuples=None, batch_size=BATCH_SIZE):
+        """Execute set-based DELETE commands using the primary key
+
+        :param keytuples: list of Tuples with key values
+        :param currtuples: list of tuples from previous gets
+        :param batch_size: maximum number of tuples per DELETE command
+        :return: list of keytuples whose rows were not deleted
+
+        See update_many for the handling of missing or stale tuples.
+        """
+        items = [(i, keytuple, None if currtuples is None else
+                  currtuples[i]._tuple_version, {})
+                 for i, keytuple in enumerate(keytuples)]
+        missing = self._execute_many('DELETE', (), currtuples is not None,
+                                     items, batch_size)
+        self._invalidate(keytuples)
+        return [keytuples[i] for i in missing]
 
     def get_one(self, keytuple):
         """Execute a single-tuple retrieval and return the tuple data
 
         :param keytuple: Tuple with key values
         :return: Tuple or None
-        """
-        attrdict = dict(self.attributes)
-        attrnames = list(attrdict.keys())
 
-        def get_one_qry():
-            if not hasattr(self, 'get_one_qry'):
-                from_clause = self.name
-                self.get_one_qry = "SELECT %s.xmin, %s FROM %s %s" % (
-                    self.name, ", ".join(attrnames), from_clause,
-                    self.where_clause())
-            return self.get_one_qry
+        If a cache is in use, a copy of the cached tuple is returned
+        if present, after checking its version if revalidation is
+        requested.
+        """
+        if self.cache is not None:
+            if self.listener is not None:
+                self.poll_notifies()
+            cachekey = self.cache_key(keytuple)
+            tup = self.cache.get(cachekey)
+            if tup is not None:
+                if not self.cache.revalidate:
+                    return copy(tup)
+                if not hasattr(self, 'get_version_qry'):
+                    self.get_version_qry = "SELECT xmin FROM %s %s" % (
+                        self.name, self.where_clause())
+                curs = self.execute(self.get_version_qry,
+                                    self.key_values(keytuple))
+                row = curs.fetchone()
+                curs.close()
+                self.db.rollback()
+                if row is not None and row['xmin'] == tup._tuple_version:
+                    return copy(tup)
+                self.cache.invalidate(cachekey, stale=True)
 
         key = self.key_values(keytuple)
-        row = self.db.fetchone(get_one_qry(), key)
+        curs = self.execute(self.get_one_sql(), key)
+        row = curs.fetchone()
+        curs.close()
         self.db.rollback()
         if not row:
             return None
-        tup = Tuple([Attribute(name, attrdict[name].type, row[name],
-                               nullable=attrdict[name].nullable,
-                               sysdefault=attrdict[name].sysdefault)
-                     for name in attrnames])
+        tup = self.row_tuple(row)
+        if self.cache is not None:
+            self.cache.put(cachekey, copy(tup))
+        return tup
+
+    def row_tuple(self, row):
+        """Return a Tuple with the values of a retrieved row
+
+        :param row: row with xmin and all attributes
+        :return: Tuple
+        """
+        names = tuple(name for name, attr in self.attributes)
+        tup = self.tuple_class(names)[0](*[row[name] for name in names])
         tup._tuple_version = row['xmin']
         return tup
+
+    def get_many_qry(self, nkeys):
+        """Return a query retrieving the tuples with any of several keys
+
+        :param nkeys: number of keys, if the key has several attributes
+        :return: string
+
+        A single-attribute key is matched against an array of values.
+        Otherwise, the relvar is joined to a VALUES list.
+        """
+        if not hasattr(self, 'get_many_qrys'):
+            self.get_many_qrys = {}
+        if len(self.key) == 1:
+            nkeys = 1
+        if nkeys not in self.get_many_qrys:
+            coltypes = self.column_types()
+            attrnames = ", ".join(["t.%s" % name
+                                   for name, attr in self.attributes])
+            if len(self.key) == 1:
+                attr = self.key[0]
+                qry = "SELECT t.xmin, %s FROM %s t WHERE %s = ANY(" \
+                    "CAST(%%s AS %s[]))" % (attrnames, self.name, attr,
+                                            coltypes[attr])
+            else:
+                row = '(%s)' % ", ".join(['CAST(%%s AS %s)' % coltypes[attr]
+                                          for attr in self.key])
+                qry = "SELECT t.xmin, %s FROM %s t JOIN (VALUES %s) " \
+                    "AS v (%s) ON (%s)" % (
+                        attrnames, self.name, ", ".join([row] * nkeys),
+                        ", ".join(['_kv_%s' % attr for attr in self.key]),
+                        " AND ".join(['t.%s = v._kv_%s' % (attr, attr)
+                                      for attr in self.key]))
+            self.get_many_qrys[nkeys] = qry
+        return self.get_many_qrys[nkeys]
+
+    def get_many(self, keytuples):
+        """Retrieve several tuples with a single query
+
+        :param keytuples: list of Tuples with key values
+        :return: list of Tuples, or None for keys not found, in the
+            order of keytuples
+        """
+        if not keytuples:
+            return []
+        keys = [tuple(getattr(keytuple, attr) for attr in self.key)
+                for keytuple in keytuples]
+        if len(self.key) == 1:
+            args = ([key[0] for key in keys], )
+        else:
+            args = [val for key in keys for val in key]
+        rows = self.db.fetchall(self.get_many_qry(len(keys)), args)
+        self.db.rollback()
+        found = dict((tuple(row[attr] for attr in self.key), row)
+                     for row in rows)
+        return [self.row_tuple(found[key]) if key in found else None
+                for key in keys]
@@ -3,7 +3,7 @@
     pyrseas.relation.tuple
 """
 from datetime import datetime, time
-from pyrseas.relation.attribute import Attribute
+from pyrseas.relation.attribute import Attribute, attribute_validator
 
 RESERVED_ATTRIBUTE_NAMES = (
     '_heading', '_nullable_attribs', '_tuple_version', '_sysdefault_attribs')
@@ -12,6 +12,15 @@ RESERVED_ATTRIBUTE_NAMES = (
 class Tuple(object):
     "A relational n-tuple: a set of attributes"
 
+    __slots__ = ()
+
+    def __new__(cls, *args, **kwargs):
+        # Tuple itself has no slots for its attributes, so an instance
+        # built from a list of Attributes keeps them in a __dict__
+        if cls is Tuple:
+            cls = _AttributeTuple
+        return object.__new__(cls)
+
     def __init__(self, attribs):
         """Initialize a relational tuple
 
@@ -54,6 +63,10 @@ class Tuple(object):
                                        for name, type_ in self._heading)
 
 
+class _AttributeTuple(Tuple):
+    "A Tuple whose attributes are given by a list of Attributes"
+
+
 def tuple_values_dict(currtuple, newtuple=None):
     """Return dictionary of attributes with their values
 
@@ -62,9 +75,8 @@ def tuple_values_dict(currtuple, newtuple=None):
     :return: dictionary of attributes and values
     """
     valdict = {}
-    for attr in currtuple.__dict__:
-        if attr in RESERVED_ATTRIBUTE_NAMES:
-            continue
+    currattrs = [name for name, type_ in currtuple._heading]
+    for attr in currattrs:
         currval = getattr(currtuple, attr)
         if newtuple is None:
             valdict.update({attr: currval})
@@ -82,9 +94,74 @@ def tuple_values_dict(currtuple, newtuple=None):
             if diff:
                 valdict.update({attr: newval})
     if newtuple is not None:
-        for newattr in newtuple.__dict__:
-            if newattr in RESERVED_ATTRIBUTE_NAMES:
-                continue
-            if newattr not in currtuple.__dict__:
+        for newattr, type_ in newtuple._heading:
+            if newattr not in currattrs:
                 valdict.update({newattr: getattr(newtuple, newattr)})
     return valdict
+
+
+_tuple_classes = {}
+
+
+def tuple_class(attribs):
+    """Return a Tuple subclass specialized for a heading
+
+    :param attribs: list of Attributes giving the names, types and
+        nullable and system default indicators (values are ignored)
+    :return: Tuple subclass, taking the values as positional arguments
+
+    The attribute values are stored in slots and validated by
+    functions prepared when the class is created, so that creating
+    and changing tuples avoids building Attribute objects, while
+    applying the same rules.  Classes are cached by heading.
+    """
+    spec = tuple((attr.name, attr.type, attr.nullable, attr.sysdefault)
+                 for attr in attribs)
+    if spec in _tuple_classes:
+        return _tuple_classes[spec]
+    names = tuple(attr.name for attr in attribs)
+    for name in names:
+        assert name not in RESERVED_ATTRIBUTE_NAMES, \
+            "Cannot use '%s' as attribute name" % name
+    # as in Tuple, system defaults only apply when creating the tuple
+    init_validators = [attribute_validator(*attrspec) for attrspec in spec]
+    set_validators = dict((name, attribute_validator(name, type_, nullable))
+                          for (name, type_, nullable, sysdef) in spec)
+
+    def __init__(self, *values):
+        if len(values) != len(names):
+            raise TypeError("%r takes %d values (%d given)" % (
+                self, len(names), len(values)))
+        for set_, validate, value in zip(setters, init_validators, values):
+            set_(self, validate(value))
+        set_version(self, None)
+
+    def __setattr__(self, name, value):
+        if name in set_validators:
+            value = set_validators[name](value)
+        elif name != '_tuple_version':
+            assert name not in RESERVED_ATTRIBUTE_NAMES, \
+                "Attribute '%s' cannot be set" % name
+            raise AttributeError("%r has no attribute '%s'" % (self, name))
+        object.__setattr__(self, name, value)
+
+    def __copy__(self):
+        other = cls.__new__(cls)
+        for name in cls.__slots__:
+            object.__setattr__(other, name, getattr(self, name))
+        return other
+
+    cls = type('Tuple', (Tuple, ), {
+        '__slots__': names + ('_tuple_version', ),
+        '__init__': __init__, '__setattr__': __setattr__,
+        '__copy__': __copy__,
+        '_heading': tuple((name, type_) for (name, type_, nullable, sysdef)
+                          in spec),
+        '_nullable_attribs': [name for (name, type_, nullable, sysdef)
+                              in spec if nullable],
+        '_sysdefault_attribs': [name for (name, type_, nullable, sysdef)
+                                in spec if sysdef]})
+    setters = [cls.__dict__[name].__set__ for name in names]
+    set_version = cls.__dict__['_tuple_version'].__set__
+    _tuple_classes[spec] = cls
+    return cls
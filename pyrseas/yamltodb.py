@@ -4,14 +4,21 @@
 to match the schema specified in a YAML file"""
 
 from __future__ import print_function
+import json
 import sys
 from argparse import FileType
 
 import yaml
 
 from pyrseas import __version__
+from pyrseas.apply import Executor, BatchExecutor, LockAwareExecutor
 from pyrseas.database import Database
+from pyrseas.datacopy import export_report
 from pyrseas.cmdargs import cmd_parser, parse_args
+from pyrseas.plancache import PlanCache, catalog_fingerprint, plan_key
+from pyrseas.plan import coalesce_alters, estimate_plan, estimate_report
+from pyrseas.plan import stmt_text
+from pyrseas.lib.progress import print_progress
 from pyrseas.lib.pycompat import PY2
 
 
@@ -28,30 +35,110 @@ def main():
                         dest='onetrans', help="wrap commands in BEGIN/COMMIT")
     parser.add_argument('-u', '--update', action='store_true',
                         help="apply changes to database (implies -1)")
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N',
+                        help="with --update, send up to N statements per "
+                        "round trip (default %(default)s)")
+    parser.add_argument('--lock-timeout', type=int, metavar='MS',
+                        help="with --update, wait at most MS milliseconds "
+                        "for each lock and retry statements blocked by "
+                        "other sessions")
+    parser.add_argument('--lock-deadline', type=int, default=60,
+                        metavar='SECS',
+                        help="with --lock-timeout, give up retrying a "
+                        "statement after SECS seconds (default "
+                        "%(default)s)")
+    parser.add_argument('--bulk-load', action='store_true',
+                        help="with --update, load datacopy tables after "
+                        "the other changes are committed, dropping and "
+                        "rebuilding their indexes and foreign keys")
+    parser.add_argument('--sync-data', action='store_true',
+                        help="with --update, after the other changes are "
+                        "committed, change only the rows of datacopy "
+                        "tables that differ from their data files")
+    parser.add_argument('--progress', action='store_true',
+                        help="with --update, report the progress of "
+                        "loading data files")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="with --bulk-load or --sync-data, use N "
+                        "connections (default %(default)s)")
     parser.add_argument('--revert', action='store_true',
                         help="generate SQL to revert changes")
     parser.add_argument('--quote-reserved', action='store_true',
                         help="quote SQL reserved words")
+    parser.add_argument('--coalesce-alters', action='store_true',
+                        help="merge ALTER TABLE statements on the same "
+                        "table")
+    parser.add_argument('--estimate', nargs='?', const='text',
+                        choices=['text', 'json'],
+                        help="report locks, table rewrites/scans and "
+                        "estimated time of each statement, instead of "
+                        "the statements (default format %(const)s)")
+    parser.add_argument('--plan-cache', metavar='DIR',
+                        help="reuse the statements generated for the same "
+                        "input and catalogs, caching them in DIR")
     parser.add_argument('-n', '--schema', metavar='SCHEMA', dest='schemas',
                         action='append', default=[],
                         help="process only named schema(s) (default all)")
     cfg = parse_args(parser)
     output = cfg['files']['output']
     options = cfg['options']
+    if options.estimate and options.update:
+        parser.error("Cannot specify both --estimate and --update")
+    if options.batch_size < 1:
+        parser.error("Batch size must be a positive integer")
+    if options.lock_timeout is not None and options.lock_timeout < 1:
+        parser.error("Lock timeout must be a positive integer")
+    if options.bulk_load and not options.update:
+        parser.error("--bulk-load requires --update")
+    if options.sync_data and not options.update:
+        parser.error("--sync-data requires --update")
+    if options.bulk_load and options.sync_data:
+        parser.error("Cannot specify both --bulk-load and --sync-data")
+    if options.jobs < 1:
+        parser.error("Number of jobs must be a positive integer")
     db = Database(cfg)
     if options.multiple_files:
         inmap = db.map_from_dir()
     else:
         inmap = yaml.safe_load(options.spec)
 
-    stmts = db.diff_map(inmap)
+    if options.plan_cache:
+        cache = PlanCache(options.plan_cache)
+        fingerprint = catalog_fingerprint(db.dbconn)
+        key = plan_key(inmap, cfg, fingerprint)
+        plan = cache.get(key)
+        if plan is None:
+            plan = cache.put(key, db.diff_map(inmap), fingerprint,
+                             db.dbconn.dbname)
+        else:
+            print("Using cached plan %s" % key, file=sys.stderr)
+        stmts = plan['statements']
+    else:
+        stmts = db.diff_map(inmap)
+    if options.update and options.lock_timeout and \
+            db.dbconn.version < 90300:
+        parser.error("--lock-timeout requires PostgreSQL 9.3 or later")
+    if options.sync_data and db.dbconn.version < 90500:
+        parser.error("--sync-data requires PostgreSQL 9.5 or later")
+    if options.coalesce_alters:
+        stmts = coalesce_alters(stmts)
+    if options.estimate:
+        estimates = estimate_plan(db.dbconn, stmts, cfg.get('estimate'))
+        fd = output or sys.stdout
+        if options.estimate == 'json':
+            print(json.dumps(estimates, indent=2), file=fd)
+        else:
+            print(estimate_report(estimates), file=fd)
+        if output:
+            output.close()
+        return
     if stmts:
         fd = output or sys.stdout
         if options.onetrans or options.update:
             print("BEGIN;", file=fd)
         for stmt in stmts:
             if isinstance(stmt, tuple):
-                outstmt = "".join(stmt) + '\n'
+                outstmt = stmt_text(stmt) + '\n'
             else:
                 outstmt = "%s;\n" % stmt
             if PY2:
@@ -60,21 +147,45 @@ def main():
         if options.onetrans or options.update:
             print("COMMIT;", file=fd)
         if options.update:
+            if options.lock_timeout:
+                executor = LockAwareExecutor(
+                    db.dbconn, options.batch_size, options.lock_timeout,
+                    options.lock_deadline,
+                    log=lambda msg: print(msg, file=sys.stderr))
+            elif options.batch_size > 1:
+                executor = BatchExecutor(db.dbconn, options.batch_size)
+            else:
+                executor = Executor(db.dbconn)
+            if options.progress:
+                executor.progress = print_progress
+            if options.plan_cache:
+                def check_fingerprint():
+                    if catalog_fingerprint(db.dbconn) != fingerprint:
+                        sys.exit("Catalogs changed since the plan was "
+                                 "generated: not applied")
+                executor.begin = check_fingerprint
             try:
-                for stmt in stmts:
-                    if isinstance(stmt, tuple):
-                        # expected format: (\copy, table, from, path, csv)
-                        db.dbconn.copy_from(stmt[3], stmt[1])
-                    else:
-                        db.dbconn.execute(stmt)
+                executor.run(stmts)
             except:
                 db.dbconn.rollback()
                 raise
             else:
                 db.dbconn.commit()
+                if options.lock_timeout:
+                    print(executor.wait_report(), file=sys.stderr)
+                if executor.loads:
+                    print(export_report(executor.loads), file=sys.stderr)
                 print("Changes applied", file=sys.stderr)
         if output:
             output.close()
+    if options.bulk_load:
+        db.bulk_load(inmap, options.jobs, print_progress,
+                     print_progress if options.progress else None)
+        print("Data loaded", file=sys.stderr)
+    elif options.sync_data:
+        db.sync_data(inmap, options.jobs, print_progress,
+                     print_progress if options.progress else None)
+        print("Data synchronized", file=sys.stderr)
 
 if __name__ == '__main__':
     main()
@@ -37,6 +37,8 @@ setup(
     install_requires=[
         'psycopg2 >= 2.2',
         'PyYAML >= 3.09'],
+    extras_require={
+        'async': ['psycopg >= 3.1', 'psycopg_pool >= 3.1']},
 
     tests_require=['pytest'],
     cmdclass={'test': PyTest},
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks for Tuples
+
+Run with ``python -m tests.relation.bench_tuple`` from the top
+directory.  Each benchmark is timed with ``timeit`` and the best time
+per operation, in microseconds, is printed.
+"""
+from __future__ import print_function
+
+import timeit
+from collections import namedtuple
+from datetime import datetime
+
+from pyrseas.relation import Attribute, RelVar, Tuple
+from pyrseas.relation.tuple import tuple_class
+
+ATTRIBS = [Attribute('id', int), Attribute('title'),
+           Attribute('descr', nullable=True),
+           Attribute('updated', datetime, sysdefault=True)]
+VALUES = (123, "John Doe", "A description", datetime(2017, 1, 2, 3, 4, 5))
+ROW = dict(zip([attr.name for attr in ATTRIBS], VALUES))
+
+rv = RelVar('rv', ATTRIBS, key=['id'])
+cls = tuple_class(ATTRIBS)
+NamedTuple = namedtuple('NamedTuple', [attr.name for attr in ATTRIBS])
+
+
+def generic_tuple():
+    return Tuple([Attribute(attr.name, attr.type, val,
+                            nullable=attr.nullable,
+                            sysdefault=attr.sysdefault)
+                  for attr, val in zip(ATTRIBS, VALUES)])
+
+
+generic = generic_tuple()
+generated = cls(*VALUES)
+
+
+def set_generic():
+    generic.title = "Jane Doe"
+
+
+def set_generated():
+    generated.title = "Jane Doe"
+
+
+BENCHMARKS = [
+    ("namedtuple (baseline)", lambda: NamedTuple(*VALUES)),
+    ("Tuple of Attributes", generic_tuple),
+    ("generated class", lambda: cls(*VALUES)),
+    ("RelVar.tuple", lambda: rv.tuple(**ROW)),
+    ("set, Tuple of Attributes", set_generic),
+    ("set, generated class", set_generated),
+]
+
+
+def main(number=20000, repeat=5):
+    for (label, func) in BENCHMARKS:
+        best = min(timeit.repeat(func, number=number, repeat=repeat))
+        print("%-28s %8.2f usec" % (label, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Test asyncio RelVars and JoinRelations"""
+from __future__ import unicode_literals
+
+import pytest
+
+pytest.importorskip('psycopg')
+pytest.importorskip('psycopg_pool')
+
+import asyncio
+
+from pyrseas.relation import RelVar, Attribute, ProjAttribute, Projection
+from pyrseas.relation import JoinRelation
+from pyrseas.relation.aio import AsyncRelVar, AsyncJoinRelation
+from pyrseas.relation.aio import connection_pool
+from pyrseas.testutils import RelationTestCase
+
+rv1 = RelVar('rv1', [Attribute('id', int, sysdefault=True),
+                     Attribute('title'),
+                     Attribute('descr', nullable=True)],
+             key=['id'])
+
+jr1 = JoinRelation([Projection('rv1', [ProjAttribute('id', int),
+                                       ProjAttribute('title')])])
+
+
+class TestAsyncRelvar(RelationTestCase):
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.pgdb.execute("DROP TABLE IF EXISTS rv1 CASCADE")
+        self.pgdb.execute_commit(
+            "CREATE TABLE rv1 (id serial PRIMARY KEY, "
+            "title text NOT NULL UNIQUE, descr text)")
+
+    def run(self, test):
+        "Run a coroutine function with a connection pool"
+        async def run_with_pool():
+            pool = connection_pool(self.db, max_size=2)
+            await pool.open()
+            try:
+                await test(pool)
+            finally:
+                await pool.close()
+        asyncio.run(run_with_pool())
+
+    def test_async_crud(self):
+        "Insert, get, update and delete a tuple"
+        async def test(pool):
+            relvar = AsyncRelVar(rv1)
+            relvar.connect(pool)
+            keytuple = await relvar.insert_one(rv1.tuple(title="John Doe"),
+                                               True)
+            currtuple = await relvar.get_one(keytuple)
+            assert currtuple.title == "John Doe"
+            newtuple = rv1.tuple(id=currtuple.id, title="Jane Doe")
+            await relvar.update_one(newtuple, keytuple, currtuple)
+            assert (await relvar.get_one(keytuple)).title == "Jane Doe"
+            await relvar.delete_one(keytuple)
+            assert await relvar.get_one(keytuple) is None
+        self.run(test)
+
+    def test_async_join_subset(self):
+        "Count and retrieve tuples from a join relation"
+        self.pgdb.execute_commit(
+            "INSERT INTO rv1 SELECT i, 'Title ' || i "
+            "FROM generate_series(1, 30) i")
+
+        async def test(pool):
+            joinrel = AsyncJoinRelation(jr1)
+            joinrel.connect(pool)
+            assert await joinrel.count({'title': '2'}) == 12
+            tuples = await joinrel.subset(10, 10)
+            assert tuples[0].title == 'Title 11'
+        self.run(test)
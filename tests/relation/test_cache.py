@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Test Tuple caches"""
+from pyrseas.relation import Attribute, RelVar, Tuple
+from pyrseas.relation.cache import TupleCache
+
+
+def test_cache_lru():
+    "Drop the least recently used tuples"
+    cache = TupleCache(maxsize=2)
+    for i in range(1, 4):
+        if i == 3:
+            assert cache.get((1, )) is not None
+        cache.put((i, ), Tuple(Attribute('id', int, i)))
+    assert len(cache) == 2
+    assert cache.get((2, )) is None
+    assert cache.get((3, )).id == 3
+    assert cache.stats() == {'size': 2, 'hits': 2, 'misses': 1, 'stale': 0,
+                             'invalidations': 0, 'evictions': 1}
+
+
+def test_cache_ttl(monkeypatch):
+    "Drop tuples after their time to live"
+    now = [1000.0]
+    monkeypatch.setattr(TupleCache, 'clock', staticmethod(lambda: now[0]))
+    cache = TupleCache(ttl=10)
+    cache.put((1, ), Tuple(Attribute('id', int, 1)))
+    now[0] += 5
+    assert cache.get((1, )) is not None
+    now[0] += 6
+    assert cache.get((1, )) is None
+    assert len(cache) == 0
+
+
+def test_cache_invalidate():
+    "Remove tuples from the cache"
+    cache = TupleCache()
+    cache.put((1, ), Tuple(Attribute('id', int, 1)))
+    cache.put((2, ), Tuple(Attribute('id', int, 2)))
+    cache.invalidate((1, ))
+    cache.invalidate((2, ), stale=True)
+    cache.invalidate((3, ))
+    stats = cache.stats()
+    assert stats['invalidations'] == 1
+    assert stats['stale'] == 1
+    assert stats['size'] == 0
+
+
+def test_relvar_notify_trigger():
+    "Generate a trigger notifying changes to a relvar"
+    relvar = RelVar('s1.rv1', [Attribute('id', int), Attribute('title')],
+                    key=['id'])
+    stmts = relvar.notify_trigger()
+    assert "pg_notify('pyrseas_s1_rv1', json_build_object('id', OLD.id)" \
+        "::text)" in stmts[0]
+    assert stmts[2] == "CREATE TRIGGER pyrseas_s1_rv1 AFTER UPDATE OR " \
+        "DELETE ON s1.rv1 FOR EACH ROW EXECUTE PROCEDURE pyrseas_s1_rv1()"
@@ -165,6 +165,55 @@ def test_joinrel_dupe_rangevar(proj1):
                                         rangevar='a')])
 
 
+def test_joinrel_page_query(joinrel1):
+    "Generate a query for a page of tuples with the total count"
+    (query, params) = joinrel1.page_query(10, 20, qry_args={'title': '7'})
+    assert query == "SELECT a.a_id, a.title, a.descr, a.code, count(*) " \
+        "OVER () AS _total FROM arv a WHERE a.title ILIKE %(title)s " \
+        "ORDER BY 1 LIMIT 10 OFFSET 20"
+    assert params == {'title': '%7%'}
+
+
+def test_joinrel_subset_query_projection(joinrel3):
+    "Generate a query selecting some attributes, and those sorted on"
+    (query, params) = joinrel3.subset_query(
+        10, qry_args={'code': '3'}, order=['child_name'],
+        attributes=['parent_name'])
+    assert query == "SELECT p.name AS parent_name, c.name AS child_name " \
+        "FROM crv r JOIN arv p ON (id1 = p.id) JOIN arv c ON " \
+        "(id2 = c.id) WHERE r.code = %(code)s ORDER BY child_name " \
+        "LIMIT 10 OFFSET 0"
+    assert params == {'code': 3}
+    (query, params) = joinrel3.subset_query(attributes=['child_name'])
+    assert query.startswith("SELECT c.name AS child_name, r.id1 AS "
+                            "parent_id FROM")
+    assert " ORDER BY parent_id " in query
+
+
+def test_joinrel_subset_query_cached(joinrel2):
+    "Reuse the query for the same argument names, order and projection"
+    (query1, params1) = joinrel2.subset_query(
+        qry_args={'name': 'x', 'num': '>5'}, order=['title'],
+        attributes=['name'])
+    ncached = len(joinrel2.subset_queries)
+    (query2, params2) = joinrel2.subset_query(
+        qry_args={'name': 'y', 'num': '>7'}, order=['title'],
+        attributes=['name'])
+    assert query2 == query1
+    assert len(joinrel2.subset_queries) == ncached
+    assert params2 == {'name': '%y%', 'num': 7}
+    (query3, params3) = joinrel2.subset_query(
+        qry_args={'name': 'y', 'num': '<7'}, order=['title'],
+        attributes=['name'])
+    assert "b.num < %(num)s" in query3
+
+
+def test_joinrel_subset_query_unknown_attribute(joinrel1):
+    "Error selecting an attribute not in the relation"
+    with pytest.raises(AttributeError):
+        joinrel1.subset_query(attributes=['title', 'name'])
+
+
 class TestJoinRel1(RelationTestCase):
 
     @pytest.fixture(autouse=True)
@@ -211,6 +260,57 @@ class TestJoinRel1(RelationTestCase):
         assert len(tuples) == 19
         assert tuples[2].title == 'Title 27'
 
+    def test_joinrel_get_after(self):
+        "Get the page of tuples following a given tuple"
+        self.insert_multiple(100)
+        tuples = self.relation.subset(10)
+        tuples = self.relation.subset(10, after=tuples[-1])
+        assert len(tuples) == 10
+        assert tuples[0].a_id == 11
+        assert tuples[9].title == 'Title 20'
+
+    def test_joinrel_iter_subset(self):
+        "Iterate over tuples read with a server-side cursor"
+        self.insert_multiple(100)
+        tuples = list(self.relation.iter_subset(
+            qry_args={'title': '7'}, fetch_size=5))
+        assert len(tuples) == 19
+        assert tuples[2].title == 'Title 27'
+
+    def test_joinrel_subset_projection(self):
+        "Get several tuples with only some attributes"
+        self.insert_multiple(20)
+        tuples = self.relation.subset(3, 5, attributes=['title'])
+        assert [tup.title for tup in tuples] == ['Title 6', 'Title 7',
+                                                 'Title 8']
+        assert not hasattr(tuples[0], 'descr')
+        tuples = list(self.relation.iter_subset(
+            qry_args={'code': '2'}, order=['a_id DESC'],
+            attributes=['descr']))
+        assert len(tuples) == 7
+        assert tuples[0].descr == 'Description 19'
+        assert tuples[0].a_id == 19
+
+    def test_joinrel_page(self):
+        "Get a page of tuples and the total count"
+        self.insert_multiple(100)
+        (total, tuples) = self.relation.page(10, 30)
+        assert total == 100
+        assert tuples[0].title == 'Title 31'
+        (total, tuples) = self.relation.page(5, qry_args={'title': '7'},
+                                             after=tuples[-1])
+        assert total == 19
+        assert tuples[0].title == 'Title 47'
+        assert self.relation.page(10, 200) == (100, [])
+
+    def test_joinrel_page_estimate(self):
+        "Get a page of tuples and an estimated count"
+        self.insert_multiple(100)
+        self.pgdb.execute_commit("ANALYZE arv")
+        (total, tuples) = self.relation.page(10, estimate=True)
+        assert total == 100
+        assert len(tuples) == 10
+
 
 class TestJoinRel2(RelationTestCase):
 
@@ -250,6 +350,17 @@ class TestJoinRel2(RelationTestCase):
         assert tuples[0].name == 'Name 99'
         assert tuples[9].title == 'John Doe'
 
+    def test_get_join_after_order_desc(self):
+        "Get the tuples following a given tuple in mixed order"
+        tuples = self.relation.subset(10, order=['title DESC', 'num'])
+        assert tuples[9].title == 'Peter Jones'
+        tuples = self.relation.subset(30, order=['title DESC', 'num'],
+                                      after=tuples[-1])
+        assert tuples[0].num == 32
+        assert tuples[22].title == 'Peter Jones'
+        assert tuples[23].title == 'John Doe'
+        assert tuples[23].num == 3
+
     def test_get_join_order_by_unknown(self):
         "Get a slice of tuples ordered by unknown attribute"
         with pytest.raises(AttributeError):
@@ -2,6 +2,7 @@
 """Test RelVars"""
 from __future__ import unicode_literals
 
+import json
 from copy import copy
 from datetime import date, datetime, timedelta
 
@@ -9,6 +10,7 @@ import pytest
 from psycopg2 import DatabaseError, IntegrityError
 
 from pyrseas.relation import RelVar, Attribute
+from pyrseas.relation.relvar import copy_text
 from pyrseas.testutils import RelationTestCase
 
 TEST_DATA1 = {'title': "John Doe"}
@@ -26,6 +28,12 @@ rv1 = RelVar('rv1', [Attribute('id', int, sysdefault=True),
 rv2 = RelVar('rv2', [Attribute('num', int), Attribute('name'),
                      Attribute('id', int)], key=['num'])
 
+rv4 = RelVar('rv4', [Attribute('id', int),
+                     Attribute('data', bytes, nullable=True),
+                     Attribute('nums', list, nullable=True),
+                     Attribute('doc', dict, nullable=True)],
+             key=['id'])
+
 rv3 = RelVar('rv3', [Attribute('id1', int), Attribute('id2', int),
                      Attribute('code'), Attribute('descr'),
                      Attribute('created', date, sysdefault=True)],
@@ -69,6 +77,25 @@ def test_relvar_tuple_unknown_attribute(relvar1):
         relvar1.tuple(code='abc')
 
 
+def test_relvar_copy_text():
+    "Format attribute values for COPY"
+    assert copy_text(None) == '\\N'
+    assert copy_text(True) == 't'
+    assert copy_text("a\tb\\c\n") == 'a\\tb\\\\c\\n'
+    assert copy_text(date(2017, 1, 2)) == '2017-01-02'
+    assert copy_text(b'\x00\\') == '\\\\x005c'
+    assert copy_text([1, None, ['a"b', 'c,d']]) == \
+        '{"1",NULL,{"a\\\\"b","c,d"}}'
+    assert copy_text({'a': 'b\tc'}) == '{"a": "b\\\\tc"}'
+
+
+def test_relvar_insert_many_invalid_heading(relvar1):
+    "Insert tuples not matching the relvar heading"
+    tuples = [relvar1.tuple(**TEST_DATA1), rv2.tuple(**TEST_DATA2)]
+    with pytest.raises(ValueError):
+        relvar1.insert_many(tuples)
+
+
 class TestRelvar1(RelationTestCase):
 
     @pytest.fixture(autouse=True)
@@ -131,6 +158,38 @@ class TestRelvar1(RelationTestCase):
         row = self.get_one(1)
         assert row['descr'] is None
 
+    def test_relvar_insert_many(self):
+        "Insert several tuples with a multi-row INSERT"
+        tuples = [self.relvar.tuple(title="Title %d" % i) for i in range(5)]
+        self.relvar.insert_many(tuples)
+        self.db.commit()
+        row = self.pgdb.fetchone(
+            "SELECT array_agg(title ORDER BY id) AS titles FROM rv1")
+        assert row['titles'] == [tup.title for tup in tuples]
+
+    def test_relvar_insert_many_return_pk(self):
+        "Insert several tuples and return the generated primary keys"
+        self.insert_one()
+        tuples = [self.relvar.tuple(title="Title %d" % i) for i in range(3)]
+        retvals = self.relvar.insert_many(tuples, True, batch_size=2)
+        self.db.commit()
+        assert [tup.id for tup in retvals] == [2, 3, 4]
+        assert self.get_one(retvals[2].id)['title'] == tuples[2].title
+
+    def test_relvar_insert_many_copy(self):
+        "Insert more tuples than the batch size using COPY"
+        tuples = [self.relvar.tuple(title="Title\t%d" % i) for i in range(4)]
+        tuples.append(self.relvar.tuple(id=10, title="Back\\slash",
+                                        descr=''))
+        self.relvar.insert_many(tuples, batch_size=2)
+        self.db.commit()
+        rows = self.db.fetchall("SELECT id, title, descr FROM rv1 "
+                                "ORDER BY id")
+        assert [row['title'] for row in rows] == [tup.title
+                                                  for tup in tuples]
+        assert rows[4]['id'] == 10
+        assert rows[4]['descr'] is None
+
     def test_relvar_dup_insert_pk(self):
         "Insert a duplicate by overriding normal sequenced primary key value"
         self.insert_one()
@@ -160,6 +219,18 @@ class TestRelvar1(RelationTestCase):
         "Fail to retrieve a single tuple from a relvar"
         assert self.relvar.get_one(self.relvar.key_tuple(1)) is None
 
+    def test_relvar_get_many(self):
+        "Retrieve several tuples with one query, in the order requested"
+        self.insert_one()
+        self.pgdb.execute_commit("INSERT INTO rv1 (title) VALUES (%(title)s)",
+                                 (TEST_DATA1x))
+        tuples = self.relvar.get_many([self.relvar.key_tuple(i)
+                                       for i in (2, 3, 1)])
+        assert tuples[0].title == TEST_DATA1x['title']
+        assert tuples[1] is None
+        assert tuples[2].title == TEST_DATA1['title']
+        assert tuples[2]._tuple_version == self.get_one(1)['xmin']
+
     def test_relvar_update_one(self):
         "Update a single tuple in a relvar"
         self.insert_one()
@@ -211,6 +282,35 @@ class TestRelvar1(RelationTestCase):
         with pytest.raises(DatabaseError):
             self.relvar.update_one(currtuple, keytuple)
 
+    def test_relvar_update_many(self):
+        "Update several tuples, detecting those changed since fetched"
+        self.insert_one()
+        self.pgdb.execute_commit("INSERT INTO rv1 (title) VALUES (%(title)s)",
+                                 (TEST_DATA1x))
+        keytuples = [self.relvar.key_tuple(1), self.relvar.key_tuple(2)]
+        currtuples = [self.relvar.get_one(keytuple) for keytuple in keytuples]
+        newtuples = [copy(currtuple) for currtuple in currtuples]
+        newtuples[0].title = "Jane Doe"
+        newtuples[1].title = "Mary Smith"
+        self.pgdb.execute_commit("UPDATE rv1 SET descr = 'x' WHERE id = 2")
+        stale = self.relvar.update_many(newtuples, keytuples, currtuples)
+        self.db.commit()
+        assert stale == [keytuples[1]]
+        assert self.get_one(1)['title'] == newtuples[0].title
+        assert self.get_one(2)['title'] == TEST_DATA1x['title']
+
+    def test_relvar_delete_many(self):
+        "Delete several tuples, reporting those already deleted"
+        self.insert_one()
+        self.pgdb.execute_commit("INSERT INTO rv1 (title) VALUES (%(title)s)",
+                                 (TEST_DATA1x))
+        keytuples = [self.relvar.key_tuple(i) for i in (1, 2, 3)]
+        missing = self.relvar.delete_many(keytuples)
+        self.db.commit()
+        assert missing == [keytuples[2]]
+        assert self.get_one(1) is None
+        assert self.get_one(2) is None
+
     def test_relvar_delete_one(self):
         "Delete a single tuple from a relvar"
         self.insert_one()
@@ -229,6 +329,70 @@ class TestRelvar1(RelationTestCase):
         with pytest.raises(DatabaseError):
             self.relvar.delete_one(currtuple, keytuple)
 
+    def test_relvar_cache(self):
+        "Retrieve tuples from the cache, invalidated by updates"
+        self.insert_one()
+        cache = self.relvar.use_cache(revalidate=True)
+        try:
+            keytuple = self.relvar.key_tuple(1)
+            currtuple = self.relvar.get_one(keytuple)
+            assert self.relvar.get_one(keytuple).title == currtuple.title
+            newtuple = copy(currtuple)
+            newtuple.title = "Jane Doe"
+            self.relvar.update_one(newtuple, keytuple, currtuple)
+            self.db.commit()
+            assert self.relvar.get_one(keytuple).title == newtuple.title
+            self.pgdb.execute_commit("UPDATE rv1 SET title = 'x' WHERE id = 1")
+            assert self.relvar.get_one(keytuple).title == 'x'
+            stats = cache.stats()
+            assert stats['hits'] == 2
+            assert stats['misses'] == 2
+            assert stats['stale'] == 1
+            assert stats['invalidations'] == 1
+        finally:
+            self.relvar.cache = None
+
+    def test_relvar_cache_read_during_update(self, monkeypatch):
+        "Invalidate the cache after a read racing with an update"
+        self.insert_one()
+        cache = self.relvar.use_cache()
+        keytuple = self.relvar.key_tuple(1)
+        execute = self.relvar.execute
+
+        def read_then_execute(cmd, args):
+            if cmd.startswith("UPDATE"):
+                self.relvar.get_one(keytuple)
+            return execute(cmd, args)
+
+        try:
+            currtuple = self.relvar.get_one(keytuple)
+            newtuple = copy(currtuple)
+            newtuple.title = "Jane Doe"
+            monkeypatch.setattr(self.relvar, 'execute', read_then_execute)
+            self.relvar.update_one(newtuple, keytuple, currtuple)
+            self.db.commit()
+            monkeypatch.undo()
+            assert len(cache) == 0
+            assert self.relvar.get_one(keytuple).title == newtuple.title
+        finally:
+            self.relvar.cache = None
+
+    def test_relvar_prepared(self):
+        "Update a tuple using prepared statements, preparing them again"
+        self.insert_one()
+        self.relvar.connect(self.db, prepare=True)
+        keytuple = self.relvar.key_tuple(1)
+        currtuple = self.relvar.get_one(keytuple)
+        assert self.relvar.get_one_qry in self.db.prepared
+        self.db.execute("DEALLOCATE ALL").close()
+        self.db.commit()
+        currtuple = self.relvar.get_one(keytuple)
+        newtuple = copy(currtuple)
+        newtuple.title = "Jane Doe"
+        self.relvar.update_one(newtuple, keytuple, currtuple)
+        self.db.commit()
+        assert self.get_one(1)['title'] == newtuple.title
+
 
 class TestRelvar2(RelationTestCase):
 
@@ -366,6 +530,15 @@ class TestRelvar3(RelationTestCase):
         assert row['descr'] == newtuple.descr
         assert row['created'] == date.today()
 
+    def test_relvar_get_many_multi_key(self):
+        "Retrieve several tuples from a relvar with a multi-attribute key"
+        self.insert_one()
+        keytuples = [self.relvar.key_tuple(1, 'EN', 2),
+                     self.relvar.key_tuple(**TEST_DATA3)]
+        tuples = self.relvar.get_many(keytuples)
+        assert tuples[0] is None
+        assert tuples[1].descr == TEST_DATA3['descr']
+
     def test_relvar_update_one(self):
         "Update a tuple in a relvar with a multi-attribute key"
         self.insert_one()
@@ -382,3 +555,41 @@ class TestRelvar3(RelationTestCase):
         assert row['code'] == currtuple.code
         assert row['id2'] == currtuple.id2
         assert row['descr'] == currtuple.descr
+
+
+class TestRelvar4(RelationTestCase):
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.relvar = rv4
+        self.relvar.connect(self.db)
+        self.pgdb.execute("DROP TABLE IF EXISTS rv4")
+        self.pgdb.execute_commit(
+            "CREATE TABLE rv4 (id integer PRIMARY KEY, data bytea, "
+            "nums integer[], doc text)")
+
+    def insert_copy(self, **kwargs):
+        tuples = [self.relvar.tuple(id=i, **kwargs) for i in range(3)]
+        self.relvar.insert_many(tuples[:2], batch_size=1)
+        self.relvar.insert_many(tuples[2:])
+        self.db.commit()
+        return self.db.fetchall("SELECT * FROM rv4 ORDER BY id")
+
+    def test_relvar_insert_many_copy_bytea(self):
+        "Insert binary data using COPY"
+        rows = self.insert_copy(data=b'\x00\\\n\xff')
+        assert [bytes(row['data']) for row in rows] == [b'\x00\\\n\xff'] * 3
+
+    def test_relvar_insert_many_copy_array(self):
+        "Insert arrays using COPY"
+        rows = self.insert_copy(nums=[[1, 2], [None, 4]])
+        assert [row['nums'] for row in rows] == [[[1, 2], [None, 4]]] * 3
+
+    def test_relvar_insert_many_copy_json(self):
+        "Insert dictionaries as JSON using COPY"
+        doc = {'a': "b\tc", 'd': [1, None]}
+        tuples = [self.relvar.tuple(id=i, doc=doc) for i in range(3)]
+        self.relvar.insert_many(tuples, batch_size=1)
+        self.db.commit()
+        rows = self.db.fetchall("SELECT doc FROM rv4 ORDER BY id")
+        assert [json.loads(row['doc']) for row in rows] == [doc] * 3
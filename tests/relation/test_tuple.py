@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 """Test Tuples"""
+from copy import copy
+from datetime import datetime
+
 from pytest import raises
 
 from pyrseas.relation import Attribute, Tuple
-from pyrseas.relation.tuple import tuple_values_dict
+from pyrseas.relation.tuple import tuple_class, tuple_values_dict
 
 
 def test_tuple_no_attribs():
@@ -132,3 +135,43 @@ def test_tuple_changed_nullable_values():
                   Attribute('attr2', str, '', nullable=True),
                  Attribute('attr3', float, 0, nullable=True)])
     assert tuple_values_dict(tup1, tup2) == {'attr2': None, 'attr3': None}
+
+
+def test_tuple_class():
+    "Create a tuple from a class generated for its heading"
+    cls = tuple_class([Attribute('attr1', int), Attribute('attr2'),
+                       Attribute('attr3', float, nullable=True)])
+    tup = cls(123, 'abc', 0)
+    assert isinstance(tup, Tuple)
+    assert tup.attr1 == 123
+    assert tup.attr3 is None
+    assert tup._heading == (('attr1', int), ('attr2', str), ('attr3', float))
+    assert tup._nullable_attribs == ['attr3']
+    assert tup._tuple_version is None
+    assert repr(tup) == "Tuple(attr1 int, attr2 str, attr3 float)"
+    assert not hasattr(tup, '__dict__')
+    assert tuple_class([Attribute('attr1', int), Attribute('attr2'),
+                        Attribute('attr3', float, nullable=True)]) is cls
+
+
+def test_tuple_class_values():
+    "Validate values of a tuple from a generated class"
+    cls = tuple_class([Attribute('attr1', int),
+                       Attribute('attr2', datetime, sysdefault=True)])
+    tup = cls(None, None)
+    assert tup.attr1 == 0
+    assert tup.attr2 is None
+    with raises(ValueError):
+        cls('abc', None)
+    with raises(ValueError):
+        tup.attr1 = 'abc'
+    with raises(ValueError):
+        tup.attr2 = None
+    with raises(AttributeError):
+        tup.attr3 = 1
+    tup.attr1 = 456
+    tup._tuple_version = 789
+    tup2 = copy(tup)
+    assert tup2.attr1 == 456
+    assert tup2._tuple_version == 789
+    assert tuple_values_dict(tup, tup2) == {}
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Test execution of generated SQL statements"""
+
+import threading
+import time
+from argparse import Namespace
+
+import pytest
+
+from pyrseas.apply import StatementError, batches, conflicting_modes
+from pyrseas.apply import lock_mode_name, LockAwareExecutor, LOCK_CONFLICTS
+from pyrseas.apply import blocked_by, conflicting_holders_query
+from pyrseas.apply import split_table_name
+from pyrseas.lib.dbutils import PostgresDb
+from pyrseas.testutils import RelationTestCase, TEST_DBNAME, TEST_HOST
+from pyrseas.testutils import TEST_PORT, TEST_USER
+
+COPY = ("\\copy ", 't1', " from '", '/tmp/t1.data', "' csv")
+
+
+def test_batches():
+    "Group statements in batches of a given size"
+    stmts = ["GRANT SELECT ON t%d TO PUBLIC" % i for i in range(5)]
+    assert [[i for (i, stmt) in batch] for batch in batches(stmts, 2)] == [
+        [1, 2], [3, 4], [5]]
+
+
+def test_batches_copy():
+    "A \\copy tuple is in a batch by itself"
+    stmts = ["TRUNCATE ONLY t1", COPY, "COMMENT ON TABLE t1 IS 'x'",
+             "COMMENT ON TABLE t2 IS 'y'"]
+    assert list(batches(stmts, 10)) == [
+        [(1, "TRUNCATE ONLY t1")], [(2, COPY)],
+        [(3, "COMMENT ON TABLE t1 IS 'x'"), (4, "COMMENT ON TABLE t2 IS 'y'")]]
+
+
+def test_statement_error():
+    "Report the failing statement and its position"
+    err = StatementError(3, "DROP TABLE t9", Exception(
+        'table "t9" does not exist\n'))
+    assert str(err) == 'Statement 3 failed: DROP TABLE t9\n' \
+        'table "t9" does not exist'
+    assert str(StatementError(2, COPY, Exception("x"))).startswith(
+        "Statement 2 failed: \\copy t1 from '/tmp/t1.data' csv")
+
+
+def test_conflicting_modes():
+    "Map lock modes to the pg_locks names of the modes they conflict with"
+    assert lock_mode_name('SHARE ROW EXCLUSIVE') == 'ShareRowExclusiveLock'
+    assert conflicting_modes('ACCESS SHARE') == ['AccessExclusiveLock']
+    assert 'AccessShareLock' in conflicting_modes('ACCESS EXCLUSIVE')
+    assert 'AccessShareLock' not in conflicting_modes('EXCLUSIVE')
+    assert 'RowExclusiveLock' in conflicting_modes('SHARE')
+
+
+def test_lock_conflicts_symmetric():
+    "Lock conflicts are symmetric"
+    for (mode, others) in LOCK_CONFLICTS.items():
+        for other in others:
+            assert mode in LOCK_CONFLICTS[other]
+
+
+def test_blocked_by():
+    "A lock request waits for conflicting locks held by this session"
+    assert blocked_by('RowExclusiveLock', ['AccessExclusiveLock'])
+    assert not blocked_by('RowExclusiveLock', ['AccessShareLock',
+                                               'SIReadLock'])
+    assert not blocked_by('AccessShareLock', [])
+
+
+def test_split_table_name():
+    "Split qualified and quoted table names"
+    assert split_table_name('t1') == (None, 't1')
+    assert split_table_name('s1.T1') == ('s1', 't1')
+    assert split_table_name('"My Schema"."t""1"') == ('My Schema', 't"1')
+
+
+def test_conflicting_holders_query_versions():
+    "Use the pg_stat_activity columns of the server version"
+    assert "a.procpid" in conflicting_holders_query(90100)
+    assert "a.pid" in conflicting_holders_query(90200)
+    assert "to_regclass" not in conflicting_holders_query(90000)
+
+
+class Clock(object):
+    "Simulated time"
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def sleep(self, secs):
+        self.sleeps.append(secs)
+        self.now += secs
+
+
+class FakeConnection(object):
+    "Connection recording rollbacks"
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def lock_aware(holders_seq, deadline=60):
+    "Return an executor that sees a sequence of conflicting lock holders"
+    class Executor(LockAwareExecutor):
+        def conflicting_holders(self, locks):
+            return holders_seq.pop(0) if holders_seq else []
+
+        def attempt(self, index, stmt):
+            self.executed.append(stmt)
+            return None
+
+        def start(self):
+            self.starts += 1
+    executor = Executor(None, deadline=deadline)
+    executor.dbconn = Namespace(conn=FakeConnection())
+    executor.executed = []
+    executor.starts = 0
+    clock = Clock()
+    executor.clock = lambda: clock.now
+    executor.sleep = clock.sleep
+    return (executor, clock)
+
+
+HOLDER = {'table': 't1', 'pid': 42, 'mode': 'AccessShareLock',
+          'granted': True, 'xact_age': 300.0}
+
+
+def test_lock_aware_backoff():
+    "Retry with exponential backoff while conflicting locks are held"
+    (executor, clock) = lock_aware([[HOLDER], [HOLDER], [HOLDER]])
+    executor.run(["ALTER TABLE t1 ALTER COLUMN c2 TYPE bigint"])
+    assert clock.sleeps == [0.5, 1.0, 2.0]
+    assert executor.waits[0][2:] == (3.5, 4)
+    assert executor.dbconn.conn.rollbacks == 0
+
+
+def test_lock_aware_no_locks():
+    "Statements without table locks are not checked"
+    (executor, clock) = lock_aware([[HOLDER]])
+    executor.run(["CREATE SCHEMA s1"])
+    assert clock.sleeps == []
+    assert executor.waits == []
+
+
+def test_lock_aware_deadline():
+    "Give up when the deadline would be exceeded"
+    (executor, clock) = lock_aware([[HOLDER]] * 10, deadline=5)
+    with pytest.raises(StatementError) as exc:
+        executor.run(["CREATE SCHEMA s%d" % i for i in range(6)] +
+                     ["ALTER TABLE t1 DROP COLUMN c2"])
+    assert clock.sleeps == [0.5, 1.0, 2.0]
+    assert "Statement 7 failed" in str(exc.value)
+    assert "pid 42 holds AccessShareLock on t1" in str(exc.value)
+
+
+def test_lock_aware_restart():
+    "Roll back locks taken by earlier statements before waiting"
+    stmts = ["ALTER TABLE t1 ADD COLUMN c3 integer",
+             "ALTER TABLE t2 DROP COLUMN c2"]
+    (executor, clock) = lock_aware([[], [dict(HOLDER, table='t2')]])
+    executor.run(stmts)
+    assert executor.dbconn.conn.rollbacks == 1
+    assert executor.starts == 2
+    assert executor.executed == [stmts[0], stmts[0], stmts[1]]
+    assert clock.sleeps == [0.5]
+    assert executor.waits[0][:2] == (2, stmts[1])
+
+
+class TestLockAwareExecutor(RelationTestCase):
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.pgdb.execute("DROP TABLE IF EXISTS t1")
+        self.pgdb.execute_commit("CREATE TABLE t1 (c1 integer)")
+
+    def test_lock_aware_own_lock(self):
+        "Ignore sessions waiting for a lock held by the executor"
+        executor = LockAwareExecutor(self.db)
+        executor.run(["ALTER TABLE t1 ADD COLUMN c2 integer"])
+        other = PostgresDb(TEST_DBNAME, TEST_USER, TEST_HOST, TEST_PORT)
+        other.connect()
+        writer = threading.Thread(target=other.execute_commit,
+                                  args=("INSERT INTO t1 VALUES (1, 2)", ))
+        writer.start()
+        try:
+            for i in range(100):
+                row = self.pgdb.fetchone(
+                    "SELECT count(*) FROM pg_locks WHERE NOT granted "
+                    "AND relation = 't1'::regclass")
+                self.pgdb.conn.rollback()
+                if row[0]:
+                    break
+                time.sleep(0.05)
+            assert row[0] == 1
+            assert executor.conflicting_holders([('t1', 'SHARE')]) == []
+            executor.execute_one(2, "CREATE INDEX t1_c2_idx ON t1 (c2)")
+            assert executor.waits == []
+        finally:
+            self.db.rollback()
+            writer.join()
+            other.close()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Test compressed data files"""
+
+import gzip
+
+import pytest
+
+from pyrseas.lib.compress import codec_suffix, decompress_command, open_file
+from pyrseas.dbobject.table import Table
+from pyrseas.plan import stmt_text
+
+DATA = "1,abc\n2,\"d,e\"\n"
+
+
+def test_codec_suffix():
+    "Map codecs to file suffixes"
+    assert codec_suffix(None) == ''
+    assert codec_suffix('gzip') == '.gz'
+    assert codec_suffix('zstd') == '.zst'
+    with pytest.raises(ValueError):
+        codec_suffix('lzma')
+
+
+def test_gzip_roundtrip(tmpdir):
+    "Write and read a gzip compressed file"
+    path = str(tmpdir.join('table.t1.data.gz'))
+    with open_file(path, 'w') as f:
+        f.write(DATA)
+    with gzip.open(path, 'rb') as f:
+        assert f.read().decode('utf-8') == DATA
+    with open_file(path, 'r') as f:
+        assert f.read() == DATA
+    assert decompress_command(path) == 'gzip -dc'
+
+
+def test_zstd_roundtrip(tmpdir):
+    "Write and read a zstd compressed file"
+    pytest.importorskip('zstandard')
+    path = str(tmpdir.join('table.t1.data.zst'))
+    with open_file(path, 'w') as f:
+        f.write(DATA)
+    with open_file(path, 'r') as f:
+        assert f.read() == DATA
+
+
+def test_uncompressed(tmpdir):
+    "Files without a codec suffix are not compressed"
+    path = str(tmpdir.join('table.t1.data'))
+    with open_file(path, 'w') as f:
+        f.write(DATA)
+    assert tmpdir.join('table.t1.data').read() == DATA
+    assert decompress_command(path) is None
+
+
+def test_import_compressed():
+    "Import a compressed file using a decompression program"
+    table = Table(schema='public', name='t1')
+    table.copy_options = {'compression': 'gzip'}
+    stmts = table.data_import('/tmp/schema.public')
+    assert stmts[1] == ("\\copy ", 't1', " from program 'gzip -dc ",
+                        '/tmp/schema.public/table.t1.data.gz', "' csv")
+
+
+def test_import_compressed_quoted():
+    "Quote the path of a compressed file for the shell and for psql"
+    table = Table(schema='public', name='t1')
+    table.copy_options = {'compression': 'gzip'}
+    stmts = table.data_import("/tmp/O'Neil data")
+    assert stmts[1][3] == "/tmp/O'Neil data/table.t1.data.gz"
+    assert stmt_text(stmts[1]) == "\\copy t1 from program 'gzip -dc " \
+        "''/tmp/O''\"''\"''Neil data/table.t1.data.gz''' csv"
+    table.copy_options = {}
+    assert stmt_text(table.data_import("/tmp/O'Neil")[1]) == \
+        "\\copy t1 from '/tmp/O''Neil/table.t1.data' csv"
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""Test copying of table data to and from files"""
+
+import pytest
+
+from pyrseas.datacopy import export_order, export_report, export_work
+from pyrseas.datacopy import bulk_load_phases, check_import_modes
+from pyrseas.datacopy import merge_results
+from pyrseas.datacopy import range_hash_query, sync_statements
+from pyrseas.datacopy import load_order, sample_queries
+from pyrseas.dbobject.column import Column
+from pyrseas.dbobject.constraint import ForeignKey, PrimaryKey
+from pyrseas.dbobject.index import Index
+from pyrseas.dbobject.table import Table
+from pyrseas.dbobject.trigger import Trigger
+from pyrseas.lib.compress import file_md5
+
+
+def test_export_order():
+    "Export the biggest tables first"
+    tables = [(Table(schema='public', name=name), '/tmp')
+              for name in ['t1', 't2', 't3']]
+    sizes = {('public', 't1'): {'heap_bytes': 8192},
+             ('public', 't2'): {'heap_bytes': 81920}}
+    assert [tbl.name for (tbl, dir) in export_order(tables, sizes)] == [
+        't2', 't1', 't3']
+
+
+def test_export_report():
+    "Report rows, bytes and throughput per table"
+    report = export_report([
+        {'table': 't2', 'rows': 5000, 'bytes': 4 * 1024 * 1024,
+         'seconds': 2.0},
+        {'table': 't1', 'rows': 3, 'bytes': 18, 'seconds': 0.0}]).split('\n')
+    assert report == ["t2: 5000 rows, 4.0 MB in 2.0 s (2.0 MB/s)",
+                      "t1: 3 rows, 18 bytes in 0.0 s (0 bytes/s)",
+                      "Tables: 2, rows: 5003, size: 4.0 MB"]
+
+
+def chunked_table():
+    "Return a table with a two-column primary key, exported in chunks"
+    table = Table(schema='public', name='t1')
+    table.columns = [Column(schema='public', table='t1', name=name,
+                            type=type_, number=i + 1)
+                     for (i, (name, type_)) in enumerate([
+                         ('c1', 'integer'), ('C2', 'text'), ('c3', 'date')])]
+    table.primary_key = PrimaryKey(schema='public', table='t1',
+                                   name='t1_pkey', keycols=[1, 2])
+    table.primary_key.col_idx = [1, 2]
+    table.copy_options = {'chunks': 3}
+    return table
+
+
+def test_chunk_where():
+    "Restrict a chunk to a primary key range"
+    table = chunked_table()
+    assert table._chunk_where({'lower': None, 'upper': ['10', "O'x"]}) == \
+        " WHERE (c1, \"C2\") < ('10'::integer, 'O''x'::text)"
+    assert table._chunk_where({'lower': ['10', 'a'], 'upper': None}) == \
+        " WHERE (c1, \"C2\") >= ('10'::integer, 'a'::text)"
+    assert table._chunk_where({'lower': None, 'upper': None}) == ""
+
+
+class FakeDbConnection(object):
+    "A connection returning canned rows and recording the queries"
+
+    def __init__(self, version, reltuples, rows):
+        self.version = version
+        self.reltuples = reltuples
+        self.rows = rows
+        self.queries = []
+
+    def fetchone(self, query, args=None):
+        return [self.reltuples]
+
+    def fetchall(self, query, args=None):
+        self.queries.append(query)
+        return self.rows
+
+
+def test_data_chunks():
+    "Take the chunk bounds from a sample of the primary key values"
+    table = chunked_table()
+    rows = [(str(i), 'a') for i in range(9)]
+    dbconn = FakeDbConnection(90500, 1000000, rows)
+    chunks = table.data_chunks(dbconn, 3)
+    assert [(chunk['lower'], chunk['upper']) for chunk in chunks] == [
+        (None, ['3', 'a']), (['3', 'a'], ['6', 'a']), (['6', 'a'], None)]
+    assert " TABLESAMPLE SYSTEM (0.300000) " in dbconn.queries[0]
+
+
+def test_data_chunks_pre95():
+    "Read all the primary key values on servers without TABLESAMPLE"
+    table = chunked_table()
+    dbconn = FakeDbConnection(90400, 1000000, [('1', 'a')])
+    table.data_chunks(dbconn, 3)
+    assert dbconn.queries[0] == "SELECT c1::text, \"C2\"::text FROM t1 " \
+        "ORDER BY c1, \"C2\""
+
+
+def test_export_work_resume(tmpdir):
+    "Export only the chunks not completed by an interrupted export"
+    table = chunked_table()
+    dirpath = str(tmpdir)
+    chunks = [{'file': 'table.t1.%03d.data' % i, 'lower': None,
+               'upper': None, 'done': i == 0} for i in range(3)]
+    tmpdir.join('table.t1.000.data').write('1,a,2017-01-01\n')
+    table.write_manifest(dirpath, {
+        'table': 't1', 'nchunks': 3, 'columns': ['c1', '"C2"'],
+        'complete': False, 'chunks': chunks})
+    work = export_work(None, [(table, dirpath)])
+    assert [chunk['file'] for (tbl, dir, chunk, manifest) in work] == [
+        'table.t1.001.data', 'table.t1.002.data']
+
+
+def test_data_files(tmpdir):
+    "Import the chunk files listed in a complete manifest"
+    table = chunked_table()
+    dirpath = str(tmpdir)
+    table.write_manifest(dirpath, {
+        'table': 't1', 'nchunks': 2, 'columns': ['c1', '"C2"'],
+        'complete': True, 'chunks': [
+            {'file': 'table.t1.000.data', 'done': True},
+            {'file': 'table.t1.001.data', 'done': True}]})
+    assert table.data_files(dirpath) == [
+        str(tmpdir.join('table.t1.000.data')),
+        str(tmpdir.join('table.t1.001.data'))]
+
+
+def test_merge_results():
+    "Combine the results of the chunks of a table"
+    assert merge_results([
+        {'table': 't1', 'rows': 10, 'bytes': 100, 'seconds': 1.0},
+        {'table': 't2', 'rows': 5, 'bytes': 50, 'seconds': 0.5},
+        {'table': 't1', 'rows': 20, 'bytes': 200, 'seconds': 2.0}]) == [
+        {'table': 't1', 'rows': 30, 'bytes': 300, 'seconds': 3.0},
+        {'table': 't2', 'rows': 5, 'bytes': 50, 'seconds': 0.5}]
+
+
+def binary_table():
+    "Return a table exported in binary format"
+    table = chunked_table()
+    table.copy_options = {'format': 'binary'}
+    return table
+
+
+def test_data_files_checksum(tmpdir):
+    "Reject a data file that does not match its checksum"
+    table = binary_table()
+    dirpath = str(tmpdir)
+    tmpdir.join('table.t1.data').write('PGCOPY')
+    table.write_manifest(dirpath, {
+        'table': 't1', 'nchunks': 1, 'columns': [], 'format': 'binary',
+        'server_version': 100005, 'complete': True, 'chunks': [
+            {'file': 'table.t1.data', 'done': True, 'rows': 2,
+             'md5': file_md5(str(tmpdir.join('table.t1.data')))}]})
+    assert table.data_files(dirpath) == [str(tmpdir.join('table.t1.data'))]
+    tmpdir.join('table.t1.data').write('PGCOPY!')
+    with pytest.raises(ValueError):
+        table.data_files(dirpath)
+
+
+def test_data_import_binary(tmpdir):
+    "Check the server version and row count around a binary import"
+    table = binary_table()
+    dirpath = str(tmpdir)
+    tmpdir.join('table.t1.data').write('PGCOPY')
+    table.write_manifest(dirpath, {
+        'table': 't1', 'nchunks': 1, 'columns': [], 'format': 'binary',
+        'server_version': 100005, 'complete': True, 'chunks': [
+            {'file': 'table.t1.data', 'done': True, 'rows': 2}]})
+    stmts = table.data_import(dirpath)
+    assert "server_version_num')::integer / 10000 <> 10 " in stmts[0]
+    assert stmts[1] == "TRUNCATE ONLY t1"
+    assert stmts[2] == ("\\copy ", 't1', " from '",
+                        str(tmpdir.join('table.t1.data')), "' binary")
+    assert "(SELECT count(*) FROM t1) <> 2 " in stmts[3]
+
+
+def test_bulk_load_phases(tmpdir):
+    "Drop and rebuild indexes, foreign keys and triggers around a load"
+    table = chunked_table()
+    table.copy_options = {}
+    table.indexes = {'t1_c3_idx': Index(schema='public', name='t1_c3_idx',
+                                        table='t1', keys=['c3'])}
+    table.triggers = {'t1_trg': Trigger(schema='public', name='t1_trg',
+                                        table='t1')}
+    table2 = Table(schema='public', name='t2')
+    fkey = ForeignKey(schema='public', table='t2', name='t2_c1_fkey',
+                      ref_cols=['c1', '"C2"'])
+    fkey.col_names = ['c1', 'c2']
+    fkey._table = table2
+    fkey.references = table
+    table2.foreign_keys = {'t2_c1_fkey': fkey}
+    phases = dict(bulk_load_phases([(table, str(tmpdir))], [table, table2]))
+    assert phases['prepare'] == [('prepare', [
+        "ALTER TABLE t2 DROP CONSTRAINT t2_c1_fkey",
+        "DROP INDEX t1_c3_idx",
+        "ALTER TABLE t1 DISABLE TRIGGER t1_trg"])]
+    assert phases['load'] == [('t1', [
+        "TRUNCATE ONLY t1",
+        ("\\copy ", 't1', " from '", str(tmpdir.join('table.t1.data')),
+         "' csv")])]
+    assert phases['index'] == [('t1_c3_idx', [
+        "CREATE INDEX t1_c3_idx ON t1 (c3)"])]
+    assert phases['constrain'] == [('constrain', [
+        "ALTER TABLE t2 ADD CONSTRAINT t2_c1_fkey FOREIGN KEY (c1, c2) "
+        "REFERENCES t1 (c1, \"C2\") NOT VALID",
+        "ALTER TABLE t1 ENABLE TRIGGER t1_trg"])]
+    assert phases['validate'] == [('t2_c1_fkey', [
+        "ALTER TABLE t2 VALIDATE CONSTRAINT t2_c1_fkey"])]
+
+
+def test_range_hash_query():
+    "Hash the rows of a primary key range in key order"
+    table = chunked_table()
+    where = table._chunk_where({'lower': ['10', 'a'], 'upper': None})
+    assert range_hash_query('t1', table, where) == (
+        "SELECT count(*), md5(string_agg(md5(_sync_r::text), '' "
+        "ORDER BY c1, \"C2\")) FROM t1 _sync_r WHERE (c1, \"C2\") >= "
+        "('10'::integer, 'a'::text)")
+
+
+def test_sync_statements():
+    "Delete missing rows and upsert the rows that differ"
+    table = chunked_table()
+    (delete, upsert) = sync_statements(table, "")
+    assert delete == (
+        "DELETE FROM t1 _sync_t WHERE NOT EXISTS (SELECT 1 FROM "
+        "pyrseas_sync _sync_s WHERE (_sync_s.c1, _sync_s.\"C2\") = "
+        "(_sync_t.c1, _sync_t.\"C2\"))")
+    assert upsert == (
+        "INSERT INTO t1 AS _sync_t SELECT * FROM pyrseas_sync "
+        "ON CONFLICT (c1, \"C2\") DO UPDATE SET c3 = EXCLUDED.c3 "
+        "WHERE ROW(_sync_t.*) IS DISTINCT FROM ROW(EXCLUDED.*)")
+
+
+def test_data_import_merge(tmpdir):
+    "Merge the data through a staging table instead of truncating"
+    table = chunked_table()
+    table.copy_options = {'import': 'merge'}
+    stmts = table.data_import(str(tmpdir))
+    assert stmts[0] == "CREATE UNLOGGED TABLE t1_pyrseas_stage (LIKE t1, " \
+        "_pyrseas_row bigserial)"
+    assert stmts[1] == ("\\copy ", 't1_pyrseas_stage (c1, "C2", c3)',
+                        " from '", str(tmpdir.join('table.t1.data')), "' csv")
+    assert stmts[2] == "CREATE INDEX ON t1_pyrseas_stage (_pyrseas_row)"
+    assert "ON CONFLICT (c1, \"C2\") DO UPDATE SET c3 = EXCLUDED.c3 " \
+        "WHERE ROW(_pyrseas_t.*) IS DISTINCT FROM ROW(EXCLUDED.*);" \
+        in stmts[3]
+    assert "DELETE FROM t1 _pyrseas_t USING _pyrseas_gone _pyrseas_g " \
+        "WHERE (_pyrseas_t.c1, _pyrseas_t.\"C2\") = (_pyrseas_g.c1, " \
+        "_pyrseas_g.\"C2\")" in stmts[3]
+    assert stmts[4] == "DROP TABLE t1_pyrseas_stage"
+    assert not any(stmt.startswith("TRUNCATE") for stmt in stmts
+                   if not isinstance(stmt, tuple))
+
+
+def test_check_import_modes():
+    "Reject the merge import mode on servers before PostgreSQL 9.5"
+    table = chunked_table()
+    table.copy_options = {'import': 'merge'}
+    check_import_modes([(table, '/tmp')], 90500)
+    with pytest.raises(ValueError):
+        check_import_modes([(table, '/tmp')], 90400)
+    table.copy_options = {}
+    check_import_modes([(table, '/tmp')], 90400)
+
+
+def parent_child():
+    "Return a sampled table and a table referencing it"
+    parent = chunked_table()
+    parent.copy_options = {'tablesample': 5}
+    child = Table(schema='s1', name='t2')
+    child.columns = [Column(schema='s1', table='t2', name=name,
+                            type=type_, number=i + 1)
+                     for (i, (name, type_)) in enumerate([
+                         ('id', 'integer'), ('p1', 'integer'),
+                         ('p2', 'text')])]
+    fkey = ForeignKey(schema='s1', table='t2', name='t2_p1_fkey',
+                      col_idx=[2, 3], ref_cols=[1, 2])
+    fkey._table = child
+    fkey.references = parent
+    child.foreign_keys = {'t2_p1_fkey': fkey}
+    child.copy_options = {'where': "id < 100", 'limit': 10, 'closure': True}
+    child.primary_key = PrimaryKey(schema='s1', table='t2', name='t2_pkey',
+                                   keycols=[1])
+    child.primary_key.col_idx = [1]
+    return (parent, child)
+
+
+def test_sample_queries():
+    "Add the rows referenced by a sampled table to the referenced table"
+    (parent, child) = parent_child()
+    queries = sample_queries([(parent, '/tmp'), (child, '/tmp')])
+    assert queries['s1.t2'] == "SELECT * FROM s1.t2 WHERE id < 100 " \
+        "ORDER BY id LIMIT 10"
+    assert queries['t1'] == (
+        "SELECT * FROM t1 WHERE (c1, \"C2\") IN (SELECT c1, \"C2\" FROM "
+        "(SELECT * FROM t1 TABLESAMPLE SYSTEM (5.0) REPEATABLE (0)) _base)"
+        " OR (c1, \"C2\") IN (SELECT p1, p2 FROM (SELECT * FROM s1.t2 "
+        "WHERE id < 100 ORDER BY id LIMIT 10) _child)")
+    child.copy_options = {'closure': True}
+    assert sample_queries([(parent, '/tmp'), (child, '/tmp')])['t1'] \
+        .endswith(" OR (c1, \"C2\") IN (SELECT p1, p2 FROM s1.t2)")
+    with pytest.raises(ValueError):
+        sample_queries([(child, '/tmp')])
+
+
+def test_sample_queries_pre95():
+    "Reject tablesample on servers before PostgreSQL 9.5"
+    (parent, child) = parent_child()
+    with pytest.raises(ValueError):
+        sample_queries([(parent, '/tmp')], 90400)
+    child.copy_options = {'where': "id < 100"}
+    assert sample_queries([(child, '/tmp')], 90400)['s1.t2'] == \
+        "SELECT * FROM s1.t2 WHERE id < 100"
+
+
+def test_load_order():
+    "Load referenced tables first"
+    (parent, child) = parent_child()
+    assert [tbl.name for (tbl, dir) in load_order(
+        [(child, '/tmp'), (parent, '/tmp')])] == ['t1', 't2']
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Test database connection helpers"""
+
+import pytest
+
+from pyrseas.lib.dbconn import prepared_text
+
+
+def test_prepared_text_named():
+    "Convert named placeholders to numbered parameters"
+    assert prepared_text(
+        "UPDATE t SET c = %(c)s WHERE id = %(_kv_id)s AND c <> %(c)s") == (
+        "UPDATE t SET c = $1 WHERE id = $2 AND c <> $1", ['c', '_kv_id'])
+
+
+def test_prepared_text_positional():
+    "Convert positional placeholders and escaped percent signs"
+    assert prepared_text("SELECT %s, %s LIKE 'a%%'") == (
+        "SELECT $1, $2 LIKE 'a%'", 2)
+    assert prepared_text("SELECT 1") == ("SELECT 1", 0)
+
+
+def test_prepared_text_mixed():
+    "Reject a mix of named and positional placeholders"
+    with pytest.raises(ValueError):
+        prepared_text("SELECT %(a)s, %s")
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Test connection pools"""
+
+import threading
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extensions import TRANSACTION_STATUS_INTRANS
+from psycopg2.pool import PoolError
+
+from pyrseas.lib.dbconn import DbConnection
+from pyrseas.lib.dbpool import ConnectionPool, ThreadLocalConnection
+
+
+class FakeConn(object):
+    "Enough of a psycopg2 connection for the pool"
+
+    def __init__(self):
+        self.closed = False
+        self.status = TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def close(self):
+        self.closed = True
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = TRANSACTION_STATUS_IDLE
+        self.rollbacks += 1
+
+
+class FakeDbConnection(DbConnection):
+    "A DbConnection that does not connect to a server"
+
+    def connect(self):
+        self.conn = FakeConn()
+
+
+def test_pool_checkout():
+    "Check out and return connections"
+    pool = ConnectionPool(FakeDbConnection('db'), minconn=1, maxconn=2)
+    assert pool.size == 1
+    conn1 = pool.getconn()
+    conn2 = pool.getconn()
+    assert conn1 is not conn2
+    assert pool.size == 2
+    with pytest.raises(PoolError):
+        pool.getconn(timeout=0)
+    pool.putconn(conn1)
+    pool.putconn(conn2)
+    assert pool.size == 1
+    assert conn2.conn is None
+    assert pool.getconn() is conn1
+
+
+def test_pool_context_manager():
+    "Roll back transactions left open by a with block"
+    pool = ConnectionPool(FakeDbConnection('db'), minconn=1, maxconn=1)
+    with pool.connection() as conn:
+        conn.conn.status = TRANSACTION_STATUS_INTRANS
+    assert conn.conn.rollbacks == 1
+    conn.conn.close()
+    with pool.connection() as conn2:
+        assert conn2 is conn
+        assert not conn2.conn.closed
+
+
+def test_pool_thread_connection():
+    "Use a connection per thread"
+    pool = ConnectionPool(FakeDbConnection('db'), minconn=0, maxconn=2)
+    dbconn = ThreadLocalConnection(pool)
+    conns = []
+
+    def worker():
+        conns.append(dbconn.conn)
+        pool.release_thread()
+
+    assert dbconn.conn is dbconn.conn
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert conns[0] is not dbconn.conn
+    pool.release_thread()
+    pool.closeall()
+    assert pool.size == 0
+    with pytest.raises(PoolError):
+        pool.getconn()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Test analysis of generated SQL statements"""
+
+from pyrseas.plan import StatementInfo, split_clauses, estimate_report
+from pyrseas.plan import coalesce_alters
+
+
+def test_split_clauses():
+    "Split ALTER TABLE subcommands at top-level commas only"
+    assert split_clauses("ADD COLUMN c1 numeric(10, 2), DROP COLUMN c2") == [
+        "ADD COLUMN c1 numeric(10, 2)", "DROP COLUMN c2"]
+    assert split_clauses("ALTER COLUMN c1 SET DEFAULT 'a,b'") == [
+        "ALTER COLUMN c1 SET DEFAULT 'a,b'"]
+
+
+def test_alter_column_type():
+    "Changing a column's type rewrites the table"
+    info = StatementInfo("ALTER TABLE t1\n    ALTER COLUMN c2 TYPE bigint")
+    assert info.table == 't1'
+    assert info.lock == 'ACCESS EXCLUSIVE'
+    assert info.effect == 'rewrite'
+
+
+def test_set_not_null():
+    "Setting NOT NULL scans the table"
+    info = StatementInfo("ALTER TABLE s1.t1\n    ALTER COLUMN c2 SET NOT NULL")
+    assert info.table == 's1.t1'
+    assert info.lock == 'ACCESS EXCLUSIVE'
+    assert info.effect == 'scan'
+
+
+def test_column_named_type():
+    "A column named 'type' is not mistaken for a type change"
+    info = StatementInfo("ALTER TABLE t1 ALTER COLUMN type DROP NOT NULL")
+    assert info.effect is None
+
+
+def test_add_column_default():
+    "Adding a column with a DEFAULT rewrites the table before 11"
+    stmt = "ALTER TABLE t1\n    ADD COLUMN c3 integer DEFAULT 0"
+    assert StatementInfo(stmt, 90400).effect == 'rewrite'
+    assert StatementInfo(stmt, 110000).effect is None
+    assert StatementInfo("ALTER TABLE t1 ADD COLUMN c3 integer").effect \
+        is None
+
+
+def test_add_foreign_key():
+    "Adding a foreign key locks both tables and scans the referrer"
+    info = StatementInfo("ALTER TABLE t2 ADD CONSTRAINT t2_c1_fkey "
+                         "FOREIGN KEY (c1) REFERENCES s1.t1 (c1)")
+    assert info.locks == [('t2', 'SHARE ROW EXCLUSIVE'),
+                          ('s1.t1', 'SHARE ROW EXCLUSIVE')]
+    assert info.effect == 'scan'
+
+
+def test_add_foreign_key_not_valid():
+    "Adding a NOT VALID foreign key does not scan"
+    info = StatementInfo("ALTER TABLE t2 ADD CONSTRAINT t2_c1_fkey "
+                         "FOREIGN KEY (c1) REFERENCES t1 (c1) NOT VALID")
+    assert info.effect is None
+
+
+def test_add_check_constraint():
+    "Adding a CHECK constraint scans the table"
+    info = StatementInfo("ALTER TABLE t1 ADD CONSTRAINT t1_c1_check "
+                         "CHECK (c1 > 0)")
+    assert info.lock == 'ACCESS EXCLUSIVE'
+    assert info.effect == 'scan'
+
+
+def test_multiple_subcommands():
+    "The strongest lock and costliest effect prevail"
+    info = StatementInfo("ALTER TABLE t1 ALTER COLUMN c1 SET STATISTICS 100, "
+                         "ALTER COLUMN c2 TYPE text")
+    assert info.lock == 'ACCESS EXCLUSIVE'
+    assert info.effect == 'rewrite'
+
+
+def test_create_index():
+    "Creating an index takes a SHARE lock and scans the table"
+    info = StatementInfo('CREATE INDEX t1_idx ON "My Table" (c1)')
+    assert info.table == '"My Table"'
+    assert info.lock == 'SHARE'
+    assert info.effect == 'scan'
+
+
+def test_copy_tuple():
+    "A \\copy tuple loads the table"
+    info = StatementInfo(("\\copy ", 't1', " from '", '/tmp/t1.data',
+                          "' csv"))
+    assert info.table == 't1'
+    assert info.lock == 'ROW EXCLUSIVE'
+    assert info.effect == 'load'
+
+
+def test_no_lock():
+    "Statements not affecting existing tables take no table lock"
+    info = StatementInfo("CREATE SCHEMA s1")
+    assert info.lock is None
+    assert info.effect is None
+
+
+def test_estimate_report():
+    "Format estimates as text"
+    report = estimate_report([
+        {'statement': "ALTER TABLE t1 ALTER COLUMN c2 TYPE bigint",
+         'lock': 'ACCESS EXCLUSIVE', 'effect': 'rewrite', 'table': 't1',
+         'locked_tables': ['t1'], 'rows': 1000, 'bytes': 2 * 1024 * 1024,
+         'seconds': 1.5},
+        {'statement': "CREATE SCHEMA s1", 'lock': None, 'effect': None,
+         'table': None, 'locked_tables': [], 'rows': None, 'bytes': None,
+         'seconds': 0.0}]).split('\n')
+    assert report[1] == "   lock: ACCESS EXCLUSIVE on t1; rewrite; " \
+        "rows: 1000; size: 2.0 MB; estimate: 1.5 s"
+    assert report[3] == "   lock: none"
+    assert report[-1] == "Statements: 2, rewrites: 1, scans: 0, " \
+        "estimated time: 1.5 s"
+
+
+def test_coalesce_same_table():
+    "Merge consecutive ALTER TABLE statements on the same table"
+    stmts = coalesce_alters([
+        "ALTER TABLE t1\n    ADD COLUMN c3 integer",
+        "COMMENT ON COLUMN t1.c3 IS 'new column'",
+        "ALTER TABLE t1\n    ALTER COLUMN c2 TYPE bigint",
+        "ALTER TABLE t1 ADD CONSTRAINT t1_c3_check CHECK (c3 > 0)"])
+    assert stmts == [
+        "ALTER TABLE t1\n    ADD COLUMN c3 integer,\n"
+        "    ALTER COLUMN c2 TYPE bigint,\n"
+        "    ADD CONSTRAINT t1_c3_check CHECK (c3 > 0)",
+        "COMMENT ON COLUMN t1.c3 IS 'new column'"]
+
+
+def test_coalesce_other_tables():
+    "Merge across ALTER TABLE statements on unrelated tables"
+    stmts = coalesce_alters([
+        "ALTER TABLE t1 ALTER COLUMN c2 TYPE bigint",
+        "ALTER TABLE t2 ALTER COLUMN c2 TYPE bigint",
+        "ALTER TABLE t1 ALTER COLUMN c3 SET NOT NULL"])
+    assert stmts == [
+        "ALTER TABLE t1\n    ALTER COLUMN c2 TYPE bigint,\n"
+        "    ALTER COLUMN c3 SET NOT NULL",
+        "ALTER TABLE t2 ALTER COLUMN c2 TYPE bigint"]
+
+
+def test_coalesce_referenced_table():
+    "Do not move a foreign key ahead of changes to the referenced table"
+    stmts = ["ALTER TABLE t1 ALTER COLUMN c2 TYPE bigint",
+             "ALTER TABLE t2 ADD CONSTRAINT t2_pkey PRIMARY KEY (c1)",
+             "ALTER TABLE t1 ADD CONSTRAINT t1_c3_fkey FOREIGN KEY (c3) "
+             "REFERENCES t2 (c1)"]
+    assert coalesce_alters(stmts) == stmts
+
+
+def test_coalesce_barrier():
+    "Do not merge across statements other than COMMENT/GRANT/REVOKE"
+    stmts = ["ALTER TABLE t1 ADD COLUMN c3 integer",
+             "CREATE INDEX t1_idx ON t1 (c3)",
+             "ALTER TABLE t1 ALTER COLUMN c2 TYPE bigint"]
+    assert coalesce_alters(stmts) == stmts
+
+
+def test_coalesce_same_column():
+    "Do not merge subcommands that depend on each other"
+    stmts = ["ALTER TABLE t1 ADD COLUMN c3 integer",
+             "ALTER TABLE t1 ALTER COLUMN c3 TYPE bigint",
+             "ALTER TABLE t1 ALTER COLUMN c3 TYPE text"]
+    assert coalesce_alters(stmts) == stmts
+
+
+def test_coalesce_rename():
+    "Do not merge RENAME"
+    stmts = ["ALTER TABLE t1 ALTER COLUMN c2 TYPE bigint",
+             "ALTER TABLE t1 RENAME COLUMN c3 TO c4",
+             "ALTER TABLE t1 ALTER COLUMN c4 SET NOT NULL"]
+    assert coalesce_alters(stmts) == stmts
+
+
+def test_copy_tuple_columns():
+    "A \\copy tuple with a column list loads the table"
+    info = StatementInfo(("\\copy ", 't1_stage (c1, c2)', " from '",
+                          '/tmp/t1.data', "' csv"))
+    assert info.table == 't1_stage'
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Test caching of generated SQL statements"""
+
+from argparse import Namespace
+
+from pyrseas.plancache import PlanCache, fingerprint_queries, plan_key
+
+INMAP = {'schema public': {'table t1': {'columns': [{'c1': {
+    'type': 'integer'}}]}}}
+STMTS = ["CREATE TABLE t1 (\n    c1 integer)",
+         "TRUNCATE ONLY t1",
+         ("\\copy ", 't1', " from '", '/tmp/schema.public/table.t1.data',
+          "' csv")]
+
+
+def config(**opts):
+    "Return a minimal configuration"
+    return {'database': {'dbname': 'db1'}, 'files': {'data_path': '/tmp'},
+            'options': Namespace(schemas=[], revert=False,
+                                 quote_reserved=False, **opts)}
+
+
+def test_plan_key():
+    "The key depends on the input, the catalogs and relevant options"
+    key = plan_key(INMAP, config(), 'fp1')
+    assert key == plan_key(INMAP, config(update=True), 'fp1')
+    assert key != plan_key(INMAP, config(), 'fp2')
+    assert key != plan_key({}, config(), 'fp1')
+    cfg = config()
+    cfg['options'].revert = True
+    assert key != plan_key(INMAP, cfg, 'fp1')
+    cfg = config()
+    cfg['datacopy'] = {'schema public': ['t1']}
+    assert key != plan_key(INMAP, cfg, 'fp1')
+
+
+def test_plan_key_other_db():
+    "The key does not depend on the database connection"
+    cfg = config()
+    cfg['database'] = {'dbname': 'db2', 'host': 'shard2'}
+    assert plan_key(INMAP, config(), 'fp1') == plan_key(INMAP, cfg, 'fp1')
+
+
+def test_cache_roundtrip(tmpdir):
+    "Store and retrieve a plan, including \\copy statements"
+    cache = PlanCache(str(tmpdir.join('plans')))
+    key = plan_key(INMAP, config(), 'fp1')
+    assert cache.get(key) is None
+    cache.put(key, STMTS, 'fp1', 'db1')
+    plan = cache.get(key)
+    assert plan['statements'] == STMTS
+    assert plan['fingerprint'] == 'fp1'
+    assert plan['database'] == 'db1'
+    assert tmpdir.join('plans').listdir() == [tmpdir.join('plans', key +
+                                                          '.json')]
+
+
+def test_cache_corrupt(tmpdir):
+    "Ignore unreadable cache files"
+    cache = PlanCache(str(tmpdir))
+    tmpdir.join('abc.json').write('{"format": 1, "key": "ab')
+    assert cache.get('abc') is None
+
+
+def test_fingerprint_queries_90():
+    "Do not use catalogs, columns or functions added in 9.1"
+    sql = "\n".join(fingerprint_queries(90000))
+    for name in ['pg_extension', 'pg_collation', 'pg_foreign_table',
+                 'concat_ws', 'relpersistence', 'enumsortorder',
+                 'fdwhandler']:
+        assert name not in sql
+    assert "array_to_string(ARRAY[('schema')::text, (n.nspname)::text" \
+        in sql
+
+
+def test_fingerprint_queries_91():
+    "Include the extensions and collations from 9.1"
+    sql = "\n".join(fingerprint_queries(90100))
+    assert "FROM pg_extension e" in sql
+    assert "FROM pg_collation c" in sql
+    assert "a.attcollation" in sql
+    assert "pg_event_trigger" not in sql
+
+
+def test_fingerprint_queries_sequences():
+    "Include the sequence parameters and owning column"
+    for version in (90000, 90400):
+        sql = [qry for qry in fingerprint_queries(version)
+               if "'sequence'" in qry][0]
+        assert "increment_by" in sql and "is_cycled" in sql
+        assert "d.deptype = 'a'" in sql
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Test progress reporting of COPY operations"""
+
+import io
+
+from pyrseas.lib.progress import CopyProgress, ProgressFile, format_seconds
+
+
+class FakeClock(object):
+    "A clock advanced by the tests"
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_format_seconds():
+    "Format durations as hours, minutes and seconds"
+    assert format_seconds(59.6) == "0:01:00"
+    assert format_seconds(3725) == "1:02:05"
+
+
+def test_progress_file_write(monkeypatch):
+    "Count rows and bytes written, reporting periodically"
+    clock = FakeClock()
+    messages = []
+    monkeypatch.setattr(CopyProgress, 'clock', clock)
+    progress = CopyProgress('t1', total_rows=8, callback=messages.append)
+    out = ProgressFile(io.StringIO(), progress)
+    out.write(u"1,a\n2,b\n")
+    assert messages == []
+    clock.now += 10
+    out.write(u"3,c\n4,d\n")
+    progress.finish(4)
+    assert out.getvalue() == u"1,a\n2,b\n3,c\n4,d\n"
+    assert messages == [
+        "t1: 4 rows, 16 bytes (0 rows/s, 1 bytes/s), 50%, ETA 0:00:10"]
+    assert progress.result() == {'table': 't1', 'rows': 4, 'bytes': 16,
+                                 'seconds': 10.0}
+
+
+def test_progress_file_read_binary():
+    "Count only bytes read from a binary file"
+    progress = CopyProgress('t1', total_bytes=12)
+    infile = ProgressFile(io.BytesIO(b"PGCOPY\n\xff\r\n\x00\n"), progress,
+                          binary=True)
+    assert infile.read(6) == b"PGCOPY"
+    assert infile.read() == b"\n\xff\r\n\x00\n"
+    assert (progress.rows, progress.bytes) == (0, 12)